@@ -1,78 +1,42 @@
 import streamlit as st
 import json
-import uuid, random, csv, os
+import logging
+import uuid, csv, os
 from datetime import datetime
 import pandas as pd
 from utils.ui_helpers import show_ab_tables, show_aspect_eval, overall_eval_ui, show_ab_tables_aspect
 from utils.load_data import load_all, load_viewpoint_descriptions, load_spot_urls
-from utils.scoring import compute_user_preference, recommend_spots
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+from utils.scoring import get_score_index
+from utils.service import get_recommender
+from utils.log_sink import get_log_sink, GoogleSheetBackend
+from utils.condition_balance import get_condition_balancer
+from utils.sheets_client import get_sheets_provider
+from utils.spot_search import get_spot_search_index
+from utils.metrics import metrics, timed, configure_from_env, profile_rerun
+from utils.log_store import get_log_store, log_store_available
+
+
+# Step 1 の観光地一覧で 1 ページに出す件数
+SPOT_PAGE_SIZE = 20
 
 
 # =====================
 # 条件割り当て（4C2 = 6通り）
 # =====================
-CONDITIONS = [
-    ("noaspect_all", "aspect_all"),
-    ("noaspect_all", "aspect_top5"),
-    ("noaspect_all", "aspect_exclude_interest_top5"),
-    ("aspect_all", "aspect_top5"),
-    ("aspect_all", "aspect_exclude_interest_top5"),
-    ("aspect_top5", "aspect_exclude_interest_top5")
-]
-
-
-def get_condition_from_log():
-    # Google Sheets 認証
-    scope = ["https://spreadsheets.google.com/feeds",
-             "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(
-        st.secrets["gcp_service_account"], scope
-    )
-    client = gspread.authorize(creds)
-
-    sheet = client.open_by_key(
-        st.secrets["gcp_service_account"]["sheet_id"]
-    ).sheet1
-
-    values = sheet.get_all_values()
+def _sheet_backend():
+    # 認証済みクライアントはプロセス内で共有（セッションごとに認証しない）
+    return GoogleSheetBackend(get_sheets_provider(st.secrets["gcp_service_account"]))
 
-    # ログが無い場合
-    if len(values) <= 1:
-        return random.choice(CONDITIONS)
 
-    header = values[0]
-    data_rows = values[1:]
+def _condition_balancer():
+    # 使用回数はメモリ上で管理し、シートとは定期的に突き合わせるだけ
+    return get_condition_balancer(_sheet_backend)
 
-    try:
-        cond_idx = header.index("condition_pair")
-    except ValueError:
-        return random.choice(CONDITIONS)
 
-    # カウント用辞書（キーは "A|B" 形式）
-    counts = {"|".join(c): 0 for c in CONDITIONS}
-
-    for row in data_rows:
-        if len(row) <= cond_idx:
-            continue
-        cond = row[cond_idx]
-        if cond in counts:
-            counts[cond] += 1
-
-    # 全部 0 の場合
-    if all(v == 0 for v in counts.values()):
-        return random.choice(CONDITIONS)
-
-    # 最小値の条件を選ぶ
-    min_count = min(counts.values())
-    candidates = [c for c, v in counts.items() if v == min_count]
-
-    # "A|B" → ("A","B") に戻す
-    chosen = random.choice(candidates)
-    condA, condB = chosen.split("|")
-
-    return (condA, condB)
+@timed("get_condition_from_log")
+def get_condition_from_log():
+    # ログに書かれたとき同じ user_id で割り当て中の分を外せるように渡す
+    return _condition_balancer().assign(st.session_state.user_id)
 
 # =====================
 # 初期化
@@ -90,48 +54,28 @@ if "mode" not in st.session_state:
 # =====================
 # ログ保存
 # =====================
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+def _on_logs_written(records):
+    # シートに書けた分を条件の使用回数に反映する
+    _condition_balancer().on_logs_written(records)
+
 
+@timed("save_log")
 def save_log(data):
-    # Google Sheets 認証
-    scope = ["https://spreadsheets.google.com/feeds",
-             "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(
-        st.secrets["gcp_service_account"], scope
+    # ローカルスプールに書いてすぐ戻る（Google Sheets へはバックグラウンドでまとめて送る）
+    sink = get_log_sink(
+        _sheet_backend,
+        on_written=_on_logs_written
     )
-    client = gspread.authorize(creds)
+    sink.submit(data)
 
-    sheet = client.open_by_key(
-        st.secrets["gcp_service_account"]["sheet_id"]
-    ).sheet1
-
-    # 既存データを取得
-    existing = sheet.get_all_values()
-
-    # ============================
-    # ★ ログがまだ無い場合（1行目が空）
-    # ============================
-    if len(existing) == 0:
-        header = list(data.keys())  # ← data のキーをそのままヘッダーにする
-        sheet.append_row(header)
-
-    else:
-        # 既存ヘッダーを取得
-        header = existing[0]
-
-        # ★ data に新しいキーが追加されていたらヘッダーに追加する
-        new_keys = [k for k in data.keys() if k not in header]
-        if new_keys:
-            header += new_keys
-            sheet.update('1:1', [header])  # 1行目を更新
-
-    # ============================
-    # ★ ヘッダー順にデータを並べる
-    # ============================
-    row = [data.get(col, "") for col in header]
-
-    sheet.append_row(row)
+    # 列指向ログ（log_store/）はシートの送信を待たずに書く
+    # 控えなので失敗しても参加者の送信は止めない（python -m utils.log_store import で取り込み直せる）
+    if log_store_available():
+        try:
+            get_log_store().append([data])
+        except Exception:
+            metrics.inc("log_store_errors")
+            logging.getLogger(__name__).exception("log_store への書き込みに失敗しました")
 
 
 # =====================
@@ -140,8 +84,6 @@ def save_log(data):
 def main():
     st.title("観光地推薦システム")
 
-    spot_url_dict = load_spot_urls()
-
     # =====================
     # Step 0: 説明・同意
     # =====================
@@ -294,33 +236,80 @@ def main():
         st.caption("東京・関西・中国地方のどの地域から選んでも構いません。")
         st.caption("全部を見る必要はありません。目についたものから直感で選んで大丈夫です。")
         
-        visited_spots = []
+        # 選んだ観光地（表示していないページの分も残るように session_state に持つ）
+        # picked_spots: スポット → 地域（選んだ順）
+        if "picked_spots" not in st.session_state:
+            st.session_state.picked_spots = {}
+        picked = st.session_state.picked_spots
+        search_index = get_spot_search_index(spot_lists)
+
+        def toggle_spot(region, spot):
+            if st.session_state[f"pick_{region}_{spot}"]:
+                picked[spot] = region
+            else:
+                picked.pop(spot, None)
+
+        def reset_page():
+            st.session_state.spot_page = 0
+
+        # --- 検索（地域 + 名前の一部） ---
+        col_region, col_query = st.columns([1, 2])
+        with col_region:
+            region_choice = st.selectbox(
+                "地域", ["すべて"] + search_index.regions, key="spot_region", on_change=reset_page
+            )
+        with col_query:
+            query = st.text_input(
+                "観光地名で絞り込み（一部でも可）", key="spot_query", on_change=reset_page
+            )
+
+        regions = None if region_choice == "すべて" else [region_choice]
+        hits = search_index.search(query, regions)
+        page_spots, n_pages = search_index.page(
+            hits, st.session_state.get("spot_page", 0), SPOT_PAGE_SIZE
+        )
+        st.session_state.spot_page = min(st.session_state.get("spot_page", 0), n_pages - 1)
+        st.caption(f"{len(hits)} 件中 {st.session_state.spot_page + 1} / {n_pages} ページ")
+
+        # --- 表示中のページだけチェックボックスを作る（横2列） ---
+        cols = st.columns(2)
+        for idx, (region, spot) in enumerate(page_spots):
+            key = f"pick_{region}_{spot}"
+            st.session_state[key] = spot in picked
+            with cols[idx % 2]:   # 偶数→左列、奇数→右列
+                st.checkbox(spot, key=key, on_change=toggle_spot, args=(region, spot))
+
+        col_prev, _, col_next = st.columns([1, 2, 1])
+        with col_prev:
+            if st.button("← 前へ", disabled=st.session_state.spot_page == 0):
+                st.session_state.spot_page -= 1
+                st.rerun()
+        with col_next:
+            if st.button("次へ →", disabled=st.session_state.spot_page >= n_pages - 1):
+                st.session_state.spot_page += 1
+                st.rerun()
+
+        # --- 選んだ観光地ごとの良かったポイント ---
+        visited_spots = list(picked)
         spot_feedback = {}
-        
-        # 地域別の観光地一覧を横2列で表示
-        for region, spots in spot_lists.items():
-            with st.expander(region):
-        
-                # 横2列レイアウト
-                cols = st.columns(2)
-        
-                for idx, spot in enumerate(spots):
-                    col = cols[idx % 2]   # 偶数→左列、奇数→右列
-        
-                    with col:
-                        checked = st.checkbox(spot, key=f"spot_{region}_{spot}")
-                        if checked:
-                            visited_spots.append(spot)
-        
-                            viewpoints = st.multiselect(
-                                f"{spot} で良かったポイント（1つ以上選択してください）",
-                                viewpoint_list,
-                                key=f"viewpoints_{spot}"
-                            )
-        
-                            spot_feedback[spot] = {
-                                "viewpoints": viewpoints
-                            }
+        if visited_spots:
+            st.markdown("#### 選んだ観光地")
+        for spot in visited_spots:
+            col_spot, col_remove = st.columns([5, 1])
+            with col_spot:
+                viewpoints = st.multiselect(
+                    f"{spot} で良かったポイント（1つ以上選択してください）",
+                    viewpoint_list,
+                    key=f"viewpoints_{spot}"
+                )
+            with col_remove:
+                if st.button("外す", key=f"remove_{spot}"):
+                    picked.pop(spot, None)
+                    st.rerun()
+
+            spot_feedback[spot] = {
+                "viewpoints": viewpoints
+            }
                 
         # 右上に選択数を表示
         col_left, col_right = st.columns([1, 1])
@@ -363,41 +352,19 @@ def main():
     
         # --- 条件ペアを取り出す ---
         condA, condB = st.session_state.condition_pair
-    
-        # --- A のユーザ嗜好を計算 ---
-        user_pref_A = compute_user_preference(
-            st.session_state.visited_spots,
-            st.session_state.spot_feedback,
-            spot_scores,
-            st.session_state.selected_viewpoints,
-            condition=condA
-        )
-    
-        # --- B のユーザ嗜好を計算 ---
-        user_pref_B = compute_user_preference(
+
+        # --- 共有のスコア索引（カタログごとに 1 回だけ構築） ---
+        score_index = get_score_index(spot_scores)
+
+        # --- A / B のユーザ嗜好と推薦 ---
+        # RECOMMENDER_URL があれば推薦サービスに、無ければプロセス内で計算（入力が同じ間はキャッシュ）
+        # MMR_LAMBDA を設定すると推薦リストを多様性を考慮して並べ替える
+        recommender = get_recommender(score_index)
+        (user_pref_A, recA, excludedA), (user_pref_B, recB, excludedB) = recommender.condition_results(
             st.session_state.visited_spots,
             st.session_state.spot_feedback,
-            spot_scores,
             st.session_state.selected_viewpoints,
-            condition=condB
-        )
-    
-        # --- A の推薦 ---
-        recA, excludedA = recommend_spots(
-            user_pref_df=user_pref_A,
-            spot_scores=spot_scores,
-            condition=condA,
-            selected_viewpoints=st.session_state.selected_viewpoints,
-            visited_spots=st.session_state.visited_spots
-        )
-    
-        # --- B の推薦 ---
-        recB, excludedB = recommend_spots(
-            user_pref_df=user_pref_B,
-            spot_scores=spot_scores,
-            condition=condB,
-            selected_viewpoints=st.session_state.selected_viewpoints,
-            visited_spots=st.session_state.visited_spots
+            conditions=[condA, condB]
         )
     
         # 保存（ログ用）
@@ -430,6 +397,8 @@ def main():
         # ここから全観光地の評価（重複は除く）
         # ============================
     
+        spot_url_dict = load_spot_urls()
+
         st.subheader("以下の観光地に行ったことがありますか？")
         st.caption("観光地名をクリックすると、その場所の特徴や口コミページが見られます。気になる観光地は、お調べいただいても構いません。")
     
@@ -438,18 +407,8 @@ def main():
         spots_B = list(dfB["スポット"])
         all_spots = list(dict.fromkeys(spots_A + spots_B))  # 重複除去＋順序保持
     
-        # --- 観点ごとに min-max 正規化 ---
-        df_norm = spot_scores.copy()
-        viewpoint_cols = [c for c in df_norm.columns if c != "スポット"]
-    
-        for col in viewpoint_cols:
-            col_values = df_norm[col].astype(float)
-            min_v = col_values.min()
-            max_v = col_values.max()
-            if max_v == min_v:
-                df_norm[col] = 0.5
-            else:
-                df_norm[col] = (col_values - min_v) / (max_v - min_v)
+        # --- 観点ごとの min-max 正規化済みスコア（索引を共有） ---
+        viewpoint_cols = score_index.viewpoint_cols
     
         # --- 評価用辞書 ---
         if "spot_questions" not in st.session_state:
@@ -462,12 +421,10 @@ def main():
             with st.expander(f"{idx}. {spot}"):
                 st.write("#### 観点スコア")
     
-                detail = (
-                    df_norm[df_norm["スポット"] == spot]
-                    .drop(columns=["スポット"])
-                    .T
+                detail = pd.DataFrame(
+                    {"スコア": score_index.norm[score_index.row(spot)]},
+                    index=viewpoint_cols
                 )
-                detail.columns = ["スコア"]
                 detail["スコア"] = detail["スコア"].round(3)
                 detail = detail.sort_values("スコア", ascending=False).head(5)
     
@@ -639,4 +596,8 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    # METRICS_FILE / METRICS_PORT で集計の書き出し、PROFILE_DIR で再実行ごとのプロファイル
+    configure_from_env()
+    step = st.session_state.step
+    with profile_rerun(label=f"step{step}"), metrics.timer("step_render", step=step):
+        main()
@@ -0,0 +1,243 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.ann import get_approx_index
+from utils.load_data import load_all, load_spot_urls
+from utils.scoring import (
+    CONDITION_NAMES,
+    ScoreIndex,
+    compute_conditions,
+    compute_user_preference,
+    minmax,
+    recommend_spots,
+)
+from utils.shards import RegionShards, recommend_in_regions
+
+
+# ============================
+# 合成カタログ（spot_scores と同じ形）
+# ============================
+def synthetic_catalog(n_spots, n_viewpoints, seed=0):
+    rng = np.random.default_rng(seed)
+    viewpoint_cols = [f"観点{j}" for j in range(n_viewpoints)]
+    df = pd.DataFrame(
+        rng.random((n_spots, n_viewpoints)),
+        columns=viewpoint_cols
+    )
+    df.insert(0, "スポット", [f"spot{i}" for i in range(n_spots)])
+    return df
+
+
+def synthetic_user(df, rng, n_visited=5):
+    viewpoint_cols = [c for c in df.columns if c != "スポット"]
+    visited = list(rng.choice(df["スポット"].to_numpy(), n_visited, replace=False))
+    feedback = {
+        s: {"viewpoints": list(rng.choice(viewpoint_cols, 2, replace=False))}
+        for s in visited
+    }
+    selected = list(rng.choice(viewpoint_cols, 3, replace=False))
+    return visited, feedback, selected
+
+
+def write_catalog_files(df, root):
+    # load_all / load_spot_urls が読む data/ 以下の CSV を書き出す
+    data_dir = os.path.join(root, "data")
+    os.makedirs(data_dir, exist_ok=True)
+    df.to_csv(os.path.join(data_dir, "spot_scores.csv"), index=False)
+
+    spots = df["スポット"].to_numpy()
+    for i, (list_name, jalan_name) in enumerate([
+        ("spot_list_tokyo.csv", "jalan_spots_tokyo.csv"),
+        ("spot_list_kansai.csv", "jalan_spots_kansai.csv"),
+        ("spot_list_tyugoku.csv", "jalan_spots_tyugoku.csv"),
+    ]):
+        part = spots[i::3]
+        pd.DataFrame({"スポット": part}).to_csv(os.path.join(data_dir, list_name), index=False)
+        pd.DataFrame({
+            "スポット": part,
+            "レビュー数": np.arange(len(part)),
+            "URL": [f"https://example.com/{s}" for s in part],
+        }).to_csv(os.path.join(data_dir, jalan_name), index=False)
+
+
+# ============================
+# 計測
+# ============================
+@contextmanager
+def _cwd(path):
+    prev = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(prev)
+
+
+def measure(fn, repeat, warmup=1):
+    # レイテンシ分布（ms）とピークメモリ（MiB, tracemalloc）を返す
+    for _ in range(warmup):
+        fn()
+
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000.0)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times = np.array(times)
+    return {
+        "repeat": repeat,
+        "mean_ms": float(times.mean()),
+        "p50_ms": float(np.percentile(times, 50)),
+        "p90_ms": float(np.percentile(times, 90)),
+        "p99_ms": float(np.percentile(times, 99)),
+        "max_ms": float(times.max()),
+        "peak_mib": peak / (1024 * 1024),
+    }
+
+
+def bench_catalog(n_spots, n_viewpoints, repeat, with_loaders=True, seed=0):
+    df = synthetic_catalog(n_spots, n_viewpoints, seed=seed)
+    rng = np.random.default_rng(seed + 1)
+    visited, feedback, selected = synthetic_user(df, rng)
+
+    results = {}
+    results["minmax"] = measure(lambda: minmax(df[df.columns[1]]), repeat)
+    results["score_index_build"] = measure(lambda: ScoreIndex(df), max(1, repeat // 5))
+
+    index = ScoreIndex(df)
+    for condition in CONDITION_NAMES:
+        results[f"compute_user_preference/{condition}"] = measure(
+            lambda: compute_user_preference(visited, feedback, index, selected, condition),
+            repeat
+        )
+        user_pref = compute_user_preference(visited, feedback, index, selected, condition)
+        results[f"recommend_spots/{condition}"] = measure(
+            lambda: recommend_spots(user_pref, index, condition, selected, visited),
+            repeat
+        )
+        if condition in ("aspect_top5", "aspect_exclude_interest_top5"):
+            index.viewpoint_lists()  # 索引の構築は計測に含めない
+            results[f"recommend_spots/{condition}/threshold"] = measure(
+                lambda: recommend_spots(
+                    user_pref, index, condition, selected, visited, retrieval="threshold"
+                ),
+                repeat
+            )
+        get_approx_index(index)  # 索引の構築は計測に含めない
+        results[f"recommend_spots/{condition}/approximate"] = measure(
+            lambda: recommend_spots(
+                user_pref, index, condition, selected, visited, retrieval="approximate"
+            ),
+            repeat
+        )
+
+    # --- MMR による多様性の並べ替え（候補プールの大きさごと。素の推薦との差が追加分） ---
+    user_pref = compute_user_preference(visited, feedback, index, selected, "aspect_all")
+    for pool in (50, 200):
+        results[f"recommend_spots/aspect_all/mmr{pool}"] = measure(
+            lambda: recommend_spots(
+                user_pref, index, "aspect_all", selected, visited, mmr_lambda=0.7, mmr_pool=pool
+            ),
+            repeat
+        )
+
+    # --- 複数条件の一括計算（1 条件 / A・B の 2 条件 / 4 条件） ---
+    for n_conditions in (1, 2, 4):
+        results[f"compute_conditions/{n_conditions}"] = measure(
+            lambda: compute_conditions(
+                visited, feedback, index, selected, CONDITION_NAMES[:n_conditions]
+            ),
+            repeat
+        )
+
+    # --- 地域シャード（write_catalog_files と同じ 3 分割）の 1 地域だけ ---
+    spots = df["スポット"].to_numpy()
+    shards = RegionShards(index, {f"region{i}": list(spots[i::3]) for i in range(3)})
+    user_pref = compute_user_preference(visited, feedback, index, selected, "aspect_all")
+    results["recommend_in_regions/aspect_all/1of3"] = measure(
+        lambda: recommend_in_regions(
+            user_pref, shards, "aspect_all", selected, ["region0"], visited
+        ),
+        repeat
+    )
+
+    if with_loaders:
+        with tempfile.TemporaryDirectory() as root:
+            write_catalog_files(df, root)
+            with _cwd(root):
+                results["load_all"] = measure(load_all, max(1, repeat // 5))
+                results["load_spot_urls"] = measure(load_spot_urls, max(1, repeat // 5))
+
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="スコアリング処理のベンチマーク（JSON 出力）")
+    parser.add_argument("--spots", type=int, nargs="+", default=[244, 10000, 100000])
+    parser.add_argument("--viewpoints", type=int, nargs="+", default=[22])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--no-loaders", action="store_true", help="CSV ローダーの計測を省く")
+    parser.add_argument("--out", default=None, help="結果 JSON の出力先（省略時は標準出力）")
+    args = parser.parse_args(argv)
+
+    report = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "runs": [],
+    }
+
+    for n_viewpoints in args.viewpoints:
+        for n_spots in args.spots:
+            print(f"benchmarking {n_spots} spots x {n_viewpoints} viewpoints", file=sys.stderr)
+            report["runs"].append({
+                "n_spots": n_spots,
+                "n_viewpoints": n_viewpoints,
+                "results": bench_catalog(
+                    n_spots, n_viewpoints, args.repeat,
+                    with_loaders=not args.no_loaders
+                ),
+            })
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
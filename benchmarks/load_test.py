@@ -0,0 +1,296 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils import log_store, sheets_client
+from utils.condition_balance import get_condition_balancer
+from utils.load_data import load_all
+from utils.log_sink import GoogleSheetBackend, get_log_sink
+from utils.metrics import metrics
+from utils.sheets_client import FakeWorksheet, SheetsClientProvider
+
+
+# app.py の st.secrets に渡すダミーのサービスアカウント
+FAKE_ACCOUNT = {"client_email": "load-test@example.invalid", "sheet_id": "load-test"}
+
+
+# ============================
+# 偽の Google Sheets（遅延つき）
+# ============================
+def install_fake_sheets(latency, spool_dir):
+    # get_sheets_provider / get_log_sink / get_condition_balancer / get_log_store のシングルトンを
+    # 先に偽のシートと spool_dir で作っておく（app.py 側は何も変えずに偽物を使う）
+    # シングルトンはプロセスごとなので、参加者のプロセスの中で呼ぶ
+    log_store._store = log_store.ColumnarLogStore(os.path.join(spool_dir, "log_store"))
+    sheet = FakeWorksheet(latency=latency)
+    provider = SheetsClientProvider(FAKE_ACCOUNT, opener=lambda sheet_id: sheet)
+    sheets_client._providers[FAKE_ACCOUNT["client_email"]] = provider
+
+    backend_factory = lambda: GoogleSheetBackend(provider)
+    balancer = get_condition_balancer(
+        backend_factory, store_path=os.path.join(spool_dir, "condition_counts.json")
+    )
+    sink = get_log_sink(
+        backend_factory,
+        spool_path=os.path.join(spool_dir, "log_spool.db"),
+        on_written=balancer.on_logs_written
+    )
+    return sheet, provider, sink
+
+
+# ============================
+# 参加者 1 人分（Step 0 → 4）
+# ============================
+def _widget(elements, label):
+    for e in elements:
+        if e.label == label:
+            return e
+    raise LookupError(f"widget not found: {label}")
+
+
+def simulate_participant(app_path, spots, viewpoint_list, rng, think_time, timings, timeout):
+    # spots: 選べる (地域, スポット) のリスト（spot_scores にあるものだけ）
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(app_path, default_timeout=timeout)
+    at.secrets["gcp_service_account"] = FAKE_ACCOUNT
+
+    def run(step, action=None):
+        if think_time:
+            time.sleep(rng.uniform(0, think_time))
+        t0 = time.perf_counter()
+        (action() if action else at).run()
+        timings.append((step, time.perf_counter() - t0))
+        if at.exception:
+            raise RuntimeError(f"step {step}: {at.exception[0].message}")
+
+    # --- Step 0: 同意 → 開始（ここで条件ペアの割り当て） ---
+    run(0)
+    _widget(at.text_input, "お名前（ニックネーム可）を入力してください").input(f"load{rng.randrange(10**6)}")
+    run(0, lambda: _widget(at.checkbox, "内容を理解し、同意します").check())
+    run(0, lambda: _widget(at.button, "実験を開始する").click())
+
+    # --- Step 1: 興味のある観点（実際に描画されたチェックボックスから） + 行った観光地 5 件 ---
+    vp_keys = [c.key for c in at.checkbox if c.key and c.key.startswith("vp_")]
+    for key in rng.sample(vp_keys, rng.randint(1, 5)):
+        at.checkbox(key=key).check()
+    for region, spot in rng.sample(spots, 5):
+        at.text_input(key="spot_query").input(spot)
+        run(1)
+        run(1, lambda: at.checkbox(key=f"pick_{region}_{spot}").check())
+        at.multiselect(key=f"viewpoints_{spot}").set_value(rng.sample(viewpoint_list, rng.randint(1, 3)))
+    at.text_input(key="spot_query").input("")
+    run(1, lambda: _widget(at.button, "次へ").click())
+
+    # --- Step 2: A/B 推薦（評価は既定値のまま） ---
+    if at.session_state["step"] != 2:
+        raise RuntimeError("step 1 did not advance")
+    run(2, lambda: _widget(at.button, "次へ").click())
+
+    # --- Step 3: アンケート → ログ送信 ---
+    run(3, lambda: _widget(at.button, "送信して終了").click())
+    if at.session_state["step"] != 4:
+        raise RuntimeError("step 3 did not advance")
+
+
+# ============================
+# 負荷試験
+# ============================
+def _percentiles(values):
+    values = np.array(values) * 1000.0
+    if len(values) == 0:
+        return {"count": 0}
+    return {
+        "count": int(len(values)),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p90_ms": float(np.percentile(values, 90)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+    }
+
+
+def _participant_process(i, app_path, spots, viewpoint_list, seed, think_time, latency, timeout, spool_root):
+    # 1 プロセスで参加者 1 人。AppTest は Runtime._instance と st.secrets をプロセス全体で
+    # 共有するので、同じプロセスで並列に動かすと参加者どうしが壊し合う
+    # 偽のシート・送信キュー・条件バランサーもこのプロセスの中で作る（プロセス間では共有しない）
+    os.chdir(ROOT)  # app.py は data/ を相対パスで読む
+    spool_dir = os.path.join(spool_root, f"participant{i}")
+    os.makedirs(spool_dir)
+    sheet, provider, sink = install_fake_sheets(latency, spool_dir)
+    metrics.reset()
+
+    rng = random.Random(seed * 100003 + i)
+    timings = []
+    error = None
+    tracemalloc.start()
+    started = time.time()
+    try:
+        simulate_participant(app_path, spots, viewpoint_list, rng, think_time, timings, timeout)
+    except Exception as e:
+        error = f"participant {i}: {e}"
+    finished = time.time()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    t_flush = time.perf_counter()
+    sink.flush()
+    return {
+        "error": error,
+        "timings": timings,
+        "started": started,
+        "finished": finished,
+        "traced_peak": peak,
+        "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "sheets": provider.stats(),
+        "rows_written": max(0, len(sheet.values) - 1),
+        "flush_s": time.perf_counter() - t_flush,
+        "metrics": metrics.snapshot(),
+    }
+
+
+def _merge_sheet_stats(stats):
+    merged = {}
+    for s in stats:
+        for kind, t in s.items():
+            m = merged.setdefault(kind, {"count": 0, "seconds": 0.0})
+            m["count"] += t["count"]
+            m["seconds"] += t["seconds"]
+    for m in merged.values():
+        m["mean_ms"] = m["seconds"] * 1000.0 / m["count"] if m["count"] else 0.0
+    return merged
+
+
+def _merge_snapshots(snapshots):
+    # プロセスごとの metrics.snapshot() を、名前 + ラベルごとに足し合わせる
+    histograms, counters = {}, {}
+    for snap in snapshots:
+        for name, series in snap["histograms"].items():
+            for h in series:
+                key = json.dumps(h["labels"], sort_keys=True)
+                m = histograms.setdefault(name, {}).setdefault(
+                    key, {"labels": h["labels"], "count": 0, "sum": 0.0, "buckets": {}}
+                )
+                m["count"] += h["count"]
+                m["sum"] += h["sum"]
+                for bucket, n in h["buckets"].items():
+                    m["buckets"][bucket] = m["buckets"].get(bucket, 0) + n
+        for name, series in snap["counters"].items():
+            for c in series:
+                key = json.dumps(c["labels"], sort_keys=True)
+                m = counters.setdefault(name, {}).setdefault(key, {"labels": c["labels"], "value": 0})
+                m["value"] += c["value"]
+    return {
+        "histograms": {name: list(series.values()) for name, series in histograms.items()},
+        "counters": {name: list(series.values()) for name, series in counters.items()},
+    }
+
+
+def run_load_test(participants, concurrency, ramp=0.0, think_time=0.0, latency=0.2, seed=0, timeout=60.0):
+    # participants 人を最大 concurrency 並列（1 人 1 プロセス）で Step 0 → 4 まで進め、
+    # Step ごとのレイテンシ・スループット・メモリを返す
+    # 1 人でも失敗したら RuntimeError（一部だけ成功したスループットは出さない）
+    os.chdir(ROOT)
+    viewpoint_list, spot_lists, spot_scores = load_all()
+    known = set(spot_scores["スポット"])
+    spots = [(region, spot) for region, names in spot_lists.items() for spot in names if spot in known]
+    app_path = os.path.join(ROOT, "app.py")
+
+    with tempfile.TemporaryDirectory() as spool_root:
+        # プロセスは使い回さない（前の参加者の Runtime やシングルトンを持ち越さない）
+        pool = ProcessPoolExecutor(
+            max_workers=concurrency,
+            mp_context=multiprocessing.get_context("spawn"),
+            max_tasks_per_child=1
+        )
+        with pool:
+            t0 = time.perf_counter()
+            futures = []
+            for i in range(participants):
+                if ramp and participants > 1:
+                    time.sleep(max(0.0, t0 + ramp * i / (participants - 1) - time.perf_counter()))
+                futures.append(pool.submit(
+                    _participant_process, i, app_path, spots, viewpoint_list, seed,
+                    think_time, latency, timeout, spool_root
+                ))
+            results = []
+            for i, f in enumerate(futures):
+                try:
+                    results.append(f.result())
+                except Exception as e:  # プロセスごと落ちた場合
+                    results.append({"error": f"participant {i}: {e!r}"})
+
+    errors = [r["error"] for r in results if r["error"]]
+    if errors:
+        raise RuntimeError(
+            f"{len(errors)} of {participants} participants failed:\n" + "\n".join(errors[:20])
+        )
+
+    # 最初の参加者が始めてから最後の参加者が終わるまで（プロセスの起動待ちは含めない）
+    elapsed = max(r["finished"] for r in results) - min(r["started"] for r in results)
+    timings = [t for r in results for t in r["timings"]]
+    return {
+        "participants": participants,
+        "concurrency": concurrency,
+        "ramp_s": ramp,
+        "think_time_s": think_time,
+        "sheet_latency_s": latency,
+        "completed": participants,
+        "elapsed_s": elapsed,
+        "throughput_sessions_per_s": participants / elapsed if elapsed else 0.0,
+        "throughput_reruns_per_s": len(timings) / elapsed if elapsed else 0.0,
+        "steps": {
+            f"step{s}": _percentiles([t for step, t in timings if step == s])
+            for s in sorted({step for step, _ in timings})
+        },
+        "memory": {
+            # 参加者 1 人（1 プロセス）あたりの最大
+            "traced_peak_mib": max(r["traced_peak"] for r in results) / (1024 * 1024),
+            "max_rss_mib": max(r["max_rss_kib"] for r in results) / 1024,
+        },
+        "sheets": _merge_sheet_stats(r["sheets"] for r in results),
+        "rows_written": sum(r["rows_written"] for r in results),
+        "final_flush_s": max(r["flush_s"] for r in results),
+        "metrics": _merge_snapshots(r["metrics"] for r in results),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="同時参加者の負荷試験（Streamlit AppTest + 偽の Sheets、1 人 1 プロセス）")
+    parser.add_argument("--participants", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--ramp", type=float, default=0.0, help="全員が来るまでの秒数（0 で一斉）")
+    parser.add_argument("--think-time", type=float, default=0.0, help="操作間の最大待ち時間（秒）")
+    parser.add_argument("--sheet-latency", type=float, default=0.2, help="Sheets 1 呼び出しの擬似遅延（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="結果 JSON の出力先（省略時は標準出力）")
+    args = parser.parse_args(argv)
+
+    report = run_load_test(
+        args.participants, args.concurrency, ramp=args.ramp, think_time=args.think_time,
+        latency=args.sheet_latency, seed=args.seed
+    )
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.catalog import IncrementalCatalog
+from utils.scoring import ScoreIndex
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def catalog():
+    return pd.read_csv(os.path.join(ROOT, "data", "spot_scores.csv"))
+
+
+def _assert_same_index(cat):
+    fresh = ScoreIndex(cat.to_frame())
+    assert list(cat.spots) == list(fresh.spots)
+    assert cat.spot_to_row == fresh.spot_to_row
+    np.testing.assert_allclose(cat.norm, fresh.norm, rtol=1e-12, atol=1e-15)
+    np.testing.assert_allclose(cat.recip_rank, fresh.recip_rank)
+    np.testing.assert_allclose(cat.contrib, fresh.contrib, rtol=1e-12, atol=1e-15)
+    np.testing.assert_array_equal(cat.order, fresh.order)
+
+
+# ============================
+# 追加・更新・削除のあとも作り直した索引と同じ
+# ============================
+def test_edits_match_fresh_index(catalog):
+    cat = IncrementalCatalog(catalog)
+    rng = np.random.default_rng(0)
+    n_views = len(cat.viewpoint_cols)
+    lo = catalog[cat.viewpoint_cols].min().to_numpy()
+    hi = catalog[cat.viewpoint_cols].max().to_numpy()
+
+    # 列の範囲に収まる更新（その行だけ計算し直す）
+    cat.update(catalog["スポット"][5], lo + (hi - lo) * rng.random(n_views))
+    _assert_same_index(cat)
+
+    # 範囲を広げる追加・更新（列ごと正規化し直す）
+    cat.add("新しい観光地", hi * 2)
+    cat.update(catalog["スポット"][10], lo - 1)
+    _assert_same_index(cat)
+
+    # 最小・最大を持っていた行の削除（範囲が縮む）
+    cat.remove("新しい観光地")
+    cat.remove(catalog["スポット"][0])
+    _assert_same_index(cat)
+    assert cat.revision == 5
+
+
+def test_version_changes_and_old_arrays_stay_intact(catalog):
+    cat = IncrementalCatalog(catalog)
+    version, contrib = cat.version, cat.contrib
+    before = contrib.copy()
+
+    cat.update(catalog["スポット"][3], np.zeros(len(cat.viewpoint_cols)))
+    assert cat.version != version
+    assert cat.to_frame().attrs["catalog_version"] == cat.version
+    # 読み手が持っていた配列は書き換わらない（コピーオンライト）
+    np.testing.assert_array_equal(contrib, before)
+    assert not contrib.flags.writeable
+
+
+def test_rejects_duplicate_and_unknown_spots(catalog):
+    with pytest.raises(ValueError):
+        IncrementalCatalog(pd.concat([catalog.head(2), catalog.head(1)]))
+    cat = IncrementalCatalog(catalog)
+    with pytest.raises(ValueError):
+        cat.update("存在しない観光地", np.zeros(len(cat.viewpoint_cols)))
@@ -0,0 +1,80 @@
+import json
+
+from utils.condition_balance import CONDITIONS, ConditionBalancer
+
+PAIRS = ["|".join(c) for c in CONDITIONS]
+
+
+def _pair(assigned):
+    return "|".join(assigned)
+
+
+# ============================
+# 割り当て
+# ============================
+def test_concurrent_sessions_get_distinct_pairs():
+    balancer = ConditionBalancer(store_path=None)
+    assigned = [_pair(balancer.assign(f"u{i}")) for i in range(len(PAIRS))]
+    assert sorted(assigned) == sorted(PAIRS)
+
+
+def test_reassigning_same_user_replaces_inflight():
+    balancer = ConditionBalancer(store_path=None)
+    balancer.assign("u1")
+    balancer.assign("u1")
+    assert sum(len(v) for v in balancer.inflight.values()) == 1
+
+
+def test_logged_row_releases_only_its_own_session():
+    balancer = ConditionBalancer(store_path=None)
+    a1 = _pair(balancer.assign("u1"))
+    a2 = _pair(balancer.assign("u2"))
+
+    # 割り当てに無い行（デモ用の参加者など）は他の参加者の割り当てに触らない
+    balancer.on_logs_written([{"user_id": "demo", "condition_pair": a2}])
+    assert list(balancer.inflight[a1]) == ["u1"]
+    assert list(balancer.inflight[a2]) == ["u2"]
+    assert balancer.logged[a2] == 1
+
+    balancer.on_logs_written([{"user_id": "u2", "condition_pair": a2}])
+    assert balancer.inflight[a2] == {}
+    assert balancer.logged[a2] == 2
+
+
+def test_inflight_expires_after_ttl():
+    balancer = ConditionBalancer(store_path=None, inflight_ttl=0.0)
+    first = _pair(balancer.assign("u1"))
+    # 前の割り当ては失効しているので、同じ回数のペアからまた選ばれる
+    balancer.assign("u2")
+    assert sum(len(v) for v in balancer.inflight.values()) == 1
+    assert balancer.inflight[first].get("u1") is None
+
+
+# ============================
+# シートとの突き合わせ
+# ============================
+def test_reconcile_uses_sheet_counts(tmp_path):
+    counts = {p: 5 for p in PAIRS}
+    counts[PAIRS[2]] = 1
+    store_path = str(tmp_path / "counts.json")
+    balancer = ConditionBalancer(count_source=lambda: counts, store_path=store_path)
+
+    # 最初の割り当ての前にシートと突き合わせるので、最も少ないペアが選ばれる
+    assert _pair(balancer.assign("u1")) == PAIRS[2]
+    assert balancer.logged == counts
+    with open(store_path, encoding="utf-8") as f:
+        assert json.load(f)["logged"] == counts
+
+
+def test_reconcile_keeps_rows_logged_during_read():
+    balancer = ConditionBalancer(store_path=None)
+
+    def count_source():
+        # シートを読んでいる間に 1 件書かれる（読んだ件数には入っていない）
+        balancer.record_logged(PAIRS[0], "u1")
+        return {p: 3 for p in PAIRS}
+
+    balancer.count_source = count_source
+    balancer.reconcile()
+    assert balancer.logged[PAIRS[0]] == 4
+    assert balancer.logged[PAIRS[1]] == 3
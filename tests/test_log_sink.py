@@ -0,0 +1,167 @@
+import csv
+import threading
+import time
+
+import pytest
+
+from utils import log_sink
+from utils.log_sink import FileBackend, GoogleSheetBackend, LogSink, MemoryBackend
+from utils.sheets_client import FakeWorksheet, SheetsClientProvider
+
+
+class FlakyBackend(MemoryBackend):
+    # 最初の fail_times 回の append_rows で例外を投げる
+    def __init__(self, fail_times):
+        super().__init__()
+        self.fail_times = fail_times
+        self.attempts = []
+        self.header_reads = 0
+
+    def header(self):
+        self.header_reads += 1
+        return super().header()
+
+    def append_rows(self, rows):
+        self.attempts.append(time.monotonic())
+        if len(self.attempts) <= self.fail_times:
+            raise ConnectionError("sheet unavailable")
+        super().append_rows(rows)
+
+
+def _sink(backend, tmp_path, **kwargs):
+    return LogSink(backend, spool_path=str(tmp_path / "spool.db"), **kwargs)
+
+
+# ============================
+# ヘッダーの追加（バッチをまたぐ）
+# ============================
+def test_header_extends_across_batches_memory(tmp_path):
+    backend = MemoryBackend()
+    sink = _sink(backend, tmp_path)
+
+    sink.submit({"user_id": "u1", "sat_A": 3})
+    assert sink.flush_once() == 1
+    sink.submit({"user_id": "u2", "sat_A": 4, "sat_B": 5})
+    sink.submit({"user_id": "u3", "ab_choice": "1"})
+    assert sink.flush_once() == 2
+
+    assert backend.header_row == ["user_id", "sat_A", "sat_B", "ab_choice"]
+    assert backend.rows == [
+        ["u1", 3],
+        ["u2", 4, 5, ""],
+        ["u3", "", "", "1"],
+    ]
+
+
+def test_header_extends_across_batches_file(tmp_path):
+    path = tmp_path / "log.csv"
+    backend = FileBackend(str(path))
+    sink = _sink(backend, tmp_path, batch_size=1)
+
+    sink.submit({"user_id": "u1", "sat_A": 3})
+    sink.submit({"user_id": "u2", "favor_A": 2})
+    sink.flush()
+
+    with open(path, newline="", encoding="utf-8") as f:
+        values = list(csv.reader(f))
+    assert values == [["user_id", "sat_A", "favor_A"], ["u1", "3"], ["u2", "", "2"]]
+    assert backend.column_values(1) == ["user_id", "u1", "u2"]
+
+
+def test_header_extends_on_fake_worksheet(tmp_path):
+    sheet = FakeWorksheet(values=[["user_id", "condition_pair"], ["u0", "a|b"]])
+    account = {"client_email": "test@example.invalid", "sheet_id": "test"}
+    provider = SheetsClientProvider(account, opener=lambda sheet_id: sheet)
+    sink = _sink(GoogleSheetBackend(provider), tmp_path)
+
+    sink.submit({"user_id": "u1", "condition_pair": "a|c", "sat_A": 4})
+    sink.flush()
+
+    assert sheet.values == [
+        ["user_id", "condition_pair", "sat_A"],
+        ["u0", "a|b"],
+        ["u1", "a|c", 4],
+    ]
+    assert provider.stats()["data"]["count"] == 3  # ヘッダー読み・書き + 追記
+
+
+def test_header_reread_before_extending(tmp_path):
+    backend = MemoryBackend()
+    sink = _sink(backend, tmp_path)
+
+    sink.submit({"user_id": "u1", "sat_A": 3})
+    sink.flush()
+    # 送信の合間に、シート側で列が足される
+    backend.update_header(["user_id", "sat_A", "memo"])
+    sink.submit({"user_id": "u2", "sat_A": 4, "sat_B": 5})
+    sink.flush()
+
+    assert backend.header_row == ["user_id", "sat_A", "memo", "sat_B"]
+    assert backend.rows == [["u1", 3], ["u2", 4, "", 5]]
+
+
+# ============================
+# スプールは送信が成功してから消す
+# ============================
+def test_spool_kept_until_append_succeeds(tmp_path):
+    backend = FlakyBackend(fail_times=1)
+    written = []
+    sink = _sink(backend, tmp_path, on_written=written.extend)
+    sink.submit({"user_id": "u1"})
+    sink.submit({"user_id": "u2"})
+
+    with pytest.raises(ConnectionError):
+        sink.flush_once()
+    assert sink.pending() == 2
+    assert backend.rows == []
+    assert written == []
+
+    assert sink.flush_once() == 2
+    assert sink.pending() == 0
+    assert backend.rows == [["u1"], ["u2"]]
+    assert [r["user_id"] for r in written] == ["u1", "u2"]
+
+
+def test_spool_survives_restart(tmp_path):
+    # 送れないまま終わったスプールは、次に作ったシンクが送る
+    _sink(FlakyBackend(fail_times=10), tmp_path).submit({"user_id": "u1"})
+
+    backend = MemoryBackend()
+    sink = _sink(backend, tmp_path)
+    assert sink.pending() == 1
+    sink.flush()
+    assert backend.rows == [["u1"]]
+    assert sink.pending() == 0
+
+
+# ============================
+# バックエンドの例外は指数バックオフで再試行する
+# ============================
+def test_background_retry_with_backoff(tmp_path, monkeypatch):
+    monkeypatch.setattr(log_sink.random, "uniform", lambda a, b: 1.0)  # ゆらぎなし
+    backend = FlakyBackend(fail_times=3)
+    done = threading.Event()
+    sink = _sink(
+        backend, tmp_path, flush_interval=0.02, max_backoff=0.1,
+        on_written=lambda records: done.set()
+    )
+    sink.submit({"user_id": "u1"})
+
+    sink.start()
+    try:
+        assert done.wait(5.0)
+    finally:
+        sink.stop(timeout=5.0)
+
+    assert backend.rows == [["u1"]]
+    assert sink.pending() == 0
+    assert sink.failures == 0  # 成功したら戻る
+    assert isinstance(sink.last_error, ConnectionError)
+    assert backend.header_reads == 4  # 失敗のたびにヘッダーを取り直す
+
+    # 待ち時間は flush_interval × 2^attempt（max_backoff で頭打ち）: 0.04, 0.08, 0.1
+    gaps = [b - a for a, b in zip(backend.attempts, backend.attempts[1:])]
+    assert len(gaps) == 3
+    for gap, expected in zip(gaps, [0.04, 0.08, 0.1]):
+        assert gap >= expected * 0.9
+    assert gaps[0] < gaps[1]
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from utils.log_store import ColumnarLogStore, record_to_row, row_to_record
+
+
+def _record(**kwargs):
+    # app.py の save_log と同じ形（JSON 文字列のセルを含む）
+    record = {
+        "user_id": "u1",
+        "name": "テスト",
+        "age_group": "20代",
+        "condition_pair": "aspect_all|aspect_top5",
+        "selected_viewpoints": "温泉,食",
+        "visited_spots": "東京タワー,大阪城",
+        "spot_feedback": json.dumps({"東京タワー": {"viewpoints": ["建造物"]}}, ensure_ascii=False),
+        "recA": json.dumps([{"スポット": "京都タワー", "スコア": 1.5}], ensure_ascii=False),
+        "recB": json.dumps([{"スポット": "清水寺", "スコア": 0.25}], ensure_ascii=False),
+        "excludedA": json.dumps([{"スポット": "東京タワー", "順位": 3}], ensure_ascii=False),
+        "excludedB": json.dumps([], ensure_ascii=False),
+        "user_pref_A": json.dumps([{"観点": "温泉", "総合スコア": 0.5, "興味あり": 1}], ensure_ascii=False),
+        "user_pref_B": json.dumps([{"観点": "食", "総合スコア": 0.75, "興味あり": 0}], ensure_ascii=False),
+        "sat_A": 4,
+        "favor_A": 3,
+        "sat_B": 2,
+        "favor_B": 5,
+        "spot_questions": json.dumps({"京都タワー": {"知っていた": "知らなかった", "行きたい": 3}}, ensure_ascii=False),
+        "ab_choice": "A",
+        "ab_why": "理由",
+        "match_compare": "A",
+        "match_why": "",
+        "accept_compare": "B",
+        "aspect_comment_compare": "",
+        "timestamp": "2026-01-02T03:04:05.123456",
+    }
+    record.update(kwargs)
+    return record
+
+
+# ============================
+# save_log の 1 件 ⇔ 型付きの 1 行
+# ============================
+def test_record_row_round_trip():
+    record = _record()
+    assert row_to_record(record_to_row(record), display_columns=False) == record
+
+
+def test_round_trip_keeps_extra_columns_and_blank_ints():
+    record = _record(sat_B="", new_question="yes")
+    back = row_to_record(record_to_row(record), display_columns=False)
+    assert back["sat_B"] == ""
+    assert back["new_question"] == "yes"
+
+
+def test_store_append_and_export(tmp_path):
+    store = ColumnarLogStore(str(tmp_path / "log_store"))
+    records = [_record(), _record(user_id="u2", timestamp="2026-01-03T00:00:00")]
+    paths = store.append(records)
+    assert len(paths) == 2  # 日付ごとに 1 ファイル
+
+    exported = store.export_records(display_columns=False)
+    assert exported == records
+    assert store.read(columns=["user_id"]).column("user_id").to_pylist() == ["u1", "u2"]
@@ -0,0 +1,280 @@
+import os
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.ann import ApproxIndex, get_approx_index, measure_recall
+from utils.catalog import IncrementalCatalog
+from utils.scoring import (
+    CONDITION_NAMES,
+    ResultCache,
+    ScoreIndex,
+    compute_condition_results,
+    compute_conditions,
+    compute_user_preference,
+    estimate_rank_of_rows,
+    minmax,
+    rank_of_rows,
+    recommend_batch,
+    recommend_spots,
+    threshold_top_k,
+    top_k_rows,
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    return pd.read_csv(os.path.join(ROOT, "data", "spot_scores.csv"))
+
+
+@pytest.fixture(scope="module")
+def index(catalog):
+    return ScoreIndex(catalog)
+
+
+@pytest.fixture(scope="module")
+def small_catalog(catalog):
+    # iterrows の参照実装でも速く回るように先頭 60 件だけ
+    return catalog.head(60).reset_index(drop=True)
+
+
+def _random_user(spots, viewpoint_cols, rng):
+    visited = list(rng.choice(spots, int(rng.integers(0, 6)), replace=False))
+    feedback = {
+        s: {"viewpoints": list(rng.choice(viewpoint_cols, int(rng.integers(0, 3)), replace=False))}
+        for s in visited
+    }
+    selected = list(rng.choice(viewpoint_cols, int(rng.integers(0, 4)), replace=False))
+    return visited, feedback, selected
+
+
+def _weights(index, rng, n_queries):
+    # ランダムな重み + 1 観点だけの重み（0 点のスポットが同点で並ぶ）
+    V = len(index.viewpoint_cols)
+    ws = [rng.random(V) * (rng.random(V) < 0.5) for _ in range(n_queries)]
+    ws += [np.eye(V)[j] for j in range(V)]
+    return ws
+
+
+# ============================
+# 除外スポットの順位推定
+# ============================
+def test_estimate_rank_matches_exact_on_real_catalog(index):
+    rng = np.random.default_rng(0)
+    n = len(index.spots)
+    for w in _weights(index, rng, 300):
+        rows = rng.choice(n, 5, replace=False)
+        expected = rank_of_rows(index.contrib @ w, rows)
+        np.testing.assert_array_equal(estimate_rank_of_rows(index, w, rows), expected)
+
+
+def test_estimate_rank_sampled_never_counts_itself():
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame(rng.random((20000, 8)), columns=[f"観点{j}" for j in range(8)])
+    df.insert(0, "スポット", [f"spot{i}" for i in range(20000)])
+    index = ScoreIndex(df)
+    for w in _weights(index, rng, 20):
+        scores = index.contrib @ w
+        rows = np.concatenate([top_k_rows(scores, 3), rng.choice(20000, 5, replace=False)])
+        est = estimate_rank_of_rows(index, w, rows, sample_size=1000)
+        exact = rank_of_rows(scores, rows)
+        assert est[0] == 1
+        # 1000 行の標本からの推定なので、誤差は全体の 5%（1000 位）程度に収まる
+        assert np.all(np.abs(est - exact) <= 1000)
+
+
+# ============================
+# 参照実装（ベクトル化前の iterrows 版）
+# ============================
+def _reference_preference(visited_spots, spot_feedback, df, selected_viewpoints, condition):
+    viewpoint_cols = [c for c in df.columns if c != "スポット"]
+    df_norm = df.copy()
+    for col in viewpoint_cols:
+        df_norm[col] = minmax(df_norm[col])
+
+    aspect_scores = defaultdict(float)
+    for spot in visited_spots:
+        row = df_norm[df_norm["スポット"] == spot].iloc[0]
+        good = spot_feedback.get(spot, {}).get("viewpoints", [])
+        ranks = row[viewpoint_cols].rank(ascending=False, method="first")
+        if condition == "aspect_top5":
+            spot_top = set(ranks.sort_values().head(5).index)
+        elif condition == "aspect_exclude_interest_top5":
+            spot_top = set(ranks.drop(selected_viewpoints, errors="ignore").sort_values().head(5).index)
+        else:
+            spot_top = None
+        for v in viewpoint_cols:
+            if spot_top is not None and v not in spot_top and v not in good:
+                continue
+            score = row[v] * (1.0 / ranks[v])
+            if condition != "noaspect_all" and v in good:
+                score *= 1.2
+            aspect_scores[v] += score
+
+    aspect_scores = pd.Series(aspect_scores, dtype=float).sort_values(ascending=False)
+    return pd.DataFrame({
+        "観点": aspect_scores.index,
+        "総合スコア": aspect_scores.values,
+        "興味あり": [1 if v in selected_viewpoints else 0 for v in aspect_scores.index]
+    }).reset_index(drop=True)
+
+
+def _reference_recommend(user_pref_df, df, condition, selected_viewpoints, visited_spots):
+    viewpoint_cols = [c for c in df.columns if c != "スポット"]
+    df_norm = df.copy()
+    for col in viewpoint_cols:
+        df_norm[col] = minmax(df_norm[col])
+    rank_df = df_norm.copy()
+    for idx, row in df_norm.iterrows():
+        rank_df.loc[idx, viewpoint_cols] = 1.0 / row[viewpoint_cols].rank(method="first", ascending=False)
+
+    weights = user_pref_df.set_index("観点")["総合スコア"]
+    if condition == "aspect_top5":
+        V = {v: weights[v] for v in weights.sort_values(ascending=False).head(5).index}
+    elif condition == "aspect_exclude_interest_top5":
+        rest = weights.drop(selected_viewpoints, errors="ignore")
+        V = {v: weights[v] for v in rest.sort_values(ascending=False).head(5).index}
+    elif condition == "aspect_all":
+        V = dict(weights)
+    else:
+        V = {v: 1.0 for v in viewpoint_cols}
+
+    results = []
+    for idx, row in df_norm.iterrows():
+        score = sum(w * row[v] * rank_df.loc[idx, v] for v, w in V.items())
+        results.append({"スポット": row["スポット"], "スコア": score})
+    df_all = pd.DataFrame(results).sort_values("スコア", ascending=False, kind="stable")
+
+    excluded = [
+        {"スポット": spot, "順位": rank}
+        for rank, spot in enumerate(df_all["スポット"], start=1)
+        if spot in visited_spots
+    ]
+    return df_all[~df_all["スポット"].isin(visited_spots)].head(10), excluded
+
+
+def _assert_same_result(expected, actual):
+    (pref, rec, excluded), (pref2, rec2, excluded2) = expected, actual
+    # 訪問なし（空の嗜好）のときの列の型は問わない
+    pd.testing.assert_frame_equal(pref, pref2, check_exact=False, rtol=1e-12, check_dtype=not pref.empty)
+    assert list(rec.index) == list(rec2.index)
+    assert list(rec["スポット"]) == list(rec2["スポット"])
+    np.testing.assert_allclose(rec["スコア"].to_numpy(), rec2["スコア"].to_numpy(), rtol=1e-12)
+    assert excluded == excluded2
+
+
+# ============================
+# ベクトル化した嗜好推定・推薦と参照実装
+# ============================
+@pytest.mark.parametrize("condition", CONDITION_NAMES)
+def test_vectorized_scoring_matches_reference(small_catalog, condition):
+    rng = np.random.default_rng(CONDITION_NAMES.index(condition))
+    spots = small_catalog["スポット"].to_numpy()
+    viewpoint_cols = [c for c in small_catalog.columns if c != "スポット"]
+    for _ in range(3):
+        visited, feedback, selected = _random_user(spots, viewpoint_cols, rng)
+        pref = _reference_preference(visited, feedback, small_catalog, selected, condition)
+        rec, excluded = _reference_recommend(pref, small_catalog, condition, selected, visited)
+
+        pref2 = compute_user_preference(visited, feedback, small_catalog, selected, condition)
+        rec2, excluded2 = recommend_spots(pref2, small_catalog, condition, selected, visited)
+        _assert_same_result((pref, rec, excluded), (pref2, rec2, excluded2))
+
+
+def test_fused_and_batch_paths_match_per_condition(index):
+    rng = np.random.default_rng(7)
+    spots, viewpoint_cols = index.spots, list(index.viewpoint_cols)
+    users = [_random_user(spots, viewpoint_cols, rng) for _ in range(6)]
+
+    separate = {}
+    for visited, feedback, selected in users:
+        for c in CONDITION_NAMES:
+            pref = compute_user_preference(visited, feedback, index, selected, c)
+            rec, excluded = recommend_spots(pref, index, c, selected, visited)
+            separate[(tuple(visited), c)] = (pref, rec, excluded)
+
+    for visited, feedback, selected in users:
+        fused = compute_conditions(visited, feedback, index, selected)
+        for c in CONDITION_NAMES:
+            _assert_same_result(separate[(tuple(visited), c)], fused[c])
+
+    for c in CONDITION_NAMES:
+        batch = [
+            {"visited_spots": v, "spot_feedback": fb, "selected_viewpoints": sel}
+            for v, fb, sel in users
+        ]
+        for (visited, _, _), *result in zip(users, *recommend_batch(batch, index, c)):
+            _assert_same_result(separate[(tuple(visited), c)], result)
+
+
+# ============================
+# しきい値アルゴリズム（TA）と全件計算
+# ============================
+def test_threshold_top_k_matches_exact_with_ties():
+    # 同じ行を繰り返して、境界に同点が並ぶカタログにする
+    rng = np.random.default_rng(2)
+    base = rng.integers(0, 4, (40, 10)).astype(float)
+    df = pd.DataFrame(np.repeat(base, 25, axis=0), columns=[f"観点{j}" for j in range(10)])
+    df.insert(0, "スポット", [f"spot{i}" for i in range(len(df))])
+    index = ScoreIndex(df)
+
+    for _ in range(50):
+        w = rng.random(10) * (rng.random(10) < 0.5)
+        exclude = rng.random(len(df)) < 0.05
+        for k in (1, 10, 37):
+            rows, scores = threshold_top_k(index, w, k, exclude=exclude, block=16, max_block=64)
+            expected = top_k_rows(index.contrib @ w, k, exclude=exclude)
+            np.testing.assert_array_equal(rows, expected)
+            np.testing.assert_allclose(scores, (index.contrib @ w)[expected], rtol=1e-12)
+
+
+# ============================
+# 近似検索（IVF）
+# ============================
+def test_approx_index_full_probe_is_exact(index):
+    rng = np.random.default_rng(3)
+    approx = ApproxIndex(index.contrib, n_lists=8)
+    exclude = np.zeros(len(index.spots), dtype=bool)
+    exclude[:10] = True
+    for w in _weights(index, rng, 20):
+        rows, scores = approx.search(w, 10, n_probe=8, exclude=exclude)
+        np.testing.assert_array_equal(rows, top_k_rows(index.contrib @ w, 10, exclude=exclude))
+        assert np.all(np.diff(scores) <= 0)
+
+
+def test_measure_recall_increases_with_probes(index):
+    rng = np.random.default_rng(4)
+    weights = np.array(_weights(index, rng, 30))
+    report = measure_recall(index, weights, n_probes=(1, 4, 16), n_lists=16)
+    recalls = [r["recall"] for r in report]
+    assert all(0.0 <= r <= 1.0 for r in recalls)
+    assert recalls == sorted(recalls)
+    assert recalls[-1] == 1.0
+    assert get_approx_index(index, n_lists=16) is get_approx_index(index, n_lists=16)
+
+
+# ============================
+# 結果キャッシュ
+# ============================
+def test_result_cache_invalidated_by_catalog_version(catalog):
+    cat = IncrementalCatalog(catalog)
+    cache = ResultCache()
+    visited = list(catalog["スポット"][:3])
+    args = (visited, {}, cat, ["温泉"], ["aspect_all", "aspect_top5"])
+
+    first = compute_condition_results(*args, cache=cache)
+    again = compute_condition_results(*args, cache=cache)
+    assert cache.stats() == {"hits": 2, "misses": 2, "size": 2}
+    for a, b in zip(first, again):
+        _assert_same_result(a, b)
+
+    # 推薦の先頭を大きく下げると、版が変わってキャッシュを使わずに計算し直す
+    top_spot = first[0][1]["スポット"].iloc[0]
+    cat.update(top_spot, np.zeros(len(cat.viewpoint_cols)))
+    updated = compute_condition_results(*args, cache=cache)
+    assert cache.stats()["misses"] == 4
+    assert top_spot not in list(updated[0][1]["スポット"])
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from utils.scoring import CONDITION_NAMES
+from utils.service import LocalRecommender, create_app, get_recommender, result_from_response
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    return pd.read_csv(os.path.join(ROOT, "data", "spot_scores.csv"))
+
+
+@pytest.fixture
+def app(catalog):
+    app = create_app(catalog, workers=0)
+    yield app
+    app.service.close()
+
+
+def _call(app, method, path, payload=None, body=None):
+    # ASGI アプリを 1 回呼んで (ステータス, JSON) を返す
+    if body is None:
+        body = b"" if payload is None else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app({"type": "http", "method": method, "path": path}, receive, send))
+    return sent[0]["status"], json.loads(sent[1]["body"])
+
+
+def _request(catalog, **kwargs):
+    visited = list(catalog["スポット"][:4])
+    request = {
+        "condition": "aspect_top5",
+        "visited_spots": visited,
+        "spot_feedback": {visited[0]: {"viewpoints": ["食"]}},
+        "selected_viewpoints": ["温泉"],
+    }
+    request.update(kwargs)
+    return request
+
+
+# ============================
+# 正常系
+# ============================
+def test_health(app):
+    status, body = _call(app, "GET", "/health")
+    assert status == 200
+    assert body["status"] == "ok"
+    assert body["catalog_version"] == app.service.index.version
+    assert body["conditions"] == list(CONDITION_NAMES)
+
+
+def test_recommend_matches_local(app, catalog):
+    request = _request(catalog)
+    status, body = _call(app, "POST", "/recommend", request)
+    assert status == 200
+    assert body["catalog_version"] == app.service.index.version
+
+    expected = LocalRecommender(catalog).condition_result(
+        request["visited_spots"], request["spot_feedback"], request["selected_viewpoints"],
+        request["condition"]
+    )
+    actual = result_from_response(body)
+    pd.testing.assert_frame_equal(actual[0], expected[0], check_dtype=False)
+    assert list(actual[1]["スポット"]) == list(expected[1]["スポット"])
+    assert list(actual[1].index) == list(expected[1].index)
+    assert actual[2] == expected[2]
+
+
+def test_preference_and_batch(app, catalog):
+    status, body = _call(app, "POST", "/preference", _request(catalog))
+    assert status == 200
+    assert {"観点", "総合スコア", "興味あり"} <= set(body["preference"][0])
+
+    request = _request(catalog, conditions=["aspect_all", "noaspect_all"], mmr_lambda=0.5)
+    status, body = _call(app, "POST", "/recommend_batch", request)
+    assert status == 200
+    assert [r["condition"] for r in body["results"]] == ["aspect_all", "noaspect_all"]
+    assert all(len(r["recommendations"]) == 10 for r in body["results"])
+
+
+# ============================
+# 入力の誤り（400）・未知のパス
+# ============================
+@pytest.mark.parametrize("path, overrides", [
+    ("/recommend", {"condition": "unknown"}),
+    ("/recommend", {"visited_spots": "東京タワー"}),
+    ("/recommend", {"visited_spots": ["存在しない観光地"]}),
+    ("/recommend", {"spot_feedback": {"x": {"viewpoints": "食"}}}),
+    ("/recommend", {"mmr_lambda": 1.5}),
+    ("/recommend", {"mmr_pool": 0}),
+    ("/preference", {"selected_viewpoints": [1, 2]}),
+    ("/recommend_batch", {"conditions": []}),
+    ("/recommend_batch", {"conditions": ["aspect_all", "unknown"]}),
+])
+def test_bad_requests_return_400(app, catalog, path, overrides):
+    status, body = _call(app, "POST", path, _request(catalog, **overrides))
+    assert status == 400
+    assert body["error"]
+
+
+def test_malformed_json_and_routing(app):
+    assert _call(app, "POST", "/recommend", body=b"{not json")[0] == 400
+    assert _call(app, "POST", "/recommend", body=b"[]")[0] == 400
+    assert _call(app, "GET", "/recommend")[0] == 405
+    assert _call(app, "GET", "/unknown")[0] == 404
+
+
+# ============================
+# 環境変数の MMR 設定
+# ============================
+@pytest.mark.parametrize("value", ["1.5", "-0.1", "nan", "abc"])
+def test_get_recommender_rejects_bad_mmr_lambda(monkeypatch, catalog, value):
+    monkeypatch.delenv("RECOMMENDER_URL", raising=False)
+    monkeypatch.setenv("MMR_LAMBDA", value)
+    with pytest.raises(ValueError):
+        get_recommender(catalog)
@@ -0,0 +1,48 @@
+import numpy as np
+
+from utils.spot_search import SpotSearchIndex, get_spot_search_index, normalize_name
+
+SPOT_LISTS = {
+    "東京": ["東京タワー", "レゴランド・ディスカバリー・センター東京", "ＡＢＣ美術館"],
+    "関西": ["大阪城", "ユニバーサル・スタジオ・ジャパン", "京都タワー"],
+}
+
+
+def _names(index, ids):
+    return [index.entries[i][1] for i in ids]
+
+
+# ============================
+# 表記ゆれの吸収
+# ============================
+def test_normalize_name_folds_kana_width_and_case():
+    assert normalize_name("れごらんど") == normalize_name("レゴランド")
+    assert normalize_name("ﾚｺﾞﾗﾝﾄﾞ") == normalize_name("レゴランド")
+    assert normalize_name("ＡＢＣ 美術館") == normalize_name("abc美術館")
+
+
+def test_search_matches_hiragana_halfwidth_and_fullwidth():
+    index = SpotSearchIndex(SPOT_LISTS)
+    assert _names(index, index.search("れごらんど")) == ["レゴランド・ディスカバリー・センター東京"]
+    assert _names(index, index.search("ﾚｺﾞﾗﾝﾄﾞ")) == ["レゴランド・ディスカバリー・センター東京"]
+    assert _names(index, index.search("abc")) == ["ＡＢＣ美術館"]
+    assert _names(index, index.search("たわー")) == ["東京タワー", "京都タワー"]
+
+
+# ============================
+# 部分一致・地域・ページ
+# ============================
+def test_search_requires_substring_and_filters_regions():
+    index = SpotSearchIndex(SPOT_LISTS)
+    # n-gram はすべて含むが順番が違うものは当たらない
+    assert len(index.search("ジオ・スタ")) == 0  # 「スタジオ・」の 2-gram だけを並べ替えた
+    assert _names(index, index.search("タワー", regions=["関西"])) == ["京都タワー"]
+    np.testing.assert_array_equal(index.search(""), np.arange(6))
+
+
+def test_page_clamps_and_counts_pages():
+    index = SpotSearchIndex(SPOT_LISTS)
+    entries, n_pages = index.page(index.search(""), page=5, page_size=4)
+    assert n_pages == 2
+    assert entries == [("関西", "ユニバーサル・スタジオ・ジャパン"), ("関西", "京都タワー")]
+    assert get_spot_search_index(SPOT_LISTS) is get_spot_search_index(dict(SPOT_LISTS))
@@ -0,0 +1,114 @@
+import time
+
+import numpy as np
+
+from utils.scoring import top_k_rows
+
+
+# ============================
+# 近似最大内積検索（IVF：k-means で分割した転置リスト）
+# ============================
+class ApproxIndex:
+    # 観光地ベクトル（norm × 1/rank）を k-means で n_lists 個に分割しておき、
+    # 検索時は重み w との内積が大きいセントロイド上位 n_probe 個の中だけを
+    # 正確にスコア計算する。n_probe を増やすほど再現率が上がり、遅くなる
+    #   centroids: (n_lists × n_viewpoints)
+    #   rows:      分割ごとに並べた行番号（offsets[i]:offsets[i+1] が分割 i）
+    #   vectors:   rows の順に並べ替えたベクトル（連続メモリで読めるように）
+
+    def __init__(self, vectors, n_lists=None, n_iter=10, sample_size=50000, seed=0):
+        n_spots = len(vectors)
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(n_spots)))
+        n_lists = min(n_lists, max(1, n_spots))
+
+        rng = np.random.default_rng(seed)
+        sample = vectors
+        if n_spots > sample_size:
+            sample = vectors[rng.choice(n_spots, sample_size, replace=False)]
+
+        # --- k-means（サンプルで学習） ---
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            labels = _nearest(sample, centroids)
+            counts = np.bincount(labels, minlength=n_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+
+        # --- 全件を分割に割り当てる ---
+        labels = _nearest(vectors, centroids)
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=n_lists)
+
+        self.centroids = centroids
+        self.rows = order
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.vectors = np.ascontiguousarray(vectors[order])
+        self.n_spots = n_spots
+
+    def search(self, w, k, n_probe=8, exclude=None):
+        # 返り値は (上位 k 行, そのスコア)。同点は行番号の小さい方が上位
+        n_probe = min(n_probe, len(self.centroids))
+        centroid_scores = self.centroids @ w
+        probe = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+
+        positions = np.concatenate([
+            np.arange(self.offsets[p], self.offsets[p + 1]) for p in probe
+        ])
+        rows = self.rows[positions]
+        scores = self.vectors[positions] @ w
+
+        by_row = np.argsort(rows, kind="stable")
+        rows, scores = rows[by_row], scores[by_row]
+        top = top_k_rows(scores, k, exclude=None if exclude is None else exclude[rows])
+        return rows[top], scores[top]
+
+
+def _nearest(x, centroids, chunk=16384):
+    # 各行に最も近いセントロイド（ユークリッド距離）。メモリを抑えるため分割して計算
+    c_sq = (centroids ** 2).sum(axis=1)
+    labels = np.empty(len(x), dtype=np.int64)
+    for start in range(0, len(x), chunk):
+        block = x[start:start + chunk]
+        d = c_sq[None, :] - 2.0 * (block @ centroids.T)
+        labels[start:start + chunk] = d.argmin(axis=1)
+    return labels
+
+
+def get_approx_index(index, n_lists=None):
+    # ScoreIndex ごとに 1 回だけ作って使い回す
+    cache = index.__dict__.setdefault("_approx_indexes", {})
+    if n_lists not in cache:
+        cache[n_lists] = ApproxIndex(index.contrib, n_lists=n_lists)
+    return cache[n_lists]
+
+
+# ============================
+# 再現率の計測（正確な結果と比べる）
+# ============================
+def measure_recall(index, weights, k=10, n_probes=(1, 2, 4, 8, 16, 32), n_lists=None):
+    # weights: (n_queries × n_viewpoints)。n_probe ごとの平均再現率と 1 件あたりの時間
+    approx = get_approx_index(index, n_lists=n_lists)
+    weights = np.atleast_2d(weights)
+
+    t0 = time.perf_counter()
+    exact = [top_k_rows(index.contrib @ w, k) for w in weights]
+    exact_ms = (time.perf_counter() - t0) * 1000.0 / len(weights)
+
+    report = []
+    for n_probe in n_probes:
+        hits = 0
+        t0 = time.perf_counter()
+        found = [approx.search(w, k, n_probe=n_probe)[0] for w in weights]
+        elapsed = (time.perf_counter() - t0) * 1000.0 / len(weights)
+        for a, e in zip(found, exact):
+            hits += len(np.intersect1d(a, e))
+        report.append({
+            "n_probe": n_probe,
+            "recall": hits / (k * len(weights)),
+            "ms_per_query": elapsed,
+            "exact_ms_per_query": exact_ms,
+        })
+    return report
@@ -0,0 +1,229 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from utils.scoring import ScoreIndex, catalog_version
+
+
+# ============================
+# 追加・更新・削除に追従するカタログ
+# ============================
+class IncrementalCatalog(ScoreIndex):
+    # ScoreIndex と同じ属性（norm / recip_rank / contrib / order / spots / spot_to_row）を
+    # 持つので、compute_user_preference や recommend_spots にそのまま渡せる
+    # 変更時は列ごとの min / max を追跡して、影響のある行・列だけを計算し直す
+    #   - 変更行の値が列の [min, max] に収まる  → その行だけ正規化・順位付け
+    #   - 列の min / max が動いた（まれ）        → その列を全行で正規化し直し、全行の順位を付け直す
+    # 書き込みは 1 スレッドずつ（lock）。読み手は変更のたびに version が変わることで区別できる
+    # 公開する配列は書き込み不可のビューで、公開済みの行を書き換える変更はバッファを複製してから
+    # 行う（コピーオンライト）。計算中の読み手が持っている配列が途中で書き換わることはない
+    # スポット名は一意であること
+
+    def __init__(self, spot_scores):
+        self.viewpoint_cols = [c for c in spot_scores.columns if c != "スポット"]
+        raw = spot_scores[self.viewpoint_cols].to_numpy(dtype=float)
+        names = list(spot_scores["スポット"])
+        if len(set(names)) != len(names):
+            raise ValueError("Duplicate spot names")
+
+        n_spots, n_views = raw.shape
+        capacity = max(16, 2 * n_spots)
+        self._n = n_spots
+        self._raw = np.empty((capacity, n_views))
+        self._norm = np.empty((capacity, n_views))
+        self._recip_rank = np.empty((capacity, n_views))
+        self._contrib = np.empty((capacity, n_views))
+        self._order = np.empty((capacity, n_views), dtype=np.int64)
+        self._spots = np.empty(capacity, dtype=object)
+        self._raw[:n_spots] = raw
+        self._spots[:n_spots] = names
+        self._shared = False  # 公開中のビューがバッファを指しているか
+
+        self.spot_to_row = {spot: i for i, spot in enumerate(names)}
+        self._duplicate_rows = {}
+        self._lock = threading.Lock()
+        self._base_version = catalog_version(spot_scores)
+        self.revision = 0
+        self.renormalizations = 0  # 列の min / max が動いて全体を計算し直した回数
+
+        self._refresh_bounds(np.arange(n_views))
+        self._renormalize(np.arange(n_views))
+        self._publish()
+
+    # ----------------------------
+    # 公開用のビュー
+    # ----------------------------
+    _PUBLISHED = ("_norm", "_recip_rank", "_contrib", "_order", "_spots")
+
+    def _publish(self):
+        n = self._n
+        for name in self._PUBLISHED:
+            view = getattr(self, name)[:n]
+            view.flags.writeable = False
+            setattr(self, name[1:], view)
+        self._shared = True
+        self.version = f"{self._base_version}+{self.revision}"
+
+        # 行列から作る遅延データは作り直し
+        self._viewpoint_lists = None
+        self._top5 = None
+        self.__dict__.pop("_approx_indexes", None)
+
+    def _own(self):
+        # 公開済みの行を書き換える前に呼ぶ。公開中のビューが指すバッファは
+        # 手放して複製を書き換え、_publish で差し替える
+        if self._shared:
+            for name in self._PUBLISHED:
+                old = getattr(self, name)
+                new = np.empty_like(old)
+                new[:self._n] = old[:self._n]  # 使っている行だけ（末尾の空きは触らない）
+                setattr(self, name, new)
+            self._shared = False
+
+    # ----------------------------
+    # 正規化・順位
+    # ----------------------------
+    def _refresh_bounds(self, cols):
+        raw = self._raw[:self._n]
+        if not hasattr(self, "col_min"):
+            n_views = len(self.viewpoint_cols)
+            self.col_min = np.zeros(n_views)
+            self.col_max = np.zeros(n_views)
+        if self._n:
+            self.col_min[cols] = raw[:, cols].min(axis=0)
+            self.col_max[cols] = raw[:, cols].max(axis=0)
+
+    def _normalize(self, raw, cols=slice(None)):
+        # minmax() と同じ規則（定数列は 1.0）。raw は cols の列だけ
+        col_min, col_max = self.col_min[cols], self.col_max[cols]
+        span = col_max - col_min
+        constant = span == 0
+        norm = (raw - col_min) / np.where(constant, 1.0, span)
+        norm[..., constant] = 1.0
+        return norm
+
+    def _rank_rows(self, rows):
+        norm = self._norm[rows]
+        order = np.argsort(-norm, axis=1, kind="stable")
+        ranks = np.empty_like(order)
+        ranks[np.arange(len(rows))[:, None], order] = np.arange(1, norm.shape[1] + 1)
+        self._order[rows] = order
+        self._recip_rank[rows] = 1.0 / ranks
+        self._contrib[rows] = norm * self._recip_rank[rows]
+
+    def _renormalize(self, cols):
+        # cols の列だけ全行で正規化し直し、全行の順位を付け直す
+        n = self._n
+        self._norm[:n, cols] = self._normalize(self._raw[:n, cols], cols)
+        self._rank_rows(np.arange(n))
+
+    def _apply(self, rows, old_values=None):
+        # rows の生スコアが変わった（追加・更新）か、old_values の行が消えた後に呼ぶ
+        old_min, old_max = self.col_min.copy(), self.col_max.copy()
+
+        # 範囲が広がった列
+        if len(rows):
+            new = self._raw[rows]
+            self.col_min = np.minimum(self.col_min, new.min(axis=0))
+            self.col_max = np.maximum(self.col_max, new.max(axis=0))
+
+        # 端の値を持っていた行が動いた・消えた列は、その列だけ走査し直す
+        if old_values is not None and len(old_values):
+            at_edge = (old_values == old_min).any(axis=0) | (old_values == old_max).any(axis=0)
+            self._refresh_bounds(np.flatnonzero(at_edge))
+
+        changed = (self.col_min != old_min) | (self.col_max != old_max)
+        if changed.any():
+            self.renormalizations += 1
+            self._own()
+            if len(rows):
+                self._norm[rows] = self._normalize(self._raw[rows])
+            self._renormalize(np.flatnonzero(changed))
+        elif len(rows):
+            self._norm[rows] = self._normalize(self._raw[rows])
+            self._rank_rows(rows)
+
+    def _grow(self):
+        capacity = 2 * len(self._raw)
+        for name in ("_raw",) + self._PUBLISHED:
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self._n] = old[:self._n]
+            setattr(self, name, new)
+        self._shared = False
+
+    def _row_values(self, scores):
+        if isinstance(scores, dict):
+            missing = [v for v in self.viewpoint_cols if v not in scores]
+            if missing:
+                raise ValueError(f"Missing viewpoints: {', '.join(missing)}")
+            return np.array([scores[v] for v in self.viewpoint_cols], dtype=float)
+        values = np.asarray(scores, dtype=float)
+        if values.shape != (len(self.viewpoint_cols),):
+            raise ValueError("Wrong number of viewpoint scores")
+        return values
+
+    # ----------------------------
+    # 変更操作
+    # ----------------------------
+    def add(self, spot, scores):
+        values = self._row_values(scores)
+        with self._lock:
+            if spot in self.spot_to_row:
+                raise ValueError(f"Spot already exists: {spot}")
+            if self._n == len(self._raw):
+                self._grow()
+            # 公開範囲の外の行に書くので、複製は列の範囲が動いたときだけ（_apply）
+            i = self._n
+            self._raw[i] = values
+            self._spots[i] = spot
+            self._n += 1
+            self.spot_to_row = {**self.spot_to_row, spot: i}
+            self._apply(np.array([i]))
+            self.revision += 1
+            self._publish()
+
+    def update(self, spot, scores):
+        values = self._row_values(scores)
+        with self._lock:
+            if spot not in self.spot_to_row:
+                raise ValueError(f"Unknown spot: {spot}")
+            i = self.spot_to_row[spot]
+            old = self._raw[i:i + 1].copy()
+            self._own()
+            self._raw[i] = values
+            self._apply(np.array([i]), old_values=old)
+            self.revision += 1
+            self._publish()
+
+    def remove(self, spot):
+        # 最後の行を空いた位置に移す（行順は変わる）
+        with self._lock:
+            if spot not in self.spot_to_row:
+                raise ValueError(f"Unknown spot: {spot}")
+            spot_to_row = dict(self.spot_to_row)
+            i = spot_to_row.pop(spot)
+            old = self._raw[i:i + 1].copy()
+            last = self._n - 1
+            self._own()
+            if i != last:
+                for name in ("_raw",) + self._PUBLISHED:
+                    arr = getattr(self, name)
+                    arr[i] = arr[last]
+                spot_to_row[self._spots[i]] = i
+            self.spot_to_row = spot_to_row
+            self._spots[last] = None
+            self._n -= 1
+            self._apply(np.empty(0, dtype=int), old_values=old)
+            self.revision += 1
+            self._publish()
+
+    def to_frame(self):
+        # 現在の生スコアを spot_scores と同じ形で返す
+        # attrs にその時点の version を持たせる（get_score_index で作り直しても同じ版を名乗る）
+        with self._lock:
+            df = pd.DataFrame(self._raw[:self._n].copy(), columns=self.viewpoint_cols)
+            df.insert(0, "スポット", self._spots[:self._n].copy())
+            df.attrs["catalog_version"] = self.version
+        return df
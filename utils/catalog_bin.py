@@ -0,0 +1,243 @@
+import argparse
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+
+
+# ============================
+# バイナリカタログ形式
+# ============================
+# [MAGIC 8B][header_len u32][header JSON][pad] [section ...]
+# 各セクションは 64 バイト境界に置き、header の "sections" に
+# offset / dtype / shape を記録する。読み込みは np.memmap で行うので
+# 複数のワーカープロセスがページキャッシュ上の 1 コピーを共有できる。
+MAGIC = b"TRCATLG\0"
+FORMAT_VERSION = 1
+ALIGN = 64
+
+REGION_FILES = {
+    "東京": "spot_list_tokyo.csv",
+    "関西": "spot_list_kansai.csv",
+    "中国地方": "spot_list_tyugoku.csv",
+}
+JALAN_FILES = [
+    "jalan_spots_tokyo.csv",
+    "jalan_spots_kansai.csv",
+    "jalan_spots_tyugoku.csv",
+]
+
+
+def source_files(data_dir="data"):
+    return (
+        [os.path.join(data_dir, "spot_scores.csv")]
+        + [os.path.join(data_dir, f) for f in REGION_FILES.values()]
+        + [os.path.join(data_dir, f) for f in JALAN_FILES]
+    )
+
+
+def _string_table(strings):
+    # UTF-8 を連結したバイト列と (n+1) 個のオフセット
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def _decode_strings(offsets, blob):
+    raw = blob.tobytes()
+    return [raw[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+
+# ============================
+# ビルド
+# ============================
+def build_catalog(out_path, data_dir="data"):
+    paths = source_files(data_dir)
+
+    h = hashlib.sha1()
+    for path in paths:
+        with open(path, "rb") as f:
+            h.update(f.read())
+    catalog_version = h.hexdigest()
+
+    spot_scores = pd.read_csv(paths[0])
+    viewpoints = [c for c in spot_scores.columns if c != "スポット"]
+
+    # --- 文字列表：スコアのある観光地が先頭（行番号 = スコア行列の行） ---
+    names = list(spot_scores["スポット"])
+    name_to_id = {}
+    for i, name in enumerate(names):
+        name_to_id.setdefault(name, i)
+
+    def intern(name):
+        if name not in name_to_id:
+            name_to_id[name] = len(names)
+            names.append(name)
+        return name_to_id[name]
+
+    regions = {}
+    for region, file in REGION_FILES.items():
+        spots = pd.read_csv(os.path.join(data_dir, file))["スポット"]
+        regions[region] = np.array([intern(s) for s in spots], dtype=np.int32)
+
+    url_by_id, reviews_by_id = {}, {}
+    for file in JALAN_FILES:
+        df = pd.read_csv(os.path.join(data_dir, file))
+        for spot, url, reviews in zip(df["スポット"], df["URL"], df["レビュー数"]):
+            i = intern(spot)
+            url_by_id[i] = url
+            reviews_by_id[i] = reviews
+
+    urls = [url_by_id.get(i, "") for i in range(len(names))]
+    review_counts = np.array([reviews_by_id.get(i, -1) for i in range(len(names))], dtype=np.int64)
+    has_url = np.array([i in url_by_id for i in range(len(names))], dtype=bool)
+
+    name_offsets, name_blob = _string_table(names)
+    url_offsets, url_blob = _string_table(urls)
+
+    sections = {
+        "scores": spot_scores[viewpoints].to_numpy(dtype=np.float32),
+        "name_offsets": name_offsets,
+        "name_blob": name_blob,
+        "url_offsets": url_offsets,
+        "url_blob": url_blob,
+        "has_url": has_url,
+        "review_counts": review_counts,
+    }
+    for region, ids in regions.items():
+        sections[f"region:{region}"] = ids
+
+    # --- セクション配置を決めてヘッダーを作る ---
+    def layout(header_len):
+        offset = _align(len(MAGIC) + 4 + header_len)
+        meta = {}
+        for key, arr in sections.items():
+            meta[key] = {"offset": offset, "dtype": arr.dtype.str, "shape": list(arr.shape)}
+            offset = _align(offset + arr.nbytes)
+        return meta
+
+    header = {
+        "format_version": FORMAT_VERSION,
+        "catalog_version": catalog_version,
+        "n_scored": len(spot_scores),
+        "viewpoints": viewpoints,
+        "regions": list(regions),
+        "sections": {},
+    }
+    # ヘッダー長がオフセットに依存するので、長さが変わらなくなるまで詰め直す
+    header_bytes = b""
+    while True:
+        header["sections"] = layout(len(header_bytes))
+        new_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        if len(new_bytes) == len(header_bytes):
+            break
+        header_bytes = new_bytes
+
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header_bytes)))
+        f.write(header_bytes)
+        for key, arr in sections.items():
+            f.write(b"\0" * (header["sections"][key]["offset"] - f.tell()))
+            f.write(np.ascontiguousarray(arr).tobytes())
+    os.replace(tmp_path, out_path)  # 読み手に書きかけのファイルを見せない
+
+    return header
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+# ============================
+# 読み込み（memory-map）
+# ============================
+class BinaryCatalog:
+    # build_catalog で作ったファイルを memory-map して読む
+    #   scores:        (n_scored × n_viewpoints) float32（memmap、読み取り専用）
+    #   spot_names:    全観光地名（先頭 n_scored 件が scores の行に対応）
+    #   regions:       地域名 → spot_names のインデックス配列
+    #   urls / has_url / review_counts: じゃらんの口コミ情報
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"Not a catalog file: {path}")
+            (header_len,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_len).decode("utf-8"))
+
+        if header["format_version"] != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported catalog format version: {header['format_version']}"
+            )
+
+        self.path = path
+        self.header = header
+        self.catalog_version = header["catalog_version"]
+        self.viewpoints = header["viewpoints"]
+        self.n_scored = header["n_scored"]
+
+        self._sections = {key: self._map(key) for key in header["sections"]}
+
+        self.scores = self._sections["scores"]
+        self.spot_names = _decode_strings(self._sections["name_offsets"], self._sections["name_blob"])
+        self.regions = {r: self._sections[f"region:{r}"] for r in header["regions"]}
+        self.has_url = self._sections["has_url"]
+        self.review_counts = self._sections["review_counts"]
+        self._url_offsets = self._sections["url_offsets"]
+        self._url_blob = self._sections["url_blob"]
+        self._cache = {}
+
+    def _map(self, key):
+        meta = self.header["sections"][key]
+        shape = tuple(meta["shape"])
+        if int(np.prod(shape)) == 0:
+            return np.empty(shape, dtype=meta["dtype"])
+        return np.memmap(self.path, dtype=meta["dtype"], mode="r", offset=meta["offset"], shape=shape)
+
+    # 以下は 1 回だけ作って使い回す（呼び出し側は書き換えないこと）
+    def spot_scores(self):
+        # load_all と同じ形の DataFrame（観点列は memmap をコピーせずに参照）
+        if "spot_scores" not in self._cache:
+            df = pd.DataFrame(self.scores, columns=self.viewpoints, copy=False)
+            df.insert(0, "スポット", self.spot_names[:self.n_scored])
+            df.attrs["catalog_version"] = self.catalog_version
+            self._cache["spot_scores"] = df
+        return self._cache["spot_scores"]
+
+    def spot_lists(self):
+        if "spot_lists" not in self._cache:
+            self._cache["spot_lists"] = {
+                region: [self.spot_names[i] for i in ids]
+                for region, ids in self.regions.items()
+            }
+        return self._cache["spot_lists"]
+
+    def spot_urls(self):
+        if "spot_urls" not in self._cache:
+            urls = _decode_strings(self._url_offsets, self._url_blob)
+            self._cache["spot_urls"] = {
+                self.spot_names[i]: urls[i]
+                for i in np.flatnonzero(self.has_url)
+            }
+        return self._cache["spot_urls"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="data/ の CSV からバイナリカタログを作る")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--out", default=os.path.join("data", "catalog.bin"))
+    args = parser.parse_args(argv)
+
+    header = build_catalog(args.out, data_dir=args.data_dir)
+    print(f"wrote {args.out}: {header['n_scored']} spots x {len(header['viewpoints'])} viewpoints, "
+          f"version {header['catalog_version'][:12]}")
+
+
+if __name__ == "__main__":
+    main()
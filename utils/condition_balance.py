@@ -0,0 +1,204 @@
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+
+# =====================
+# 条件割り当て（4C2 = 6通り）
+# =====================
+CONDITIONS = [
+    ("noaspect_all", "aspect_all"),
+    ("noaspect_all", "aspect_top5"),
+    ("noaspect_all", "aspect_exclude_interest_top5"),
+    ("aspect_all", "aspect_top5"),
+    ("aspect_all", "aspect_exclude_interest_top5"),
+    ("aspect_top5", "aspect_exclude_interest_top5")
+]
+
+
+def count_condition_pairs(backend):
+    # シートの condition_pair 列だけを読んで数える（キーは "A|B" 形式）
+    counts = {"|".join(c): 0 for c in CONDITIONS}
+    header = backend.header()
+    if "condition_pair" not in header:
+        return counts
+
+    values = backend.column_values(header.index("condition_pair") + 1)
+    for cond in values[1:]:  # 1行目はヘッダー
+        if cond in counts:
+            counts[cond] += 1
+    return counts
+
+
+class ConditionBalancer:
+    # 6 通りの条件ペアの使用回数をメモリ（+ ローカルの JSON）に持ち、
+    # 最も少ないペアを O(1) で割り当てる
+    #   logged:   ログに書かれた回数（定期的にシートと突き合わせる）
+    #   inflight: 割り当て済みでまだログに書かれていないセッション（user_id → 割り当て時刻、ttl で失効）
+    # 実効回数 = logged + inflight で最小のペアを選ぶので、同時に来た参加者にも
+    # 別のペアが配られる
+    # 起動直後の最初の割り当てはシートと突き合わせてから行う（以降の突き合わせは別スレッド）
+
+    def __init__(
+        self,
+        count_source=None,
+        store_path="condition_counts.json",
+        reconcile_interval=300.0,
+        inflight_ttl=1800.0
+    ):
+        self.count_source = count_source  # () -> {"A|B": n}（シートの件数）
+        self.store_path = store_path
+        self.reconcile_interval = reconcile_interval
+        self.inflight_ttl = inflight_ttl
+
+        self._lock = threading.Lock()
+        self.logged = {"|".join(c): 0 for c in CONDITIONS}
+        self.inflight = {key: {} for key in self.logged}
+        self._recorded = {key: 0 for key in self.logged}  # record_logged の累計（突き合わせ用）
+        self.last_reconciled = None
+        self._reconciling = False
+        self._first_reconcile = threading.Event()
+        self._load()
+
+    # ----------------------------
+    # ローカル保存
+    # ----------------------------
+    def _load(self):
+        if self.store_path is None or not os.path.exists(self.store_path):
+            return
+        try:
+            with open(self.store_path, encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return
+        for key, n in stored.get("logged", {}).items():
+            if key in self.logged:
+                self.logged[key] = int(n)
+
+    def _save(self):
+        if self.store_path is None:
+            return
+        tmp_path = self.store_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"logged": self.logged}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.store_path)
+
+    # ----------------------------
+    # 割り当て
+    # ----------------------------
+    def _expire(self, now):
+        for key, started in self.inflight.items():
+            self.inflight[key] = {
+                user_id: t for user_id, t in started.items() if now - t < self.inflight_ttl
+            }
+
+    def assign(self, user_id=None):
+        # user_id: セッションの識別子（ログの user_id 列と同じ）。同じ user_id の割り当て直しは
+        # 前の割り当てを取り消す。省略時は照合できないので ttl まで数える
+        self._maybe_reconcile()
+        if user_id is None:
+            user_id = uuid.uuid4().hex
+
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            for started in self.inflight.values():
+                started.pop(user_id, None)
+
+            counts = {k: self.logged[k] + len(self.inflight[k]) for k in self.logged}
+            min_count = min(counts.values())
+            candidates = [k for k, v in counts.items() if v == min_count]
+
+            chosen = random.choice(candidates)
+            self.inflight[chosen][user_id] = now
+
+        condA, condB = chosen.split("|")
+        return (condA, condB)
+
+    def record_logged(self, condition_pair, user_id=None):
+        # condition_pair: "A|B" 形式
+        # 同じ user_id の割り当てだけを inflight から外す（該当が無い行は他の参加者のものに触らない）
+        with self._lock:
+            if condition_pair not in self.logged:
+                return
+            self.logged[condition_pair] += 1
+            self._recorded[condition_pair] += 1
+            self.inflight[condition_pair].pop(user_id, None)
+            self._save()
+
+    def on_logs_written(self, records):
+        # LogSink の on_written コールバック
+        for data in records:
+            self.record_logged(data.get("condition_pair", ""), data.get("user_id"))
+
+    # ----------------------------
+    # シートとの突き合わせ
+    # ----------------------------
+    def reconcile(self):
+        # シートを読んでいる間（ロックの外）に record_logged された分は、シートの件数に
+        # 入っていない可能性があるので上乗せする（入っていた分は次の突き合わせで直る）
+        if self.count_source is None:
+            return
+        with self._lock:
+            before = dict(self._recorded)
+        counts = self.count_source()
+        with self._lock:
+            for key in self.logged:
+                self.logged[key] = int(counts.get(key, 0)) + self._recorded[key] - before[key]
+            self.last_reconciled = time.time()
+            self._save()
+
+    def _maybe_reconcile(self, first_timeout=30.0):
+        # 古くなっていたら別スレッドで突き合わせる（割り当ては待たせない）
+        # まだ一度も突き合わせていなければ、その場で突き合わせる（他のスレッドが
+        # 突き合わせ中なら最大 first_timeout 秒待つ）
+        with self._lock:
+            if self.count_source is None:
+                return
+            cold = self.last_reconciled is None
+            stale = cold or time.time() - self.last_reconciled >= self.reconcile_interval
+            start = stale and not self._reconciling
+            if start:
+                self._reconciling = True
+
+        def run():
+            try:
+                self.reconcile()
+            except Exception:
+                pass  # 次の割り当て時にまた試す
+            finally:
+                with self._lock:
+                    self._reconciling = False
+                    if self.last_reconciled is None:
+                        self.last_reconciled = time.time() - self.reconcile_interval + 30.0
+                self._first_reconcile.set()
+
+        if start and cold:
+            run()
+        elif start:
+            threading.Thread(target=run, name="condition-reconcile", daemon=True).start()
+        elif cold:
+            self._first_reconcile.wait(first_timeout)
+
+
+# ============================
+# プロセス内で共有するバランサー
+# ============================
+_balancer = None
+_balancer_lock = threading.Lock()
+
+
+def get_condition_balancer(backend_factory=None, **kwargs):
+    # 最初の呼び出しでだけ backend_factory() を呼び、そのシートと突き合わせる
+    global _balancer
+    with _balancer_lock:
+        if _balancer is None:
+            count_source = None
+            if backend_factory is not None:
+                backend = backend_factory()
+                count_source = lambda: count_condition_pairs(backend)
+            _balancer = ConditionBalancer(count_source=count_source, **kwargs)
+        return _balancer
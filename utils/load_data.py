@@ -1,6 +1,95 @@
+import hashlib
+import io
+import os
+import threading
 import pandas as pd
 import ast
 
+from utils.metrics import timed
+
+
+# ============================
+# CSV キャッシュ（プロセス内で共有）
+# ============================
+# path -> {"mtime", "size", "digest", "df"}
+# mtime / サイズが変わったら内容ハッシュを取り直し、変わっていれば読み直す
+# 返す DataFrame は全セッションで共有されるので書き換えないこと
+_csv_cache = {}
+# name -> (依存ファイルの digest のタプル, 値)
+_derived_cache = {}
+_cache_lock = threading.RLock()
+
+
+def read_csv_cached(path):
+    with _cache_lock:
+        stat = os.stat(path)
+        entry = _csv_cache.get(path)
+        if entry is not None and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            return entry["df"]
+
+        with open(path, "rb") as f:
+            raw = f.read()
+        digest = hashlib.sha1(raw).hexdigest()
+
+        if entry is None or entry["digest"] != digest:
+            df = pd.read_csv(io.BytesIO(raw))
+        else:
+            df = entry["df"]  # 触られただけで内容は同じ
+
+        _csv_cache[path] = {
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "digest": digest,
+            "df": df,
+        }
+        return df
+
+
+def _cached_derived(name, paths, build):
+    # paths の CSV から build(*dfs) で作る値を、どれかの内容が変わるまで使い回す
+    with _cache_lock:
+        dfs = [read_csv_cached(p) for p in paths]
+        key = tuple(_csv_cache[p]["digest"] for p in paths)
+        entry = _derived_cache.get(name)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+
+        value = build(*dfs)
+        _derived_cache[name] = (key, value)
+        return value
+
+
+# ============================
+# バイナリカタログ（あれば CSV の代わりに使う）
+# ============================
+CATALOG_BIN = "data/catalog.bin"
+_binary_catalog = {}  # path -> (mtime, BinaryCatalog)
+
+
+def load_binary_catalog(path=CATALOG_BIN):
+    # python -m utils.catalog_bin で作ったファイルを memory-map して返す
+    # 無い場合・元の CSV の方が新しい場合は None（CSV から読む）
+    from utils.catalog_bin import BinaryCatalog, source_files
+
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    data_dir = os.path.dirname(path)
+    for src in source_files(data_dir):
+        if os.path.exists(src) and os.stat(src).st_mtime_ns > mtime:
+            return None
+
+    with _cache_lock:
+        entry = _binary_catalog.get(path)
+        if entry is None or entry[0] != mtime:
+            entry = (mtime, BinaryCatalog(path))
+            _binary_catalog[path] = entry
+        return entry[1]
+
+
+@timed("load_all")
 def load_all():
     viewpoint_list = [
         "山岳", "高原・湿原・原野", "湖沼", "河川・峡谷", "滝", "海岸・岬",
@@ -10,17 +99,30 @@ def load_all():
         "テーマ公園・テーマ施設", "温泉", "食"
     ]
 
-    spot_scores = pd.read_csv("data/spot_scores.csv")
+    catalog = load_binary_catalog()
+    if catalog is not None:
+        return viewpoint_list, catalog.spot_lists(), catalog.spot_scores()
+
+    spot_scores = read_csv_cached("data/spot_scores.csv")
 
     # 地域ごとのスポットリストを全部ロード
-    spot_lists = {
-        "東京": list(pd.read_csv("data/spot_list_tokyo.csv")["スポット"]),
-        "関西": list(pd.read_csv("data/spot_list_kansai.csv")["スポット"]),
-        "中国地方": list(pd.read_csv("data/spot_list_tyugoku.csv")["スポット"]),
-    }
+    spot_lists = _cached_derived(
+        "spot_lists",
+        [
+            "data/spot_list_tokyo.csv",
+            "data/spot_list_kansai.csv",
+            "data/spot_list_tyugoku.csv",
+        ],
+        lambda tokyo, kansai, tyugoku: {
+            "東京": list(tokyo["スポット"]),
+            "関西": list(kansai["スポット"]),
+            "中国地方": list(tyugoku["スポット"]),
+        }
+    )
 
     return viewpoint_list, spot_lists, spot_scores
 
+@timed("load_spot_urls")
 def load_spot_urls():
     files = [
         "data/jalan_spots_tokyo.csv",
@@ -28,16 +130,18 @@ def load_spot_urls():
         "data/jalan_spots_tyugoku.csv"
     ]
 
-    url_dict = {}
+    catalog = load_binary_catalog()
+    if catalog is not None:
+        return catalog.spot_urls()
 
-    for file in files:
-        df = pd.read_csv(file)
-        for _, row in df.iterrows():
-            spot = row["スポット"]
-            url = row["URL"]
-            url_dict[spot] = url
+    def build(*dfs):
+        # 列単位で辞書化（後のファイルが優先）
+        url_dict = {}
+        for df in dfs:
+            url_dict.update(zip(df["スポット"], df["URL"]))
+        return url_dict
 
-    return url_dict
+    return _cached_derived("spot_urls", files, build)
 
 def load_viewpoint_descriptions():
     return {
@@ -0,0 +1,25 @@
+import json
+
+
+# ============================
+# 実験ログのセル（JSON 文字列・カンマ区切り）の読み取り
+# ============================
+def load_json(value, default):
+    # JSON 文字列のセル → 値（空・壊れている場合は default、読み込み済みならそのまま）
+    if isinstance(value, (list, dict)):
+        return value
+    if not isinstance(value, str) or value == "":
+        return default
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return default
+
+
+def split_list(value):
+    # "a,b,c" 形式のセル → リスト（リストならそのまま）
+    if isinstance(value, list):
+        return value
+    if not isinstance(value, str) or value == "":
+        return []
+    return value.split(",")
@@ -0,0 +1,248 @@
+import csv
+import json
+import os
+import random
+import sqlite3
+import threading
+
+
+# ============================
+# 書き込み先（バックエンド）
+# ============================
+# どのバックエンドも以下の 4 つを持つ
+#   header()              -> 現在のヘッダー行（list）
+#   update_header(header) -> ヘッダー行を書き換える
+#   append_rows(rows)     -> 複数行をまとめて追記する
+#   column_values(col)    -> 1 列分の値（1始まりの列番号、ヘッダーを含む）
+
+class MemoryBackend:
+    # テスト用：メモリ上のシート
+    def __init__(self):
+        self.header_row = []
+        self.rows = []
+        self.lock = threading.Lock()
+
+    def header(self):
+        with self.lock:
+            return list(self.header_row)
+
+    def update_header(self, header):
+        with self.lock:
+            self.header_row = list(header)
+
+    def append_rows(self, rows):
+        with self.lock:
+            self.rows.extend(list(r) for r in rows)
+
+    def column_values(self, col):
+        with self.lock:
+            values = [self.header_row] + self.rows
+            return [str(r[col - 1]) if len(r) >= col else "" for r in values]
+
+
+class FileBackend:
+    # ローカル CSV をシートの代わりに使う（1行目がヘッダー）
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, newline="", encoding="utf-8") as f:
+            return list(csv.reader(f))
+
+    def header(self):
+        with self.lock:
+            values = self._read()
+            return values[0] if values else []
+
+    def update_header(self, header):
+        with self.lock:
+            values = self._read()
+            values[:1] = [list(header)]
+            with open(self.path, "w", newline="", encoding="utf-8") as f:
+                csv.writer(f).writerows(values)
+
+    def append_rows(self, rows):
+        with self.lock:
+            with open(self.path, "a", newline="", encoding="utf-8") as f:
+                csv.writer(f).writerows(rows)
+
+    def column_values(self, col):
+        with self.lock:
+            return [r[col - 1] if len(r) >= col else "" for r in self._read()]
+
+
+class GoogleSheetBackend:
+    # Google Sheets（sheet1）に書く
+    # 認証済みクライアントは SheetsClientProvider でプロセス内共有する
+    def __init__(self, provider, sheet_id=None):
+        self.provider = provider
+        self.sheet_id = sheet_id
+
+    def header(self):
+        # シート全体ではなく 1 行目だけ取る
+        return self.provider.call("row_values", 1, sheet_id=self.sheet_id)
+
+    def update_header(self, header):
+        self.provider.call("update", '1:1', [list(header)], sheet_id=self.sheet_id)
+
+    def append_rows(self, rows):
+        self.provider.call("append_rows", [list(r) for r in rows], sheet_id=self.sheet_id)
+
+    def column_values(self, col):
+        return self.provider.call("col_values", col, sheet_id=self.sheet_id)
+
+
+# ============================
+# ローカルスプール付きログシンク
+# ============================
+class LogSink:
+    # submit() はローカルの SQLite スプールに書いてすぐ戻る
+    # バックグラウンドのスレッドがまとめてバックエンドへ送る（失敗したら指数バックオフで再試行）
+    # 送信済みになるまでスプールに残るので、プロセスが落ちても次回起動時に送られる
+
+    def __init__(
+        self,
+        backend,
+        spool_path="log_spool.db",
+        batch_size=50,
+        flush_interval=2.0,
+        max_backoff=60.0,
+        on_written=None
+    ):
+        self.backend = backend
+        self.spool_path = spool_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.on_written = on_written  # 送信できた record のリストを受け取るコールバック
+
+        self._header = None  # バックエンドのヘッダーのキャッシュ
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.failures = 0
+        self.last_error = None
+
+        self._execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " payload TEXT NOT NULL)"
+        )
+
+    def _execute(self, sql, params=()):
+        # 1 文ごとに接続を開いてコミットし、閉じる（スレッド間で接続を共有しない）
+        with self._lock:
+            conn = sqlite3.connect(self.spool_path, timeout=30)
+            try:
+                with conn:
+                    return conn.execute(sql, params).fetchall()
+            finally:
+                conn.close()
+
+    # ----------------------------
+    # 受け付け
+    # ----------------------------
+    def submit(self, data):
+        payload = json.dumps(data, ensure_ascii=False)
+        self._execute("INSERT INTO spool (payload) VALUES (?)", (payload,))
+        self._wakeup.set()
+
+    def pending(self):
+        return self._execute("SELECT COUNT(*) FROM spool")[0][0]
+
+    # ----------------------------
+    # 送信
+    # ----------------------------
+    def flush_once(self):
+        # スプールの先頭から最大 batch_size 件を送る。送った件数を返す
+        batch = self._execute(
+            "SELECT id, payload FROM spool ORDER BY id LIMIT ?",
+            (self.batch_size,)
+        )
+        if not batch:
+            return 0
+
+        records = [json.loads(payload) for _, payload in batch]
+
+        # ★ 新しいキーがあればヘッダーを先に更新する
+        # キャッシュで済ませず 1 行目を読み直し、外で変えられたヘッダーの上に足す（列がずれないように）
+        if self._header is None or any(k not in self._header for data in records for k in data):
+            self._header = list(self.backend.header())
+        header = list(self._header)
+        for data in records:
+            header += [k for k in data.keys() if k not in header]
+        if header != self._header:
+            self.backend.update_header(header)
+            self._header = header
+
+        rows = [[data.get(col, "") for col in header] for data in records]
+        self.backend.append_rows(rows)
+
+        self._execute(
+            f"DELETE FROM spool WHERE id IN ({','.join('?' * len(batch))})",
+            [row_id for row_id, _ in batch]
+        )
+
+        if self.on_written is not None:
+            self.on_written(records)
+
+        return len(batch)
+
+    def flush(self):
+        # スプールが空になるまで同期的に送る（テスト・終了処理用）
+        while self.flush_once():
+            pass
+
+    def _run(self):
+        attempt = 0
+        while not self._stop.is_set():
+            try:
+                sent = self.flush_once()
+                attempt = 0
+                self.failures = 0
+                if sent == self.batch_size:
+                    continue  # まだ残っていればすぐ次へ
+            except Exception as e:  # バックエンドの例外は全部再試行する
+                attempt += 1
+                self.failures += 1
+                self.last_error = e
+                self._header = None  # ヘッダーがずれた可能性があるので取り直す
+                delay = min(self.max_backoff, self.flush_interval * 2 ** attempt)
+                self._stop.wait(delay * random.uniform(0.5, 1.0))
+                continue
+
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="log-sink", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+# ============================
+# プロセス内で共有するシンク
+# ============================
+_sink = None
+_sink_lock = threading.Lock()
+
+
+def get_log_sink(backend_factory, **kwargs):
+    # 最初の呼び出しでだけ backend_factory() を呼んでシンクを作り、フラッシャーを起動する
+    global _sink
+    with _sink_lock:
+        if _sink is None:
+            _sink = LogSink(backend_factory(), **kwargs).start()
+        return _sink
@@ -0,0 +1,328 @@
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from utils.log_cells import load_json, split_list
+
+
+# save_log が書くシートの列（この順で書き出す）
+SHEET_COLUMNS = [
+    "user_id", "name", "age_group", "condition_pair",
+    "selected_viewpoints", "visited_spots", "spot_feedback",
+    "recA", "recB", "excludedA", "excludedB", "user_pref_A", "user_pref_B",
+    "sat_A", "favor_A", "sat_B", "favor_B",
+    "spot_questions",
+    "ab_choice", "ab_why",
+    "match_compare", "match_why", "accept_compare", "aspect_comment_compare",
+    "timestamp",
+]
+TEXT_COLUMNS = [
+    "user_id", "name", "age_group",
+    "ab_choice", "ab_why", "match_compare", "match_why", "accept_compare", "aspect_comment_compare",
+]
+INT_COLUMNS = ["sat_A", "favor_A", "sat_B", "favor_B"]
+
+
+# ============================
+# スキーマ（pyarrow は使うときだけ読み込む）
+# ============================
+def log_schema():
+    import pyarrow as pa
+
+    rec = pa.list_(pa.struct([("spot", pa.string()), ("score", pa.float64())]))
+    excluded = pa.list_(pa.struct([("spot", pa.string()), ("rank", pa.int32())]))
+    pref = pa.list_(pa.struct([
+        ("viewpoint", pa.string()), ("score", pa.float64()), ("interest", pa.int8()),
+    ]))
+    return pa.schema(
+        [(c, pa.string()) for c in TEXT_COLUMNS[:3]]
+        + [
+            ("condA", pa.dictionary(pa.int8(), pa.string())),
+            ("condB", pa.dictionary(pa.int8(), pa.string())),
+            ("selected_viewpoints", pa.list_(pa.string())),
+            ("visited_spots", pa.list_(pa.string())),
+            ("spot_feedback", pa.list_(pa.struct([
+                ("spot", pa.string()), ("viewpoints", pa.list_(pa.string())),
+            ]))),
+            ("recA", rec), ("recB", rec),
+            ("excludedA", excluded), ("excludedB", excluded),
+            ("user_pref_A", pref), ("user_pref_B", pref),
+        ]
+        + [(c, pa.int8()) for c in INT_COLUMNS]
+        + [
+            ("spot_questions", pa.list_(pa.struct([
+                # 回答は JSON 文字列（"知らなかった" / 3 など型がまちまちなため）
+                ("spot", pa.string()), ("question", pa.string()), ("answer", pa.string()),
+            ]))),
+        ]
+        + [(c, pa.string()) for c in TEXT_COLUMNS[3:]]
+        + [
+            ("timestamp", pa.timestamp("us")),
+            # スキーマに無いキー（後から save_log に増えた列など）は文字列のまま残す
+            ("extra", pa.map_(pa.string(), pa.string())),
+        ]
+    )
+
+
+# ============================
+# save_log の 1 件 ⇔ 型付きの 1 行
+# ============================
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def record_to_row(data):
+    # save_log に渡す dict（JSON 文字列のセルを含む）→ log_schema() の 1 行
+    pair = data.get("condition_pair") or ""
+    condA, condB = pair.split("|", 1) if "|" in pair else (data.get("condition") or None, None)
+
+    timestamp = data.get("timestamp")
+    try:
+        timestamp = datetime.fromisoformat(timestamp) if timestamp else None
+    except ValueError:
+        timestamp = None
+
+    row = {c: (None if data.get(c) is None else str(data.get(c))) for c in TEXT_COLUMNS}
+    row.update({
+        "condA": condA,
+        "condB": condB,
+        "selected_viewpoints": split_list(data.get("selected_viewpoints")),
+        "visited_spots": split_list(data.get("visited_spots")),
+        "spot_feedback": [
+            {"spot": spot, "viewpoints": list((fb or {}).get("viewpoints", []))}
+            for spot, fb in load_json(data.get("spot_feedback"), {}).items()
+        ],
+        "spot_questions": [
+            {"spot": spot, "question": q, "answer": json.dumps(a, ensure_ascii=False)}
+            for spot, answers in load_json(data.get("spot_questions"), {}).items()
+            for q, a in (answers or {}).items()
+        ],
+        "timestamp": timestamp,
+    })
+    for arm in ("A", "B"):
+        row[f"rec{arm}"] = [
+            {"spot": r.get("スポット"), "score": r.get("スコア")}
+            for r in load_json(data.get(f"rec{arm}"), [])
+        ]
+        row[f"excluded{arm}"] = [
+            {"spot": e.get("スポット"), "rank": e.get("順位")}
+            for e in load_json(data.get(f"excluded{arm}"), [])
+        ]
+        row[f"user_pref_{arm}"] = [
+            {"viewpoint": p.get("観点"), "score": p.get("総合スコア"), "interest": p.get("興味あり")}
+            for p in load_json(data.get(f"user_pref_{arm}"), [])
+        ]
+    for c in INT_COLUMNS:
+        row[c] = _int_or_none(data.get(c))
+
+    row["extra"] = [(k, str(v)) for k, v in data.items() if k not in SHEET_COLUMNS]
+    return row
+
+
+def row_to_record(row, display_columns=True):
+    # log_schema() の 1 行 → save_log と同じ形の dict（シートの 1 行）
+    # display_columns: Step 3 が嗜好の DataFrame に足す表示用の列も出す（今のログと同じ形）
+    def dumps(value):
+        return json.dumps(value, ensure_ascii=False)
+
+    data = {
+        "user_id": row["user_id"],
+        "name": row["name"],
+        "age_group": row["age_group"],
+        "condition_pair": f"{row['condA']}|{row['condB']}" if row["condB"] is not None else "",
+        "selected_viewpoints": ",".join(row["selected_viewpoints"] or []),
+        "visited_spots": ",".join(row["visited_spots"] or []),
+        "spot_feedback": dumps({
+            fb["spot"]: {"viewpoints": list(fb["viewpoints"] or [])}
+            for fb in row["spot_feedback"] or []
+        }),
+    }
+    for arm in ("A", "B"):
+        data[f"rec{arm}"] = dumps([
+            {"スポット": r["spot"], "スコア": r["score"]} for r in row[f"rec{arm}"] or []
+        ])
+    for arm in ("A", "B"):
+        data[f"excluded{arm}"] = dumps([
+            {"スポット": e["spot"], "順位": e["rank"]} for e in row[f"excluded{arm}"] or []
+        ])
+    for arm in ("A", "B"):
+        prefs = []
+        for p in row[f"user_pref_{arm}"] or []:
+            entry = {"観点": p["viewpoint"], "総合スコア": p["score"], "興味あり": p["interest"]}
+            if display_columns:
+                entry.update({
+                    "元々興味あり": "〇" if p["interest"] != 0 else "",
+                    "あなたの好み": p["viewpoint"],
+                    "スコア": p["score"],
+                })
+            prefs.append(entry)
+        data[f"user_pref_{arm}"] = dumps(prefs)
+    for c in INT_COLUMNS:
+        data[c] = row[c] if row[c] is not None else ""
+
+    questions = {}
+    for q in row["spot_questions"] or []:
+        questions.setdefault(q["spot"], {})[q["question"]] = json.loads(q["answer"])
+    data["spot_questions"] = dumps(questions)
+
+    for c in TEXT_COLUMNS[3:]:
+        data[c] = row[c] if row[c] is not None else ""
+    data["timestamp"] = row["timestamp"].isoformat() if row["timestamp"] is not None else ""
+    for k, v in row["extra"] or []:
+        data[k] = v
+    return data
+
+
+# ============================
+# ローカルの列指向ログ（日付ごとの Parquet）
+# ============================
+class ColumnarLogStore:
+    # root/date=YYYY-MM-DD/part-*.parquet に追記していく（ファイルは書いたら変更しない）
+    # 読むときは必要な列だけを pyarrow.dataset で読む
+
+    def __init__(self, root="log_store"):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def append(self, records):
+        # save_log の dict のリスト → 日付ごとに 1 ファイル
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not records:
+            return []
+        schema = log_schema()
+        by_date = {}
+        for data in records:
+            row = record_to_row(data)
+            day = (row["timestamp"] or datetime.now()).strftime("%Y-%m-%d")
+            by_date.setdefault(day, []).append(row)
+
+        paths = []
+        with self._lock:
+            for day, rows in by_date.items():
+                part_dir = os.path.join(self.root, f"date={day}")
+                os.makedirs(part_dir, exist_ok=True)
+                name = f"part-{time.strftime('%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet"
+                path = os.path.join(part_dir, name)
+                tmp_path = path + ".tmp"
+                pq.write_table(pa.Table.from_pylist(rows, schema=schema), tmp_path)
+                os.replace(tmp_path, path)
+                paths.append(path)
+        return paths
+
+    def dataset(self):
+        import pyarrow.dataset as ds
+
+        return ds.dataset(
+            self.root, format="parquet", partitioning="hive",
+            schema=log_schema(), exclude_invalid_files=True
+        )
+
+    def read(self, columns=None, filter=None):
+        # columns を指定すると、その列だけをディスクから読む
+        if not os.path.isdir(self.root):
+            return log_schema().empty_table().select(columns or log_schema().names)
+        return self.dataset().to_table(columns=columns, filter=filter)
+
+    # ----------------------------
+    # シートの形への書き出し
+    # ----------------------------
+    def export_records(self, display_columns=True):
+        table = self.read().sort_by([("timestamp", "ascending")])
+        return [row_to_record(row, display_columns) for row in table.to_pylist()]
+
+    def export_csv(self, path, display_columns=True):
+        import csv
+
+        records = self.export_records(display_columns)
+        header = list(SHEET_COLUMNS)
+        for data in records:
+            header += [k for k in data if k not in header]
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=header, restval="")
+            writer.writeheader()
+            writer.writerows(records)
+        return len(records)
+
+    # ----------------------------
+    # よく使う集計
+    # ----------------------------
+    def mean_excluded_rank(self):
+        # 条件ごとの「除外された訪問済みスポットの平均順位」
+        # condA/condB と excludedA/excludedB の 4 列だけを読む
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        table = self.read(columns=["condA", "condB", "excludedA", "excludedB"])
+        parts = []
+        for arm in ("A", "B"):
+            excluded = table[f"excluded{arm}"]
+            cond = table[f"cond{arm}"].cast(pa.string())
+            parents = pc.list_parent_indices(excluded)
+            ranks = pc.struct_field(pc.list_flatten(excluded), "rank")
+            parts.append(pa.table({"condition": pc.take(cond, parents), "rank": ranks}))
+        result = (
+            pa.concat_tables(parts)
+            .group_by("condition")
+            .aggregate([("rank", "mean"), ("rank", "count")])
+        )
+        return result.to_pandas().rename(columns={"rank_mean": "mean_rank", "rank_count": "n"})
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_log_store(root="log_store"):
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ColumnarLogStore(root)
+        return _store
+
+
+def log_store_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+# ============================
+# CLI
+# ============================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="列指向ログ（Parquet）の取り込み・書き出し・集計")
+    parser.add_argument("--root", default="log_store")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_import = sub.add_parser("import", help="シートから書き出した CSV を取り込む")
+    p_import.add_argument("csv")
+    p_export = sub.add_parser("export", help="シートと同じ列の CSV を書き出す")
+    p_export.add_argument("out")
+    sub.add_parser("excluded-rank", help="条件ごとの除外スポットの平均順位")
+    args = parser.parse_args(argv)
+
+    store = ColumnarLogStore(args.root)
+    if args.command == "import":
+        import pandas as pd
+
+        df = pd.read_csv(args.csv, dtype=str, keep_default_na=False)
+        paths = store.append(df.to_dict(orient="records"))
+        print(f"{len(df)} rows -> {len(paths)} files")
+    elif args.command == "export":
+        print(f"{store.export_csv(args.out)} rows -> {args.out}")
+    else:
+        print(store.mean_excluded_rank().to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.log_cells import load_json
+
+
+# ============================
+# 表の列と型
+# ============================
+# 参加者 1 人 1 行（旧形式は condition だけなので condA に入れる）
+SESSION_COLUMNS = {
+    "user_id": "string",
+    "condA": "category",
+    "condB": "category",
+    "age_group": "category",
+    "n_selected_viewpoints": "Int16",
+    "sat_A": "Int8",
+    "favor_A": "Int8",
+    "sat_B": "Int8",
+    "favor_B": "Int8",
+    "match_A": "Int8",
+    "ab_choice": "Int8",
+    "match_compare": "Int8",
+    "accept_compare": "Int8",
+    "timestamp": "datetime64[ns]",
+}
+TABLE_COLUMNS = {
+    "sessions": SESSION_COLUMNS,
+    # 行った観光地 × 良かった観点
+    "spot_feedback": {
+        "user_id": "string", "position": "Int8", "spot": "string", "viewpoint": "category",
+    },
+    # 推薦リスト（A/B）の各順位
+    "recommendations": {
+        "user_id": "string", "arm": "category", "condition": "category",
+        "rank": "Int16", "spot": "string", "score": "float64",
+    },
+    # 推薦から除外された訪問済みスポットの全体順位
+    "excluded": {
+        "user_id": "string", "arm": "category", "condition": "category",
+        "spot": "string", "rank": "Int32",
+    },
+    # 推定された嗜好（観点ごと）
+    "preferences": {
+        "user_id": "string", "arm": "category", "condition": "category",
+        "rank": "Int16", "viewpoint": "category", "score": "float64", "interest": "Int8",
+    },
+    # Step 2 の観光地ごとの質問（visited / likability など）
+    "spot_questions": {
+        "user_id": "string", "spot": "string", "question": "category", "answer": "string",
+    },
+}
+
+# 5 段階の選択肢 → 1..5（ログには文言で残っている）
+AB_CHOICES = ["1: A がよい", "2: どちらかというとA がよい", "3: どちらとも言えない", "4: どちらかというとB がよい", "5: B がよい"]
+MATCH_CHOICES = ["A の方が近い", "どちらかというと A", "どちらとも言えない", "どちらかというと B", "B の方が近い"]
+ACCEPT_CHOICES = ["A の方が多い", "どちらかというと A", "どちらとも言えない", "どちらかというと B", "B の方が多い"]
+
+
+def _choice_codes(values, choices):
+    # 文言 → 1..5（前後の空白は無視、該当なしは欠損）
+    lookup = {c.strip(): i + 1 for i, c in enumerate(choices)}
+    return pd.array([lookup.get(str(v).strip()) for v in values], dtype="Int8")
+
+
+def _column(chunk, name):
+    if name in chunk.columns:
+        return chunk[name]
+    return pd.Series([""] * len(chunk), index=chunk.index, dtype=object)
+
+
+def _typed(rows, table):
+    columns = TABLE_COLUMNS[table]
+    df = pd.DataFrame(rows, columns=list(columns))
+    return df.astype(columns)
+
+
+# ============================
+# チャンク 1 つ分の平坦化
+# ============================
+def flatten_chunk(chunk):
+    # ログ（CSV を dtype=str で読んだもの）の 1 チャンク → {表の名前: DataFrame}
+    # save_log の形式（condition_pair / sat_A ...）と旧形式（condition / satisfaction ...）の両方を読む
+    pair = _column(chunk, "condition_pair").fillna("")
+    is_pair = pair.str.contains("|", regex=False)
+    split = pair.where(is_pair, "|").str.split("|", n=1, expand=True)
+    condA = split[0].where(is_pair, _column(chunk, "condition").fillna(""))
+    condB = split[1].where(is_pair, "")
+
+    def numeric(new, old=None):
+        values = _column(chunk, new)
+        if old is not None:
+            values = values.where(is_pair, _column(chunk, old))
+        return pd.to_numeric(values, errors="coerce").astype("Float64").round().astype("Int8")
+
+    sessions = pd.DataFrame({
+        "user_id": _column(chunk, "user_id").to_numpy(),
+        "condA": condA.replace("", None).to_numpy(),
+        "condB": condB.replace("", None).to_numpy(),
+        "age_group": _column(chunk, "age_group").replace("", None).to_numpy(),
+        "n_selected_viewpoints": [
+            len(v.split(",")) if isinstance(v, str) and v else 0
+            for v in _column(chunk, "selected_viewpoints")
+        ],
+        "sat_A": numeric("sat_A", "satisfaction").to_numpy(),
+        "favor_A": numeric("favor_A", "favor").to_numpy(),
+        "sat_B": numeric("sat_B").to_numpy(),
+        "favor_B": numeric("favor_B").to_numpy(),
+        "match_A": numeric("match_A", "match").to_numpy(),
+        "ab_choice": _choice_codes(_column(chunk, "ab_choice"), AB_CHOICES),
+        "match_compare": _choice_codes(_column(chunk, "match_compare"), MATCH_CHOICES),
+        "accept_compare": _choice_codes(_column(chunk, "accept_compare"), ACCEPT_CHOICES),
+        "timestamp": pd.to_datetime(_column(chunk, "timestamp"), errors="coerce").to_numpy(),
+    })
+    sessions = sessions.astype(SESSION_COLUMNS)
+
+    feedback, recs, excluded, prefs, questions = [], [], [], [], []
+    records = zip(
+        sessions["user_id"], condA, condB,
+        _column(chunk, "spot_feedback"), _column(chunk, "spot_questions"),
+        _column(chunk, "recA"), _column(chunk, "recB"),
+        _column(chunk, "excludedA"), _column(chunk, "excludedB"),
+        _column(chunk, "user_pref_A"), _column(chunk, "user_pref_B"),
+    )
+    for user_id, ca, cb, fb, sq, rec_a, rec_b, exc_a, exc_b, pref_a, pref_b in records:
+        for position, (spot, value) in enumerate(load_json(fb, {}).items(), start=1):
+            for vp in (value or {}).get("viewpoints", []):
+                feedback.append((user_id, position, spot, vp))
+
+        for spot, answers in load_json(sq, {}).items():
+            for question, answer in (answers or {}).items():
+                questions.append((user_id, spot, question, str(answer)))
+
+        for arm, cond, rec, exc, pref in (("A", ca, rec_a, exc_a, pref_a), ("B", cb, rec_b, exc_b, pref_b)):
+            for rank, r in enumerate(load_json(rec, []), start=1):
+                recs.append((user_id, arm, cond, rank, r.get("スポット"), r.get("スコア")))
+            for e in load_json(exc, []):
+                excluded.append((user_id, arm, cond, e.get("スポット"), e.get("順位")))
+            for rank, p in enumerate(load_json(pref, []), start=1):
+                prefs.append((user_id, arm, cond, rank, p.get("観点"), p.get("総合スコア"), p.get("興味あり")))
+
+    return {
+        "sessions": sessions,
+        "spot_feedback": _typed(feedback, "spot_feedback"),
+        "recommendations": _typed(recs, "recommendations"),
+        "excluded": _typed(excluded, "excluded"),
+        "preferences": _typed(prefs, "preferences"),
+        "spot_questions": _typed(questions, "spot_questions"),
+    }
+
+
+# ============================
+# 条件ごとの集計（件数・和・二乗和だけを持つ）
+# ============================
+class ConditionAggregates:
+    # チャンクを足し込むだけなので、ログの長さによらずメモリは条件数ぶん
+    #   per_condition: (条件, 指標) → [n, Σx, Σx²]。sat / favor は A/B の各条件に振り分ける
+    #                  （旧形式の match は条件ごとの値なので condA に入る）
+    #   per_pair:      (条件ペア, 指標) → 1..5 の度数（ab_choice / match_compare / accept_compare）
+
+    def __init__(self):
+        self.sessions = 0
+        self.per_condition = {}
+        self.per_pair = {}
+
+    def _add(self, condition, metric, values):
+        values = values.dropna().astype(float)
+        if condition is None or pd.isna(condition) or len(values) == 0:
+            return
+        acc = self.per_condition.setdefault((condition, metric), [0, 0.0, 0.0])
+        acc[0] += len(values)
+        acc[1] += float(values.sum())
+        acc[2] += float((values ** 2).sum())
+
+    def update(self, sessions):
+        self.sessions += len(sessions)
+        for arm in ("A", "B"):
+            cond = sessions[f"cond{arm}"].astype(object)
+            for column, metric in (("sat", "satisfaction"), ("favor", "favor"), ("match", "match")):
+                if f"{column}_{arm}" not in sessions:
+                    continue
+                for condition, values in sessions[f"{column}_{arm}"].groupby(cond, observed=True):
+                    self._add(condition, metric, values)
+
+        pair = (sessions["condA"].astype(object) + "|" + sessions["condB"].astype(object)).dropna()
+        for metric in ("ab_choice", "match_compare", "accept_compare"):
+            values = sessions.loc[pair.index, metric]
+            for p, v in values.groupby(pair):
+                counts = np.bincount(v.dropna().astype(int), minlength=6)[1:6]
+                acc = self.per_pair.setdefault((p, metric), np.zeros(5, dtype=np.int64))
+                acc += counts
+
+    def summary(self):
+        rows = []
+        for (condition, metric), (n, s, sq) in sorted(self.per_condition.items()):
+            mean = s / n
+            var = max(0.0, sq / n - mean ** 2) * n / (n - 1) if n > 1 else float("nan")
+            rows.append({"condition": condition, "metric": metric, "n": n, "mean": mean, "std": var ** 0.5})
+        per_condition = pd.DataFrame(rows, columns=["condition", "metric", "n", "mean", "std"])
+
+        rows = []
+        for (p, metric), counts in sorted(self.per_pair.items()):
+            n = int(counts.sum())
+            mean = float((counts * np.arange(1, 6)).sum() / n) if n else float("nan")
+            rows.append({"condition_pair": p, "metric": metric, "n": n, "mean": mean,
+                         **{f"choice_{i}": int(c) for i, c in enumerate(counts, start=1)}})
+        per_pair = pd.DataFrame(
+            rows,
+            columns=["condition_pair", "metric", "n", "mean"] + [f"choice_{i}" for i in range(1, 6)]
+        )
+        return per_condition, per_pair
+
+
+# ============================
+# ストリーミング処理
+# ============================
+def iter_log_tables(log_path, chunksize=1000):
+    # ログを chunksize 行ずつ読み、平坦化した表を返すジェネレータ
+    reader = pd.read_csv(log_path, dtype=str, keep_default_na=False, chunksize=chunksize)
+    for chunk in reader:
+        yield flatten_chunk(chunk)
+
+
+def process_log(log_path, out_dir=None, chunksize=1000):
+    # 全チャンクを集計し、out_dir があれば表ごとの CSV に追記していく
+    # 返り値: (条件ごとの集計, 条件ペアごとの選択分布)
+    aggregates = ConditionAggregates()
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    written = set()
+
+    for tables in iter_log_tables(log_path, chunksize=chunksize):
+        aggregates.update(tables["sessions"])
+        if not out_dir:
+            continue
+        for name, df in tables.items():
+            path = os.path.join(out_dir, f"{name}.csv")
+            df.to_csv(path, mode="a" if name in written else "w", header=name not in written, index=False)
+            written.add(name)
+
+    return aggregates.summary()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="実験ログの JSON 列を表に展開し、条件ごとに集計する")
+    parser.add_argument("log", nargs="?", default="experiment_log.csv")
+    parser.add_argument("--out-dir", default=None, help="展開した表（CSV）の出力先")
+    parser.add_argument("--chunksize", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    per_condition, per_pair = process_log(args.log, out_dir=args.out_dir, chunksize=args.chunksize)
+    print(per_condition.to_string(index=False))
+    if len(per_pair):
+        print()
+        print(per_pair.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
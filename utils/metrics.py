@@ -0,0 +1,285 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# 秒単位のバケット上限（Prometheus の既定値に近いもの）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# ============================
+# ヒストグラム・カウンタ
+# ============================
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最後は +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total, out = 0, []
+        for n in self.counts:
+            total += n
+            out.append(total)
+        return out
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class MetricsRegistry:
+    # 名前 + ラベルごとの処理時間ヒストグラム（秒）と呼び出し回数をプロセス内で集計する
+    #   histograms: 名前 → {ラベル → Histogram}
+    #   counters:   名前 → {ラベル → 回数}
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, name, seconds, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram(self.buckets)
+            series[key].observe(seconds)
+
+    def inc(self, name, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    @contextmanager
+    def timer(self, name, **labels):
+        # 例外（st.rerun / st.stop を含む）で抜けても記録する
+        t0 = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            labels = dict(labels, outcome=type(e).__name__)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+            self.inc(f"{name}_calls", **labels)
+
+    def timed(self, name):
+        # 関数デコレータ版の timer
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.counters = {}
+
+    # ----------------------------
+    # 書き出し
+    # ----------------------------
+    def snapshot(self):
+        with self._lock:
+            return {
+                "histograms": {
+                    name: [
+                        {
+                            "labels": dict(key),
+                            "count": h.count,
+                            "sum": h.sum,
+                            "buckets": dict(zip([str(b) for b in h.buckets] + ["+Inf"], h.cumulative())),
+                        }
+                        for key, h in series.items()
+                    ]
+                    for name, series in self.histograms.items()
+                },
+                "counters": {
+                    name: [{"labels": dict(key), "value": v} for key, v in series.items()]
+                    for name, series in self.counters.items()
+                },
+            }
+
+    def to_prometheus(self, prefix="app_"):
+        def fmt(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.histograms.items()):
+                metric = f"{prefix}{name}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                for key, h in series.items():
+                    for bound, n in zip([str(b) for b in h.buckets] + ["+Inf"], h.cumulative()):
+                        lines.append(f"{metric}_bucket{fmt(key, [('le', bound)])} {n}")
+                    lines.append(f"{metric}_sum{fmt(key)} {h.sum}")
+                    lines.append(f"{metric}_count{fmt(key)} {h.count}")
+            for name, series in sorted(self.counters.items()):
+                metric = f"{prefix}{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for key, v in series.items():
+                    lines.append(f"{metric}{fmt(key)} {v}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        # 拡張子 .json なら JSON、それ以外は Prometheus のテキスト形式
+        if path.endswith(".json"):
+            text = json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+        else:
+            text = self.to_prometheus()
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+
+# プロセス内で共有する集計
+metrics = MetricsRegistry()
+timed = metrics.timed
+
+
+# ============================
+# 書き出し先（ファイル / HTTP）
+# ============================
+_exporter_lock = threading.Lock()
+_exporters = {}
+
+
+def start_file_exporter(path, interval=10.0, registry=metrics):
+    # interval 秒ごとに path へ書き出すスレッドを 1 つだけ立てる
+    with _exporter_lock:
+        if ("file", path) in _exporters:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    registry.write(path)
+                except OSError:
+                    pass  # 次の周期でまた書く
+
+        thread = threading.Thread(target=run, name="metrics-file", daemon=True)
+        thread.start()
+        _exporters[("file", path)] = thread
+
+
+def start_http_exporter(port, host="127.0.0.1", registry=metrics):
+    # GET /metrics で Prometheus のテキスト形式を返す
+    with _exporter_lock:
+        if ("http", port) in _exporters:
+            return _exporters[("http", port)]
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        _exporters[("http", port)] = server
+        return server
+
+
+def configure_from_env():
+    # METRICS_FILE=metrics.prom（または .json） / METRICS_PORT=9100 で書き出しを有効にする
+    path = os.environ.get("METRICS_FILE")
+    if path:
+        start_file_exporter(path, float(os.environ.get("METRICS_INTERVAL", "10")))
+    port = os.environ.get("METRICS_PORT")
+    if port:
+        start_http_exporter(int(port))
+
+
+# ============================
+# サンプリングプロファイラ（1 回の再実行ごと）
+# ============================
+class SamplingProfiler:
+    # 対象スレッドのスタックを interval 秒ごとに取り、
+    # flamegraph.pl / speedscope が読める折りたたみ形式（"a;b;c 回数"）で書き出す
+    # 標準ライブラリだけで動き、計測対象のコードには手を入れない
+
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, n in self.samples.most_common():
+                f.write(f"{stack} {n}\n")
+
+
+@contextmanager
+def profile_rerun(out_dir=None, label="rerun"):
+    # PROFILE_DIR が設定されているときだけ、ブロックの実行中をサンプリングして
+    # out_dir/<時刻>-<label>.folded に書き出す
+    out_dir = out_dir or os.environ.get("PROFILE_DIR")
+    if not out_dir:
+        yield
+        return
+
+    profiler = SamplingProfiler(float(os.environ.get("PROFILE_INTERVAL", "0.005")))
+    profiler.start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        os.makedirs(out_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S") + f"-{int(time.time() * 1000) % 1000:03d}"
+        profiler.write(os.path.join(out_dir, f"{stamp}-{label}.folded"))
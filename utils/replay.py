@@ -0,0 +1,142 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from utils.log_cells import load_json, split_list
+from utils.scoring import CONDITION_NAMES, compute_conditions, get_score_index
+
+
+# ============================
+# ログ1行の解析
+# ============================
+def parse_log_row(row):
+    # save_log の形式（condition_pair / recA / recB）と
+    # 旧形式（condition のみ）の両方を読む
+    logged = {}
+    pair = row.get("condition_pair")
+    if isinstance(pair, str) and "|" in pair:
+        condA, condB = pair.split("|")
+        logged[condA] = load_json(row.get("recA"), None)
+        logged[condB] = load_json(row.get("recB"), None)
+    elif isinstance(row.get("condition"), str):
+        logged[row["condition"]] = None
+
+    return {
+        "user_id": row.get("user_id", ""),
+        "selected_viewpoints": split_list(row.get("selected_viewpoints")),
+        "visited_spots": split_list(row.get("visited_spots")),
+        "spot_feedback": load_json(row.get("spot_feedback"), {}),
+        "logged": logged,
+    }
+
+
+# ============================
+# ワーカー（プロセスごとにカタログを 1 回だけ読む）
+# ============================
+_worker_index = None
+
+def _init_worker(scores_path):
+    global _worker_index
+    _worker_index = get_score_index(pd.read_csv(scores_path))
+
+
+def _replay_one(args):
+    row_no, session = args
+    results = []
+
+    # 4 条件を共通の中間結果からまとめて計算する
+    try:
+        computed = compute_conditions(
+            session["visited_spots"],
+            session["spot_feedback"],
+            _worker_index,
+            session["selected_viewpoints"],
+            CONDITION_NAMES
+        )
+        error = None
+    except (KeyError, ValueError) as e:
+        computed, error = {}, f"{type(e).__name__}: {e}"
+
+    for condition in CONDITION_NAMES:
+        record = {
+            "row": row_no,
+            "user_id": session["user_id"],
+            "condition": condition,
+            "logged": condition in session["logged"],
+        }
+        if error is not None:
+            record["error"] = error
+            results.append(record)
+            continue
+
+        _, rec, excluded = computed[condition]
+        replay_spots = list(rec["スポット"])
+        record["replay_spots"] = ",".join(replay_spots)
+        record["excluded"] = json.dumps(excluded, ensure_ascii=False)
+
+        # --- ログに残っている推薦との差分 ---
+        logged_rec = session["logged"].get(condition)
+        if logged_rec is not None:
+            logged_spots = [r["スポット"] for r in logged_rec]
+            record["logged_spots"] = ",".join(logged_spots)
+            record["same_order"] = logged_spots == replay_spots
+            record["added"] = ",".join(s for s in replay_spots if s not in logged_spots)
+            record["removed"] = ",".join(s for s in logged_spots if s not in replay_spots)
+
+        results.append(record)
+
+    return results
+
+
+# ============================
+# リプレイ本体
+# ============================
+def replay_log(log_path, scores_path="data/spot_scores.csv", workers=None):
+    log = pd.read_csv(log_path, dtype=str, keep_default_na=False)
+    sessions = [
+        (row_no, parse_log_row(row))
+        for row_no, row in enumerate(log.to_dict(orient="records"), start=1)
+    ]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(scores_path,)
+    ) as pool:
+        chunks = pool.map(_replay_one, sessions, chunksize=max(1, len(sessions) // (workers * 4)))
+        records = [r for chunk in chunks for r in chunk]
+
+    columns = [
+        "row", "user_id", "condition", "logged", "same_order",
+        "added", "removed", "logged_spots", "replay_spots", "excluded", "error"
+    ]
+    return pd.DataFrame(records).reindex(columns=columns)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="experiment_log.csv の全セッションを全条件で再計算し、ログとの差分を出力する"
+    )
+    parser.add_argument("log", nargs="?", default="experiment_log.csv")
+    parser.add_argument("--scores", default="data/spot_scores.csv")
+    parser.add_argument("--out", default="replay_diff.csv")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    diff = replay_log(args.log, scores_path=args.scores, workers=args.workers)
+    diff.to_csv(args.out, index=False)
+
+    compared = diff[diff["same_order"].notna()]
+    changed = int((compared["same_order"] == False).sum())
+    print(f"{diff['row'].nunique()} sessions, {len(diff)} results, "
+          f"{len(compared)} compared with log, {changed} changed -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,12 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
 import pandas as pd
 import numpy as np
 
+from utils.metrics import metrics, timed
+
 # ============================
 # min-max 正規化（方法2用）
 # ============================
@@ -11,12 +17,236 @@ def minmax(s: pd.Series):
     return (s - s.min()) / (s.max() - s.min())
 
 
+# ============================
+# 行列化ヘルパー
+# ============================
+def normalized_matrix(df, viewpoint_cols):
+    # (n_spots × n_viewpoints) の min-max 正規化済み行列
+    # 定数列は minmax() と同じく 1.0 にする
+    X = df[viewpoint_cols].to_numpy(dtype=float)
+    col_min = X.min(axis=0)
+    col_max = X.max(axis=0)
+    span = col_max - col_min
+    constant = span == 0
+    norm = (X - col_min) / np.where(constant, 1.0, span)
+    norm[:, constant] = 1.0
+    return norm
+
+
+def reciprocal_rank_matrix(norm):
+    # 観光地内順位の逆数（1/rank）
+    # rank(method="first", ascending=False) と同じく、同値は列順で先を上位とする
+    n_spots, n_views = norm.shape
+    order = np.argsort(-norm, axis=1, kind="stable")
+    ranks = np.empty_like(order)
+    ranks[np.arange(n_spots)[:, None], order] = np.arange(1, n_views + 1)
+    return 1.0 / ranks
+
+
+# ============================
+# スコア索引（カタログごとに 1 回だけ構築）
+# ============================
+class ScoreIndex:
+    # spot_scores から導出したデータをまとめて保持する（読み取り専用）
+    #   norm:        min-max 正規化済み行列 (n_spots × n_viewpoints)
+    #   recip_rank:  観光地内順位の逆数（1/rank）
+    #   contrib:     norm × recip_rank（推薦スコアの寄与）
+    #   order:       観光地ごとの観点インデックス（順位順）
+    #   top5:        観光地ごとの上位5観点（集合、遅延構築）
+    #   spot_to_row: スポット名 → 行番号（同名があれば先頭の行）
+    #   viewpoint_lists(): 観点ごとの contrib 降順リスト（遅延構築）
+
+    def __init__(self, spot_scores, version=None):
+        self.viewpoint_cols = [c for c in spot_scores.columns if c != "スポット"]
+        self.spots = spot_scores["スポット"].to_numpy()
+        self.version = version if version is not None else catalog_version(spot_scores)
+
+        self.norm = normalized_matrix(spot_scores, self.viewpoint_cols)
+        self.recip_rank = reciprocal_rank_matrix(self.norm)
+        self.contrib = self.norm * self.recip_rank
+        self.order = np.argsort(-self.norm, axis=1, kind="stable")
+
+        self.spot_to_row = {}
+        self._duplicate_rows = {}
+        for i, spot in enumerate(self.spots):
+            if spot in self.spot_to_row:
+                self._duplicate_rows.setdefault(spot, [self.spot_to_row[spot]]).append(i)
+            else:
+                self.spot_to_row[spot] = i
+
+        self._viewpoint_lists = None
+        self._top5 = None
+
+        # 共有されるので書き換え不可にしておく
+        for arr in (self.spots, self.norm, self.recip_rank, self.contrib, self.order):
+            arr.flags.writeable = False
+
+    def row(self, spot):
+        return self.spot_to_row[spot]
+
+    @property
+    def top5(self):
+        if self._top5 is None:
+            self._top5 = [
+                frozenset(self.viewpoint_cols[j] for j in row[:5])
+                for row in self.order
+            ]
+        return self._top5
+
+    def spot_mask(self, spots):
+        # 指定スポット（同名の行はすべて）を True にしたマスク
+        mask = np.zeros(len(self.spots), dtype=bool)
+        for spot in spots:
+            if spot in self._duplicate_rows:
+                mask[self._duplicate_rows[spot]] = True
+            elif spot in self.spot_to_row:
+                mask[self.spot_to_row[spot]] = True
+        return mask
+
+    def viewpoint_lists(self):
+        # 観点ごとに contrib 降順に並べた行番号と値 (n_viewpoints × n_spots)
+        # threshold_top_k で使うときに初めて作る
+        if self._viewpoint_lists is None:
+            order = np.argsort(-self.contrib.T, axis=1, kind="stable")
+            values = np.take_along_axis(self.contrib.T, order, axis=1)
+            order.flags.writeable = False
+            values.flags.writeable = False
+            self._viewpoint_lists = (order, values)
+        return self._viewpoint_lists
+
+    def norm_frame(self):
+        # 表示用に正規化済みスコアを DataFrame で返す
+        df = pd.DataFrame(self.norm, columns=self.viewpoint_cols)
+        df.insert(0, "スポット", self.spots)
+        return df
+
+
+def catalog_version(spot_scores):
+    # カタログ内容のハッシュ（列名 + 値）
+    # バイナリカタログ由来の DataFrame はビルド時のバージョンを持っている
+    if "catalog_version" in spot_scores.attrs:
+        return spot_scores.attrs["catalog_version"]
+
+    h = hashlib.sha1()
+    h.update("\x1f".join(map(str, spot_scores.columns)).encode("utf-8"))
+    h.update(pd.util.hash_pandas_object(spot_scores, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+_score_index_cache = {}
+
+def get_score_index(spot_scores):
+    # カタログのバージョンごとに ScoreIndex を 1 つだけ作って共有する
+    # load_all が返す共有 DataFrame（書き換えない前提）は同じオブジェクトなら再ハッシュしない
+    if isinstance(spot_scores, ScoreIndex):
+        return spot_scores
+
+    cached = _score_index_cache.get("frame")
+    if cached is not None and cached[0] is spot_scores:
+        return cached[1]
+
+    version = catalog_version(spot_scores)
+    index = _score_index_cache.get(version)
+    if index is None:
+        index = ScoreIndex(spot_scores, version=version)
+        _score_index_cache.clear()
+        _score_index_cache[version] = index
+    _score_index_cache["frame"] = (spot_scores, index)
+    return index
+
+
 # ============================
 # ユーザー嗜好推定
 # ============================
-from collections import defaultdict
-import pandas as pd
+BOOST_RATE = 1.2
+
+def _top5_mask(index, rows, excluded_cols=None):
+    # 各行（観光地）の上位5観点を True にした (len(rows) × n_viewpoints) マスク
+    # excluded_cols が True の観点は飛ばして次の順位から取る
+    order = index.order[rows]
+    allowed = np.ones(order.shape, dtype=bool)
+    if excluded_cols is not None:
+        allowed = ~excluded_cols[order]
+    keep = allowed & (np.cumsum(allowed, axis=1) <= 5)
+
+    mask = np.zeros(order.shape, dtype=bool)
+    mask[np.nonzero(keep)[0], order[keep]] = True
+    return mask
+
+
+CONDITION_NAMES = ("noaspect_all", "aspect_all", "aspect_top5", "aspect_exclude_interest_top5")
 
+
+def _visited_inputs(index, visited_spots, spot_feedback):
+    # visited_spots の行番号と、良かった観点（spot_feedback）の (行 × 観点) マスク
+    unknown = [spot for spot in visited_spots if spot not in index.spot_to_row]
+    if unknown:
+        raise ValueError(f"Unknown spot: {', '.join(unknown)}")
+
+    col_pos = {v: j for j, v in enumerate(index.viewpoint_cols)}
+    rows = np.array([index.spot_to_row[spot] for spot in visited_spots], dtype=int)
+
+    good = np.zeros((len(rows), len(col_pos)), dtype=bool)
+    for r, spot in enumerate(visited_spots):
+        for v in spot_feedback.get(spot, {}).get("viewpoints", []):
+            if v in col_pos:
+                good[r, col_pos[v]] = True
+    return rows, good
+
+
+def _use_mask(index, rows, good, condition, selected_viewpoints):
+    # 観点ごとの加算判定
+    if condition == "aspect_top5":
+        return _top5_mask(index, rows) | good
+    if condition == "aspect_exclude_interest_top5":
+        interest = np.isin(index.viewpoint_cols, list(selected_viewpoints))
+        return _top5_mask(index, rows, excluded_cols=interest) | good
+    return np.ones(good.shape, dtype=bool)  # noaspect_all / aspect_all
+
+
+def _argsort_desc(values):
+    # pandas の sort_values(ascending=False) と同じ並び（同点の扱いも同じ）
+    idx = np.arange(len(values))[::-1]
+    return idx[values[::-1].argsort(kind="quicksort")][::-1]
+
+
+def _preference_arrays(use, totals):
+    # 嗜好の (観点列番号, 総合スコア) を総合スコアの降順で返す
+    # 観点は最初に加算された順（観光地順 → 観点列順）に並べてから降順ソート
+    used_cols = np.flatnonzero(use.any(axis=0))
+    if len(used_cols):
+        first_row = use[:, used_cols].argmax(axis=0)
+        used_cols = used_cols[np.lexsort((used_cols, first_row))]
+    values = totals[used_cols].astype(float)
+    order = _argsort_desc(values)
+    return used_cols[order], values[order]
+
+
+def _preference_frame(index, cols, values, selected_viewpoints):
+    names = [index.viewpoint_cols[j] for j in cols]
+    return pd.DataFrame({
+        "観点": names,
+        "総合スコア": values,
+        "興味あり": [1 if v in selected_viewpoints else 0 for v in names]
+    })
+
+
+def _preference_weights(cols, values, condition, selected_viewpoints, viewpoint_cols):
+    # weight_vector と同じ重みベクトルを、嗜好の配列から DataFrame を作らずに求める
+    w = np.zeros(len(viewpoint_cols))
+    if condition == "noaspect_all":
+        return np.ones(len(viewpoint_cols))
+    if condition == "aspect_exclude_interest_top5":
+        keep = ~np.isin(cols, [j for j, v in enumerate(viewpoint_cols) if v in selected_viewpoints])
+        cols, values = cols[keep], values[keep]
+    if condition in ("aspect_top5", "aspect_exclude_interest_top5"):
+        top = _argsort_desc(values)[:5]
+        cols, values = cols[top], values[top]
+    w[cols] = values
+    return w
+
+
+@timed("compute_user_preference")
 def compute_user_preference(
     visited_spots,
     spot_feedback,
@@ -25,174 +255,604 @@ def compute_user_preference(
     condition
 ):
     # ============================
-    # 観点列
+    # 共有のスコア索引（正規化・順位は構築済み）
     # ============================
-    viewpoint_cols = [c for c in df.columns if c != "スポット"]
+    index = get_score_index(df)
+
+    if condition not in CONDITION_NAMES:
+        raise ValueError("Unknown condition")
 
     # ============================
-    # min-max 正規化
+    # visited_spots の行と良かった観点
     # ============================
-    df_norm = df.copy()
-    for col in viewpoint_cols:
-        df_norm[col] = minmax(df_norm[col])
+    rows, good = _visited_inputs(index, visited_spots, spot_feedback)
 
     # ============================
-    # 観点スコア初期化
+    # 観点ごとの加算判定
     # ============================
-    aspect_scores = defaultdict(float)
-    boost_rate = 1.2
+    use = _use_mask(index, rows, good, condition, selected_viewpoints)
 
     # ============================
-    # 各 visited_spot を独立に処理
+    # スコア計算（正規化スコア × 1/rank、良かった観点はブースト）
     # ============================
-    for spot in visited_spots:
-        row = df_norm[df_norm["スポット"] == spot].iloc[0]
-        good_viewpoints = spot_feedback.get(spot, {}).get("viewpoints", [])
+    score = index.contrib[rows]
+    if condition != "noaspect_all":
+        score = np.where(good, score * BOOST_RATE, score)
+    totals = np.where(use, score, 0.0).sum(axis=0)
 
-        # 観光地内順位（1位が1）
-        ranks = row[viewpoint_cols].rank(ascending=False, method="first")
+    # ============================
+    # 結果整形
+    # ============================
+    cols, values = _preference_arrays(use, totals)
+    return _preference_frame(index, cols, values, selected_viewpoints)
 
-        # --- spot-local top5 ---
-        if condition == "aspect_top5":
-            spot_top = set(
-                ranks.sort_values().head(5).index
-            )
+# ============================
+# 上位k件選択（全体ソートをしない）
+# ============================
+def top_k_rows(scores, k, exclude=None):
+    # スコア降順の上位 k 行（同点は行番号の小さい方を上位とする）
+    # exclude が True の行は候補から外す
+    if k <= 0:
+        return np.empty(0, dtype=int)
+    candidates = np.arange(len(scores))
+    if exclude is not None:
+        candidates = candidates[~exclude]
+    if k < len(candidates):
+        part = np.argpartition(-scores[candidates], k - 1)[:k]
+        # 境界の同点を行番号順で取り直す
+        kth = scores[candidates[part]].min()
+        candidates = np.concatenate([
+            candidates[scores[candidates] > kth],
+            candidates[scores[candidates] == kth]
+        ])
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order][:k]
+
+
+def count_ahead(scores, score_rows, probe_scores, probe_rows):
+    # probe（スコア, 行番号）より上位に並ぶ行の数。順位 = この数 + 1
+    #   上位 = スコアが高い、または同点で行番号が小さい（top_k_rows の並びと同じ）
+    #   probe と同じ行は数えない（別の行列積で出したスコアが 1 ulp ずれても自分を数えない）
+    # scores / score_rows: (..., n)、probe_scores / probe_rows: (..., m) → (..., m)
+    scores = np.asarray(scores)[..., None, :]
+    score_rows = np.asarray(score_rows)
+    s = np.asarray(probe_scores)[..., :, None]
+    r = np.asarray(probe_rows)[..., :, None]
+    ahead = ((scores > s) | ((scores == s) & (score_rows < r))) & (score_rows != r)
+    return np.count_nonzero(ahead, axis=-1)
+
+
+def rank_of_rows(scores, rows):
+    # 指定行の全体順位（1始まり）を O(n) で求める
+    rows = np.asarray(rows, dtype=int)
+    if len(rows) == 0:
+        return np.empty(0, dtype=int)
+    return count_ahead(scores, np.arange(len(scores)), scores[rows], rows) + 1
+
+
+def estimate_rank_of_rows(index, w, rows, sample_size=4096):
+    # rank_of_rows の近似。全行をスコア計算せず、等間隔に間引いた行（最大 sample_size 行）の
+    # 中での順位を間引き幅ぶん掛け戻す。行数が sample_size 以下なら全行を数えるので一致する
+    rows = np.asarray(rows, dtype=int)
+    if len(rows) == 0:
+        return np.empty(0, dtype=int)
+    n_spots = len(index.spots)
+    step = max(1, -(-n_spots // sample_size))
+    if step == 1:
+        return rank_of_rows(index.contrib @ w, rows)
+
+    # 間引いた行と指定行のスコアを 1 回の行列積で出し、指定行のスコアもそこから読む
+    pool_rows = np.union1d(np.arange(0, n_spots, step), rows)
+    scores = index.contrib[pool_rows] @ w
+    sampled = pool_rows % step == 0
+    s = scores[np.searchsorted(pool_rows, rows)]
+    ahead = count_ahead(scores[sampled], pool_rows[sampled], s, rows)
+    return np.minimum(step * ahead + 1, n_spots)
 
-        elif condition == "aspect_exclude_interest_top5":
-            filtered = ranks.drop(selected_viewpoints, errors="ignore")
-            spot_top = set(
-                filtered.sort_values().head(5).index
-            )
 
-        else:
-            spot_top = None  # noaspect_all / aspect_all
+# ============================
+# 推薦用の重みベクトル
+# ============================
+def weight_vector(user_pref_df, condition, selected_viewpoints, viewpoint_cols):
+    # 条件ごとの観点集合 V を決め、V 以外は 0 の重みベクトルを返す
+    weights = user_pref_df.set_index("観点")["総合スコア"]
+
+    # --- 観点集合 ---
+    if condition == "aspect_top5":
+        V = set(weights.sort_values(ascending=False).head(5).index)
+    elif condition == "aspect_exclude_interest_top5":
+        weights_wo_interest = weights.drop(selected_viewpoints, errors="ignore")
+        V = set(weights_wo_interest.sort_values(ascending=False).head(5).index)
+    elif condition == "aspect_all":
+        V = set(weights.index)
+    elif condition == "noaspect_all":
+        return np.ones(len(viewpoint_cols))
+    else:
+        raise ValueError("Unknown condition")
 
-        # ============================
-        # 観点ごとの加算判定
-        # ============================
-        for v in viewpoint_cols:
-            use_flag = False
+    return np.array([weights[v] if v in V else 0.0 for v in viewpoint_cols])
 
-            if condition == "noaspect_all":
-                use_flag = True
 
-            elif condition == "aspect_all":
-                use_flag = True
+def _rank_results(index, scores, visited_spots, top_k, rows=None):
+    # スコアから (上位 top_k 件の DataFrame, 除外スポットの記録) を作る
+    # rows を渡した場合、scores は rows（昇順）の行だけのスコア
+    if rows is None:
+        rows = np.arange(len(index.spots))
+
+    # ============================
+    # ★ visited_spots の除外マスク
+    # ============================
+    visited_mask = index.spot_mask(visited_spots)[rows]
 
-            elif condition in ["aspect_top5", "aspect_exclude_interest_top5"]:
-                if v in spot_top or v in good_viewpoints:
-                    use_flag = True
+    # ============================
+    # ★ 除外スポットの記録（全体順位）
+    # ============================
+    excluded_pos = np.flatnonzero(visited_mask)
+    excluded_ranks = rank_of_rows(scores, excluded_pos)
+    excluded = [
+        {"スポット": index.spots[rows[p]], "順位": int(r)}
+        for r, p in sorted(zip(excluded_ranks, excluded_pos))
+    ]
+
+    # --- 上位 top_k 件 ---
+    top = top_k_rows(scores, top_k, exclude=visited_mask)
+    df_rec = pd.DataFrame(
+        {"スポット": index.spots[rows[top]], "スコア": scores[top]},
+        index=rows[top]
+    )
 
-            if not use_flag:
-                continue
+    return df_rec, excluded
 
-            # --- スコア計算 ---
-            base = row[v]
-            rank_factor = 1.0 / ranks[v]
-            score = base * rank_factor
 
-            if condition != "noaspect_all" and v in good_viewpoints:
-                score *= boost_rate
+def _rank_results_stacked(index, S, visited_mask, top_k):
+    # _rank_results を (行 × n_spots) のスコアに一度に適用する
+    # visited_mask: 訪問済みマスク。(n_spots,) なら全行で共通、(行 × n_spots) なら行ごと
+    # 返り値: [(上位 top_k 件の DataFrame, 除外スポットの記録), ...]
+    shared = np.ndim(visited_mask) == 1
+    visited_mask = np.broadcast_to(visited_mask, S.shape)
+    n_visited = np.count_nonzero(visited_mask, axis=1)
+    if top_k <= 0 or top_k >= S.shape[1] - n_visited.max():
+        return [_rank_results(index, s, index.spots[m], top_k) for s, m in zip(S, visited_mask)]
 
-            aspect_scores[v] += score
+    # --- 除外スポットの全体順位（行ごとの訪問行を左詰めにして一度に数える） ---
+    if shared:
+        probe_rows = np.tile(np.flatnonzero(visited_mask[0]), (len(S), 1))
+    else:
+        hit, excluded_rows = np.nonzero(visited_mask)
+        pos = np.arange(len(hit)) - np.repeat(np.cumsum(n_visited) - n_visited, n_visited)
+        probe_rows = np.zeros((len(S), n_visited.max()), dtype=int)
+        probe_rows[hit, pos] = excluded_rows
+    probe_scores = np.take_along_axis(S, probe_rows, axis=1)
+    ranks = count_ahead(S, np.arange(S.shape[1]), probe_scores, probe_rows) + 1
+
+    # --- 上位 top_k 件 ---
+    masked = np.where(visited_mask, -np.inf, S)
+    top = np.argpartition(-masked, top_k - 1, axis=1)[:, :top_k]
+    kth = np.take_along_axis(masked, top, axis=1).min(axis=1)
+    n_candidates = np.count_nonzero(masked >= kth[:, None], axis=1)
+    for i in np.flatnonzero(n_candidates > top_k):
+        # 境界の同点が余る行だけ、同点を行番号の小さい方から取り直す
+        candidates = np.flatnonzero(masked[i] >= kth[i])
+        top[i] = candidates[np.lexsort((candidates, -S[i, candidates]))][:top_k]
+    top_scores = np.take_along_axis(S, top, axis=1)
+    by_score = np.lexsort((top, -top_scores), axis=1)
+    top = np.take_along_axis(top, by_score, axis=1)
+    top_scores = np.take_along_axis(top_scores, by_score, axis=1)
+    top_spots = index.spots[top]
+
+    # --- 除外記録は (順位, 行番号) 順。左詰めの余りは末尾に回す ---
+    padded = np.arange(probe_rows.shape[1]) >= n_visited[:, None]
+    by_rank = np.lexsort((probe_rows, np.where(padded, S.shape[1] + 1, ranks)), axis=1)
+    ranks = np.take_along_axis(ranks, by_rank, axis=1).tolist()
+    excluded_spots = index.spots[np.take_along_axis(probe_rows, by_rank, axis=1)].tolist()
+
+    return [
+        (
+            pd.DataFrame({"スポット": spots, "スコア": scores}, index=rows),
+            [{"スポット": s, "順位": r} for s, r in zip(ex_spots[:n], ex_ranks[:n])]
+        )
+        for rows, spots, scores, ex_spots, ex_ranks, n in zip(
+            top, top_spots, top_scores, excluded_spots, ranks, n_visited
+        )
+    ]
 
-    # ============================
-    # 結果整形
-    # ============================
-    aspect_scores = pd.Series(aspect_scores).sort_values(ascending=False)
 
-    result = pd.DataFrame({
-        "観点": aspect_scores.index,
-        "総合スコア": aspect_scores.values,
-        "興味あり": [1 if v in selected_viewpoints else 0 for v in aspect_scores.index]
-    }).reset_index(drop=True)
+# ============================
+# しきい値アルゴリズム（Fagin の TA）による上位k件
+# ============================
+def threshold_top_k(index, w, k, exclude=None, block=256, max_block=4096):
+    # 重み w の非ゼロ観点のリストだけを先頭からたどり、正確な上位 k 件が
+    # 確定したところで打ち切る。返り値は (上位 k 行, そのスコア)
+    #   深さ d まで見たとき、見ていない行のスコア ≤ しきい値 T(d) = Σ w_v × (各リストの d 番目の値)
+    #   なので、上位 k 件の最小スコア > T になればそれ以上たどらなくてよい
+    # T は深さについて単調に減るので、止まれる深さを二分探索で求め、そこまで（最大 max_block）を
+    # まとめて読む。読むたびに k 件目のスコアが上がり、止まれる深さは手前に寄っていく
+    n_spots = len(index.spots)
+    if exclude is None:
+        exclude = np.zeros(n_spots, dtype=bool)
+
+    V = np.flatnonzero(w)
+    if len(V) == 0:
+        scores = index.contrib @ w
+        rows = top_k_rows(scores, k, exclude=exclude)
+        return rows, scores[rows]
+
+    order, values = index.viewpoint_lists()  # V の行だけを毎回切り出す（丸ごとコピーしない）
+    wV = w[V]
+
+    def threshold(depth):
+        return (values[V, depth - 1] @ wV) * (1 + 1e-12)  # 丸め誤差の分だけ安全側に
+
+    seen = exclude.copy()  # 除外行は候補にしない
+    pool_rows = np.empty(0, dtype=np.int64)
+    pool_scores = np.empty(0)
+    kth = -np.inf
+    depth, end = 0, min(n_spots, block)
+    while True:
+        new_rows = order[V, depth:end].ravel()
+        new_rows = new_rows[~seen[new_rows]]
+        if len(new_rows):
+            # 重複除去はソートせずマスクで（行番号順にもなる）
+            fresh = np.zeros(n_spots, dtype=bool)
+            fresh[new_rows] = True
+            new_rows = np.flatnonzero(fresh)
+            seen[new_rows] = True
+            new_scores = index.contrib[new_rows[:, None], V] @ wV
+            pool_rows = np.concatenate([pool_rows, new_rows])
+            pool_scores = np.concatenate([pool_scores, new_scores])
+            if len(pool_scores) >= k:
+                kth = np.partition(pool_scores, len(pool_scores) - k)[len(pool_scores) - k]
+                keep = pool_scores >= kth  # 同点は行番号で決めるので残す
+                pool_rows, pool_scores = pool_rows[keep], pool_scores[keep]
+
+        depth = end
+        if depth >= n_spots or kth > threshold(depth):
+            break
+
+        # --- kth > T(d) となる最小の深さ d（無ければ末尾）を二分探索 ---
+        lo, hi = depth, n_spots
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if kth > threshold(mid):
+                hi = mid
+            else:
+                lo = mid + 1
+        end = min(lo, depth + max_block, n_spots)
+
+    order_by_row = np.argsort(pool_rows, kind="stable")
+    rows, scores = pool_rows[order_by_row], pool_scores[order_by_row]
+    top = top_k_rows(scores, k)
+    return rows[top], scores[top]
+
+
+# ============================
+# 多様性を考慮した並べ替え（MMR）
+# ============================
+def mmr_rerank(index, rows, scores, k, lambda_=0.7):
+    # rows / scores: スコア降順の候補プール。返り値は選んだ候補のプール内の位置（選んだ順）
+    #   MMR = λ × 関連度 − (1 − λ) × 選択済みの観光地との最大コサイン類似度
+    # 関連度はプール内で min-max して [0, 1] に揃え、類似度は正規化済みスコア（norm）のベクトルで測る
+    # norm は全要素が 0 以上でどのスポットも似た向きになるため、プール内の観点ごとの平均を引いてから比べる
+    # 類似度行列はプール分を 1 回で作り、ループは選ぶ件数（k 回）だけ
+    rows = np.asarray(rows, dtype=int)
+    scores = np.asarray(scores, dtype=float)
+    k = min(k, len(rows))
+    if k <= 0:
+        return np.empty(0, dtype=int)
+
+    vectors = index.norm[rows]
+    vectors = vectors - vectors.mean(axis=0)
+    lengths = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = vectors / np.where(lengths == 0, 1.0, lengths)
+    sim = unit @ unit.T
+
+    span = scores.max() - scores.min()
+    relevance = (scores - scores.min()) / span if span > 0 else np.ones(len(scores))
+
+    max_sim = np.zeros(len(rows))
+    available = np.ones(len(rows), dtype=bool)
+    picked = np.empty(k, dtype=int)
+    for n in range(k):
+        mmr = np.where(available, lambda_ * relevance - (1 - lambda_) * max_sim, -np.inf)
+        i = int(np.argmax(mmr))  # 同点はプールの前（スコアの高い方）
+        picked[n] = i
+        available[i] = False
+        np.maximum(max_sim, sim[i], out=max_sim)
+    return picked
+
+
+def _mmr_fetch(top_k, mmr_lambda, mmr_pool):
+    # MMR を使うときに並べ替えの前に取っておく件数
+    return top_k if mmr_lambda is None else max(top_k, mmr_pool)
+
+
+def _apply_mmr(index, df_rec, top_k, mmr_lambda):
+    # 候補プール（スコア降順の df_rec）から MMR で top_k 件を選ぶ（かかった時間は mmr_rerank として記録）
+    if mmr_lambda is None:
+        return df_rec
+    with metrics.timer("mmr_rerank", pool=len(df_rec)):
+        picked = mmr_rerank(
+            index, df_rec.index.to_numpy(), df_rec["スコア"].to_numpy(), top_k, mmr_lambda
+        )
+        return df_rec.iloc[picked]
 
-    return result
 
 # ============================
 # スポット推薦
 # ============================
+@timed("recommend_spots")
 def recommend_spots(
     user_pref_df,
     spot_scores,
     condition,
     selected_viewpoints,
-    visited_spots=None
+    visited_spots=None,
+    top_k=10,
+    retrieval="exact",
+    n_probe=8,
+    mmr_lambda=None,
+    mmr_pool=50,
+    exact_excluded_ranks=False
 ):
+    # retrieval="threshold" のとき、観点を 5 つに絞る条件では
+    # 観点別リストのしきい値アルゴリズムで全件を見ずに同じ上位 top_k 件を返す
+    # retrieval="approximate" のとき、IVF 索引（utils.ann）の上位 n_probe 分割だけを見る
+    # この 2 つでは除外スポットの全体順位を間引いた行から推定する（estimate_rank_of_rows。
+    # 小さいカタログでは正確）。exact_excluded_ranks=True なら全件を数えて正確に出す
+    # mmr_lambda を指定すると、上位 mmr_pool 件から MMR で top_k 件を選び直す（1.0 で並べ替えなし）
     if visited_spots is None:
         visited_spots = []
+    n_fetch = _mmr_fetch(top_k, mmr_lambda, mmr_pool)
+
+    # --- 共有のスコア索引（min-max 正規化 × 観点順位の逆数） ---
+    index = get_score_index(spot_scores)
+
+    # --- ユーザ嗜好重み（V 以外は 0） ---
+    w = weight_vector(user_pref_df, condition, selected_viewpoints, index.viewpoint_cols)
+
+    # --- スコア計算 ---
+    if retrieval == "approximate" or (
+        retrieval == "threshold" and condition in ("aspect_top5", "aspect_exclude_interest_top5")
+    ):
+        visited_mask = index.spot_mask(visited_spots)
+        if retrieval == "approximate":
+            from utils.ann import get_approx_index
+            rows, row_scores = get_approx_index(index).search(
+                w, n_fetch, n_probe=n_probe, exclude=visited_mask
+            )
+        else:
+            rows, row_scores = threshold_top_k(index, w, n_fetch, exclude=visited_mask)
+        df_rec = pd.DataFrame(
+            {"スポット": index.spots[rows], "スコア": row_scores},
+            index=rows
+        )
+        excluded_rows = np.flatnonzero(visited_mask)
+        if len(excluded_rows) == 0:
+            ranks = []
+        elif exact_excluded_ranks:
+            ranks = rank_of_rows(index.contrib @ w, excluded_rows)
+        else:
+            ranks = estimate_rank_of_rows(index, w, excluded_rows)
+        excluded = [
+            {"スポット": index.spots[i], "順位": int(r)}
+            for r, i in sorted(zip(ranks, excluded_rows))
+        ]
+    elif retrieval in ("exact", "threshold"):
+        scores = index.contrib @ w
+        df_rec, excluded = _rank_results(index, scores, visited_spots, n_fetch)
+    else:
+        raise ValueError("Unknown retrieval")
 
-    viewpoint_cols = [c for c in spot_scores.columns if c != "スポット"]
-
-    # --- min-max 正規化 ---
-    df_norm = spot_scores.copy()
-    for col in viewpoint_cols:
-        df_norm[col] = minmax(df_norm[col])
-
-    # ============================ 
-    # ② 観点順位の逆数（1/rank）を計算 
-    # ============================ 
-    rank_df = df_norm.copy() 
-    for idx, row in df_norm.iterrows():
-        ranks = row[viewpoint_cols].rank(method="first", ascending=False)
-        rank_df.loc[idx, viewpoint_cols] = 1.0 / ranks
-    
-    # --- ユーザ嗜好重み ---
-    weights = user_pref_df.set_index("観点")["総合スコア"]
+    # --- 多様性を考慮した並べ替え ---
+    return _apply_mmr(index, df_rec, top_k, mmr_lambda), excluded
 
-    # --- 観点集合 ---
-    if condition == "aspect_top5":
-        V = set(weights.sort_values(ascending=False).head(5).index)
-    elif condition == "aspect_exclude_interest_top5":
-        weights_wo_interest = weights.drop(selected_viewpoints, errors="ignore")
-        V = set(weights_wo_interest.sort_values(ascending=False).head(5).index)
-    elif condition == "aspect_all":
-        V = set(weights.index)
-    elif condition == "noaspect_all":
-        results = []
-        for idx, row in df_norm.iterrows():
-            spot = row["スポット"]
-            score = 0.0
-            for v in viewpoint_cols:
-                base = row[v]
-                rank_factor = rank_df.loc[idx, v]
-                score += base * rank_factor
-            results.append({"スポット": spot, "スコア": score})
-    
-        df_all = pd.DataFrame(results).sort_values("スコア", ascending=False)
-    else:
+
+# ============================
+# 複数ユーザの一括推薦
+# ============================
+def recommend_batch(users, spot_scores, condition, top_k=10):
+    # users: [{"visited_spots", "spot_feedback", "selected_viewpoints"}, ...]
+    # 返り値: (嗜好 DataFrame のリスト, 推薦 DataFrame のリスト, 除外記録のリスト)
+    # 嗜好と重みは DataFrame を経由せず配列のまま作り、全員分を 1 回の行列積でスコア計算する
+    index = get_score_index(spot_scores)
+    if condition not in CONDITION_NAMES:
         raise ValueError("Unknown condition")
+    if not users:
+        return [], [], []
+
+    # --- 参加者ごとの嗜好（観点列番号, 総合スコア）と (N × 観点) の重み行列 ---
+    prefs = []
+    W = np.empty((len(users), len(index.viewpoint_cols)))
+    for i, u in enumerate(users):
+        selected = u.get("selected_viewpoints", [])
+        rows, good = _visited_inputs(index, u["visited_spots"], u.get("spot_feedback", {}))
+        use = _use_mask(index, rows, good, condition, selected)
+        score = index.contrib[rows]
+        if condition != "noaspect_all":
+            score = np.where(good, score * BOOST_RATE, score)
+        cols, values = _preference_arrays(use, np.where(use, score, 0.0).sum(axis=0))
+        prefs.append(_preference_frame(index, cols, values, selected))
+        W[i] = _preference_weights(cols, values, condition, selected, index.viewpoint_cols)
+
+    # --- (N × 観点)·(観点 × n_spots) を 1 回で計算し、全員分をまとめて順位付け ---
+    S = W @ index.contrib.T
+    visited_mask = np.stack([index.spot_mask(u["visited_spots"]) for u in users])
+    ranked = _rank_results_stacked(index, S, visited_mask, top_k)
+
+    return prefs, [rec for rec, _ in ranked], [exc for _, exc in ranked]
 
-    # --- スコア計算（元コードそのまま） ---
-    if condition != "noaspect_all":
-        results = []
-        for idx, row in df_norm.iterrows():
-            spot = row["スポット"]
-            score = 0.0
-            for v in V:
-                base = row[v]
-                rank_factor = rank_df.loc[idx, v]
-                weight = weights[v]
-                
-                score += weight * base * rank_factor
-            results.append({"スポット": spot, "スコア": score})
-
-        df_all = pd.DataFrame(results).sort_values("スコア", ascending=False)
 
-    # ============================
-    # ★ 除外スポットの記録（追加）
-    # ============================
-    excluded = []
-    for rank, (_, row) in enumerate(df_all.iterrows(), start=1):
-        if row["スポット"] in visited_spots:
-            excluded.append({"スポット": row["スポット"], "順位": rank})
+# ============================
+# 複数条件の一括計算（1 人分）
+# ============================
+@timed("compute_conditions")
+def compute_conditions(
+    visited_spots,
+    spot_feedback,
+    spot_scores,
+    selected_viewpoints,
+    conditions=CONDITION_NAMES,
+    top_k=10,
+    mmr_lambda=None,
+    mmr_pool=50
+):
+    # 条件によらない中間結果（訪問行・良かった観点・ブースト後のスコア）を 1 回だけ作り、
+    # 条件ごとの嗜好・重みを積み重ねて全観光地のスコアを 1 回の行列積で出す
+    # 順位付け・上位 k 件・出力の組み立ても (条件 × n_spots) で 1 回にまとめるが、
+    # 条件ごとに全観光地分のスコアを見る分（O(n)）は条件数に比例して増える
+    # 返り値: {condition: (嗜好 DataFrame, 推薦 DataFrame, 除外記録)}
+    # compute_user_preference → recommend_spots を条件ごとに（mmr_lambda / mmr_pool も同じで）
+    # 呼んだ結果と同じ
+    index = get_score_index(spot_scores)
+    conditions = list(dict.fromkeys(conditions))
+    if any(c not in CONDITION_NAMES for c in conditions):
+        raise ValueError("Unknown condition")
+    if not conditions:
+        return {}
 
-    # ============================
-    # ★ visited_spots を除外（追加）
-    # ============================
-    df_filtered = df_all[~df_all["スポット"].isin(visited_spots)]
+    # --- 条件によらない中間結果 ---
+    rows, good = _visited_inputs(index, visited_spots, spot_feedback)
+    plain = index.contrib[rows]
+    boosted = np.where(good, plain * BOOST_RATE, plain)
 
-    # --- 上位10件を返す ---
-    df_rec = df_filtered.head(10)
+    # --- (条件 × 訪問行 × 観点) の加算マスク → (条件 × 観点) の合計 ---
+    uses = np.stack([_use_mask(index, rows, good, c, selected_viewpoints) for c in conditions])
+    scores = np.stack([plain if c == "noaspect_all" else boosted for c in conditions])
+    totals = np.where(uses, scores, 0.0).sum(axis=1)
 
-    return df_rec, excluded
+    prefs = [_preference_arrays(use, t) for use, t in zip(uses, totals)]
+
+    # --- (条件 × 観点)·(観点 × n_spots) を 1 回で計算 ---
+    W = np.vstack([
+        _preference_weights(cols, values, c, selected_viewpoints, index.viewpoint_cols)
+        for (cols, values), c in zip(prefs, conditions)
+    ])
+    S = W @ index.contrib.T
+
+    ranked = _rank_results_stacked(
+        index, S, index.spot_mask(visited_spots), _mmr_fetch(top_k, mmr_lambda, mmr_pool)
+    )
+
+    results = {}
+    for c, (cols, values), (rec, excluded) in zip(conditions, prefs, ranked):
+        rec = _apply_mmr(index, rec, top_k, mmr_lambda)
+        results[c] = (_preference_frame(index, cols, values, selected_viewpoints), rec, excluded)
+    return results
+
+
+# ============================
+# Step 2 の計算結果キャッシュ（LRU）
+# ============================
+class ResultCache:
+    # 参加者の入力 + カタログのバージョンをキーに (嗜好, 推薦, 除外) を保持する
+    # 返す DataFrame は呼び出し側で書き換えられるのでコピーを渡す
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(
+        catalog_version, condition, visited_spots, spot_feedback, selected_viewpoints,
+        mmr_lambda=None, mmr_pool=50
+    ):
+        canonical = json.dumps({
+            "catalog": catalog_version,
+            "condition": condition,
+            "mmr": None if mmr_lambda is None else [float(mmr_lambda), int(mmr_pool)],
+            "visited_spots": list(visited_spots),  # 順序は結果に影響する
+            "spot_feedback": {
+                spot: sorted(fb.get("viewpoints", []))
+                for spot, fb in spot_feedback.items()
+            },
+            "selected_viewpoints": sorted(selected_viewpoints),
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+
+result_cache = ResultCache()
+
+
+def _copy_result(result):
+    user_pref, rec, excluded = result
+    return user_pref.copy(), rec.copy(), [dict(e) for e in excluded]
+
+
+def compute_condition_results(
+    visited_spots,
+    spot_feedback,
+    spot_scores,
+    selected_viewpoints,
+    conditions,
+    cache=result_cache,
+    mmr_lambda=None,
+    mmr_pool=50
+):
+    # 条件ごとにキャッシュを見て、無い条件だけ compute_conditions でまとめて計算する
+    # 返り値は conditions と同じ順の [(嗜好, 推薦, 除外), ...]
+    index = get_score_index(spot_scores)
+    keys = {
+        c: cache.make_key(
+            index.version, c, visited_spots, spot_feedback, selected_viewpoints,
+            mmr_lambda=mmr_lambda, mmr_pool=mmr_pool
+        )
+        for c in conditions
+    }
+
+    results = {}
+    for c, key in keys.items():
+        cached = cache.get(key)
+        if cached is not None:
+            results[c] = cached
+
+    missing = [c for c in keys if c not in results]
+    if missing:
+        computed = compute_conditions(
+            visited_spots, spot_feedback, index, selected_viewpoints, missing,
+            mmr_lambda=mmr_lambda, mmr_pool=mmr_pool
+        )
+        for c, result in computed.items():
+            cache.put(keys[c], result)
+            results[c] = result
+
+    return [_copy_result(results[c]) for c in conditions]
+
+
+def compute_condition_result(
+    visited_spots,
+    spot_feedback,
+    spot_scores,
+    selected_viewpoints,
+    condition,
+    cache=result_cache,
+    mmr_lambda=None,
+    mmr_pool=50
+):
+    # 1 条件分の (嗜好, 推薦, 除外) をキャッシュ付きで計算する
+    return compute_condition_results(
+        visited_spots, spot_feedback, spot_scores, selected_viewpoints, [condition], cache=cache,
+        mmr_lambda=mmr_lambda, mmr_pool=mmr_pool
+    )[0]
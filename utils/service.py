@@ -0,0 +1,441 @@
+import argparse
+import asyncio
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pandas as pd
+
+from utils.scoring import (
+    CONDITION_NAMES,
+    catalog_version,
+    compute_condition_result,
+    compute_condition_results,
+    compute_user_preference,
+    get_score_index,
+)
+
+
+# ============================
+# リクエストの検証と計算（JSON ⇔ DataFrame）
+# ============================
+def _is_str_list(value):
+    return isinstance(value, list) and all(isinstance(v, str) for v in value)
+
+
+def parse_request(request, batch=False):
+    # {"condition", "selected_viewpoints", "visited_spots", "spot_feedback"} を検証して返す
+    # batch=True のときは condition の代わりに "conditions"（条件名のリスト）を受け取る
+    if not isinstance(request, dict):
+        raise ValueError("Request body must be a JSON object")
+
+    def str_list(name):
+        value = request.get(name, [])
+        if not _is_str_list(value):
+            raise ValueError(f"{name} must be a list of strings")
+        return value
+
+    spot_feedback = request.get("spot_feedback", {})
+    if not isinstance(spot_feedback, dict):
+        raise ValueError("spot_feedback must be an object")
+    for fb in spot_feedback.values():
+        if fb is not None and not isinstance(fb, dict):
+            raise ValueError("spot_feedback values must be objects")
+        if not _is_str_list((fb or {}).get("viewpoints", [])):
+            raise ValueError("spot_feedback viewpoints must be a list of strings")
+    spot_feedback = {
+        spot: {"viewpoints": list((fb or {}).get("viewpoints", []))}
+        for spot, fb in spot_feedback.items()
+    }
+
+    # MMR による多様性の並べ替え（省略時はしない）
+    mmr_lambda = request.get("mmr_lambda")
+    mmr_pool = request.get("mmr_pool", 50)
+    if mmr_lambda is not None and (
+        isinstance(mmr_lambda, bool) or not isinstance(mmr_lambda, (int, float))
+        or not 0 <= mmr_lambda <= 1
+    ):
+        raise ValueError("mmr_lambda must be a number between 0 and 1")
+    if isinstance(mmr_pool, bool) or not isinstance(mmr_pool, int) or mmr_pool < 1:
+        raise ValueError("mmr_pool must be a positive integer")
+
+    parsed = {
+        "selected_viewpoints": str_list("selected_viewpoints"),
+        "visited_spots": str_list("visited_spots"),
+        "spot_feedback": spot_feedback,
+        "mmr_lambda": mmr_lambda,
+        "mmr_pool": mmr_pool,
+    }
+    if batch:
+        conditions = request.get("conditions")
+        if not _is_str_list(conditions) or not conditions:
+            raise ValueError("conditions must be a non-empty list of strings")
+        if any(c not in CONDITION_NAMES for c in conditions):
+            raise ValueError("Unknown condition")
+        parsed["conditions"] = conditions
+    else:
+        condition = request.get("condition")
+        if condition not in CONDITION_NAMES:
+            raise ValueError("Unknown condition")
+        parsed["condition"] = condition
+    return parsed
+
+
+def _pref_records(user_pref):
+    return [
+        {"観点": r["観点"], "総合スコア": float(r["総合スコア"]), "興味あり": int(r["興味あり"])}
+        for r in user_pref.to_dict(orient="records")
+    ]
+
+
+def _result_payload(result):
+    user_pref, rec, excluded = result
+    return {
+        "preference": _pref_records(user_pref),
+        "recommendations": [
+            {"row": int(row), "スポット": spot, "スコア": float(score)}
+            for row, spot, score in zip(rec.index, rec["スポット"], rec["スコア"])
+        ],
+        "excluded": excluded,
+    }
+
+
+def run_request(index, kind, request):
+    # kind: "preference" / "recommend" / "recommend_batch"。返り値は JSON にそのまま出せる dict
+    # recommend_batch は複数条件をキャッシュ + 一括計算（compute_condition_results）で返す
+    if kind == "recommend_batch":
+        req = parse_request(request, batch=True)
+        results = compute_condition_results(
+            req["visited_spots"], req["spot_feedback"], index,
+            req["selected_viewpoints"], req["conditions"],
+            mmr_lambda=req["mmr_lambda"], mmr_pool=req["mmr_pool"]
+        )
+        return {
+            "catalog_version": index.version,
+            "results": [
+                dict(condition=c, **_result_payload(result))
+                for c, result in zip(req["conditions"], results)
+            ],
+        }
+
+    req = parse_request(request)
+    response = {"condition": req["condition"], "catalog_version": index.version}
+
+    if kind == "preference":
+        user_pref = compute_user_preference(
+            req["visited_spots"], req["spot_feedback"], index,
+            req["selected_viewpoints"], req["condition"]
+        )
+        response["preference"] = _pref_records(user_pref)
+        return response
+
+    if kind == "recommend":
+        response.update(_result_payload(compute_condition_result(
+            req["visited_spots"], req["spot_feedback"], index,
+            req["selected_viewpoints"], req["condition"],
+            mmr_lambda=req["mmr_lambda"], mmr_pool=req["mmr_pool"]
+        )))
+        return response
+
+    raise ValueError(f"Unknown request: {kind}")
+
+
+def result_from_response(response):
+    # run_request("recommend") の結果 → compute_condition_result と同じ (嗜好, 推薦, 除外)
+    user_pref = pd.DataFrame(response["preference"], columns=["観点", "総合スコア", "興味あり"])
+    recs = response["recommendations"]
+    rec = pd.DataFrame(
+        {"スポット": [r["スポット"] for r in recs], "スコア": [r["スコア"] for r in recs]},
+        index=[r["row"] for r in recs]
+    )
+    return user_pref, rec, [dict(e) for e in response["excluded"]]
+
+
+# ============================
+# ワーカー（プロセスごとにカタログを 1 回だけ持つ）
+# ============================
+_worker_index = None
+
+def _init_worker(spot_scores):
+    global _worker_index
+    _worker_index = get_score_index(spot_scores)
+
+
+def _worker_call(kind, request):
+    return run_request(_worker_index, kind, request)
+
+
+class RecommenderService:
+    # 共有カタログ 1 つ + CPU を使う計算用のワーカープール
+    #   workers > 0: プロセスプール（各プロセスが起動時にカタログを受け取る）
+    #   workers = 0: 同じプロセスのスレッド 1 本（テストや小規模用）
+    # async の a* メソッドはイベントループを止めずにワーカーへ投げる
+
+    def __init__(self, spot_scores=None, workers=None):
+        if spot_scores is None:
+            from utils.load_data import load_all
+            _, _, spot_scores = load_all()
+        self.index = get_score_index(spot_scores)
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self._spot_scores = spot_scores
+        self._executor = None
+        self._executor_version = None
+        self._lock = threading.Lock()
+
+    def _worker_frame(self):
+        # ワーカーに渡すカタログ。attrs["catalog_version"] で元の版を名乗らせる
+        if isinstance(self._spot_scores, pd.DataFrame):
+            return self._spot_scores
+        if hasattr(self.index, "to_frame"):
+            return self.index.to_frame()  # 生スコア + その時点の版
+        frame = self.index.norm_frame()  # 索引しか無い場合は正規化済みを渡す
+        frame.attrs["catalog_version"] = self.index.version
+        return frame
+
+    def _pool(self):
+        with self._lock:
+            if (
+                self._executor is not None and self.workers > 0
+                and self._executor_version != self.index.version
+            ):
+                # カタログが更新された（IncrementalCatalog）ので新しい版でワーカーを作り直す
+                # 計算中の問い合わせは古い版のまま終わらせる
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            if self._executor is None:
+                if self.workers > 0:
+                    frame = self._worker_frame()
+                    self._executor_version = catalog_version(frame)
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        initializer=_init_worker,
+                        initargs=(frame,)
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=1)
+            return self._executor
+
+    # --- 同期（プロセス内で直接呼ぶ） ---
+    def preference(self, request):
+        return run_request(self.index, "preference", request)
+
+    def recommend(self, request):
+        return run_request(self.index, "recommend", request)
+
+    # --- 非同期（ワーカーで計算） ---
+    async def _submit(self, kind, request):
+        loop = asyncio.get_running_loop()
+        if self.workers > 0:
+            return await loop.run_in_executor(self._pool(), _worker_call, kind, request)
+        return await loop.run_in_executor(self._pool(), run_request, self.index, kind, request)
+
+    async def apreference(self, request):
+        return await self._submit("preference", request)
+
+    async def arecommend(self, request):
+        return await self._submit("recommend", request)
+
+    async def arecommend_batch(self, request):
+        return await self._submit("recommend_batch", request)
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+# ============================
+# ASGI アプリ（フレームワークなしで uvicorn などから動く）
+# ============================
+class RecommenderApp:
+    # GET  /health               → {"status": "ok", "catalog_version", "conditions"}
+    # POST /preference           → 嗜好推定
+    # POST /recommend            → 嗜好推定 + 推薦 + 除外スポットの順位
+    # POST /recommend_batch      → 複数条件（"conditions"）の /recommend をまとめて
+    # 入力の誤りは 400、未知のパスは 404
+
+    routes = {
+        "/preference": "preference",
+        "/recommend": "recommend",
+        "/recommend_batch": "recommend_batch",
+    }
+
+    def __init__(self, service):
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        method, path = scope["method"], scope["path"]
+        if path == "/health" and method == "GET":
+            await self._respond(send, 200, {
+                "status": "ok",
+                "catalog_version": self.service.index.version,
+                "conditions": list(CONDITION_NAMES),
+            })
+            return
+        if path not in self.routes:
+            await self._respond(send, 404, {"error": "Not found"})
+            return
+        if method != "POST":
+            await self._respond(send, 405, {"error": "Method not allowed"})
+            return
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        try:
+            request = json.loads(body or b"{}")
+            kind = self.routes[path]
+            if kind == "preference":
+                response = await self.service.apreference(request)
+            elif kind == "recommend_batch":
+                response = await self.service.arecommend_batch(request)
+            else:
+                response = await self.service.arecommend(request)
+        except (ValueError, KeyError) as e:
+            await self._respond(send, 400, {"error": str(e)})
+            return
+        await self._respond(send, 200, response)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.service.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    async def _respond(send, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json; charset=utf-8"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def create_app(spot_scores=None, workers=None):
+    return RecommenderApp(RecommenderService(spot_scores, workers=workers))
+
+
+# ============================
+# Streamlit などから使う窓口（HTTP / プロセス内）
+# ============================
+class RemoteRecommender:
+    def __init__(self, base_url, timeout=10.0, mmr_lambda=None, mmr_pool=50):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.mmr = {} if mmr_lambda is None else {"mmr_lambda": mmr_lambda, "mmr_pool": mmr_pool}
+
+    def _post(self, path, payload):
+        req = urllib.request.Request(
+            self.base_url + path,
+            data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as res:
+                return json.loads(res.read())
+        except urllib.error.HTTPError as e:
+            if e.code == 400:
+                raise ValueError(json.loads(e.read()).get("error", "Bad request"))
+            raise
+
+    def condition_result(self, visited_spots, spot_feedback, selected_viewpoints, condition):
+        return result_from_response(self._post("/recommend", {
+            "condition": condition,
+            "visited_spots": list(visited_spots),
+            "spot_feedback": spot_feedback,
+            "selected_viewpoints": list(selected_viewpoints),
+            **self.mmr,
+        }))
+
+    def condition_results(self, visited_spots, spot_feedback, selected_viewpoints, conditions):
+        # 1 回の呼び出しで、サーバ側のキャッシュと複数条件の一括計算を使う
+        response = self._post("/recommend_batch", {
+            "conditions": list(conditions),
+            "visited_spots": list(visited_spots),
+            "spot_feedback": spot_feedback,
+            "selected_viewpoints": list(selected_viewpoints),
+            **self.mmr,
+        })
+        return [result_from_response(r) for r in response["results"]]
+
+
+class LocalRecommender:
+    def __init__(self, spot_scores, mmr_lambda=None, mmr_pool=50):
+        self.index = get_score_index(spot_scores)
+        self.mmr = {"mmr_lambda": mmr_lambda, "mmr_pool": mmr_pool}
+
+    def condition_result(self, visited_spots, spot_feedback, selected_viewpoints, condition):
+        return compute_condition_result(
+            visited_spots, spot_feedback, self.index, selected_viewpoints, condition, **self.mmr
+        )
+
+    def condition_results(self, visited_spots, spot_feedback, selected_viewpoints, conditions):
+        # 複数条件は共通の中間結果を 1 回だけ作ってまとめて計算する
+        return compute_condition_results(
+            visited_spots, spot_feedback, self.index, selected_viewpoints, conditions, **self.mmr
+        )
+
+
+def get_recommender(spot_scores):
+    # RECOMMENDER_URL があればそのサービスに問い合わせ、無ければプロセス内で計算する
+    # MMR_LAMBDA（0〜1）を設定すると推薦リストを MMR で並べ替える（候補数は MMR_POOL、既定 50）
+    try:
+        mmr_lambda = float(os.environ["MMR_LAMBDA"]) if os.environ.get("MMR_LAMBDA") else None
+        mmr_pool = int(os.environ.get("MMR_POOL", "50"))
+    except ValueError:
+        raise ValueError("MMR_LAMBDA and MMR_POOL must be numbers")
+    if mmr_lambda is not None and not 0 <= mmr_lambda <= 1:
+        raise ValueError("MMR_LAMBDA must be a number between 0 and 1")
+    if mmr_pool < 1:
+        raise ValueError("MMR_POOL must be a positive integer")
+    mmr = {"mmr_lambda": mmr_lambda, "mmr_pool": mmr_pool}
+    url = os.environ.get("RECOMMENDER_URL")
+    if url:
+        return RemoteRecommender(url, **mmr)
+    return LocalRecommender(spot_scores, **mmr)
+
+
+# ============================
+# CLI: python -m utils.service --port 8000
+# ============================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="推薦 API サーバ（ASGI）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=None, help="計算用プロセス数（0 でスレッド 1 本）")
+    args = parser.parse_args(argv)
+
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("uvicorn が必要です: pip install uvicorn")
+
+    uvicorn.run(create_app(workers=args.workers), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
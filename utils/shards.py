@@ -0,0 +1,200 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from utils.scoring import count_ahead, get_score_index, top_k_rows, weight_vector
+
+
+# ============================
+# 地域ごとのシャード
+# ============================
+class RegionShards:
+    # spot_lists（load_all の地域 → スポット一覧）ごとに
+    #   mask:    全体の行に対する所属マスク
+    #   rows:    所属する行番号（昇順）
+    #   contrib: その行だけの norm × 1/rank（連続メモリのコピー）
+    # を持つ。正規化・順位は全体の ScoreIndex のものをそのまま使うので、
+    # 地域で絞った結果は全体の推薦から地域外を除いたものと同じになる
+
+    def __init__(self, spot_scores, spot_lists):
+        self.index = get_score_index(spot_scores)
+        self.regions = list(spot_lists)
+        self.mask = {}
+        self.rows = {}
+        self.contrib = {}
+        for region, spots in spot_lists.items():
+            mask = self.index.spot_mask(spots)
+            mask.flags.writeable = False
+            rows = np.flatnonzero(mask)
+            contrib = np.ascontiguousarray(self.index.contrib[rows])
+            contrib.flags.writeable = False
+            self.mask[region] = mask
+            self.rows[region] = rows
+            self.contrib[region] = contrib
+
+    def region_mask(self, regions):
+        mask = np.zeros(len(self.index.spots), dtype=bool)
+        for region in regions:
+            mask |= self.mask[region]
+        return mask
+
+    def plan(self, regions):
+        # 複数の地域に載っているスポットは最初の地域だけで数える
+        # 返り値: [(地域, その地域で飛ばす行), ...]
+        if regions is None:
+            regions = self.regions
+        unknown = [r for r in regions if r not in self.mask]
+        if unknown:
+            raise ValueError(f"Unknown region: {', '.join(unknown)}")
+
+        covered = np.zeros(len(self.index.spots), dtype=bool)
+        plan = []
+        for region in dict.fromkeys(regions):
+            rows = self.rows[region]
+            plan.append((region, rows[covered[rows]]))
+            covered[rows] = True
+        return plan
+
+
+_shards_cache = {}
+_shards_lock = threading.Lock()
+
+
+def get_region_shards(spot_scores, spot_lists):
+    # カタログのバージョン + 地域構成ごとに 1 つだけ作って共有する
+    index = get_score_index(spot_scores)
+    key = (index.version, tuple((r, tuple(s)) for r, s in spot_lists.items()))
+    with _shards_lock:
+        shards = _shards_cache.get(key)
+        if shards is None:
+            shards = RegionShards(index, spot_lists)
+            _shards_cache.clear()
+            _shards_cache[key] = shards
+        return shards
+
+
+# ============================
+# シャード 1 つ分の検索
+# ============================
+def _query_shard(rows, contrib, w, k, exclude_rows, skip_rows, probe_rows, probe_scores):
+    # 返り値: (上位 k 行, そのスコア, probe ごとの自分より上位の行の数)
+    #   exclude_rows: 候補から外す行（訪問済み。順位の数え上げには含める）
+    #   skip_rows:    このシャードでは無いものとして扱う行（他の地域で数える重複分）
+    scores = contrib @ w
+    skip = np.isin(rows, skip_rows)
+    exclude = skip | np.isin(rows, exclude_rows)
+
+    top = top_k_rows(scores, k, exclude=exclude)
+
+    ahead = count_ahead(scores[~skip], rows[~skip], probe_scores, probe_rows)
+    return rows[top], scores[top], ahead
+
+
+_worker_shard = None
+
+def _init_shard_worker(rows, contrib):
+    global _worker_shard
+    _worker_shard = (rows, contrib)
+
+
+def _query_worker(w, k, exclude_rows, skip_rows, probe_rows, probe_scores):
+    rows, contrib = _worker_shard
+    return _query_shard(rows, contrib, w, k, exclude_rows, skip_rows, probe_rows, probe_scores)
+
+
+class ShardWorkerPool:
+    # 地域ごとに 1 プロセスを立て、そのシャードの行列だけを持たせる
+    # 問い合わせは対象の地域のプロセスにだけ送り、親で上位 k 件をマージする
+
+    def __init__(self, shards, regions=None):
+        self.shards = shards
+        self.executors = {}
+        for region in regions or shards.regions:
+            self.executors[region] = ProcessPoolExecutor(
+                max_workers=1,
+                initializer=_init_shard_worker,
+                initargs=(shards.rows[region], shards.contrib[region])
+            )
+
+    def map(self, plan, w, k, exclude_rows, probe_rows, probe_scores):
+        futures = [
+            self.executors[region].submit(
+                _query_worker, w, k, exclude_rows, skip_rows, probe_rows, probe_scores
+            )
+            for region, skip_rows in plan
+        ]
+        return [f.result() for f in futures]
+
+    def close(self):
+        for executor in self.executors.values():
+            executor.shutdown()
+        self.executors = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ============================
+# 地域を絞ったスポット推薦
+# ============================
+def recommend_in_regions(
+    user_pref_df,
+    shards,
+    condition,
+    selected_viewpoints,
+    regions=None,
+    visited_spots=None,
+    top_k=10,
+    pool=None
+):
+    # recommend_spots と同じ (推薦 DataFrame, 除外記録) を、regions の地域だけから返す
+    # 除外記録の順位は対象地域の中での順位。regions=None なら全地域
+    # pool（ShardWorkerPool）を渡すと各シャードを別プロセスで計算する
+    if visited_spots is None:
+        visited_spots = []
+    index = shards.index
+    plan = shards.plan(regions)
+
+    # --- ユーザ嗜好重み（V 以外は 0） ---
+    w = weight_vector(user_pref_df, condition, selected_viewpoints, index.viewpoint_cols)
+
+    # --- 対象地域にある訪問済みスポット（順位を数える） ---
+    visited_mask = index.spot_mask(visited_spots)
+    probe_rows = np.flatnonzero(visited_mask & shards.region_mask([r for r, _ in plan]))
+    probe_scores = index.contrib[probe_rows] @ w
+    exclude_rows = np.flatnonzero(visited_mask)
+
+    # --- シャードごとの上位 k 件と数え上げ ---
+    if pool is None:
+        results = [
+            _query_shard(
+                shards.rows[region], shards.contrib[region], w, top_k,
+                exclude_rows, skip_rows, probe_rows, probe_scores
+            )
+            for region, skip_rows in plan
+        ]
+    else:
+        results = pool.map(plan, w, top_k, exclude_rows, probe_rows, probe_scores)
+
+    # --- マージ（同点は行番号の小さい方が上位） ---
+    rows = np.concatenate([r for r, _, _ in results])
+    scores = np.concatenate([s for _, s, _ in results])
+    by_row = np.argsort(rows, kind="stable")
+    rows, scores = rows[by_row], scores[by_row]
+    top = top_k_rows(scores, top_k)
+    df_rec = pd.DataFrame(
+        {"スポット": index.spots[rows[top]], "スコア": scores[top]},
+        index=rows[top]
+    )
+
+    ranks = sum(c for _, _, c in results) + 1 if results else np.ones(len(probe_rows), dtype=int)
+    excluded = [
+        {"スポット": index.spots[i], "順位": int(r)}
+        for r, i in sorted(zip(ranks, probe_rows))
+    ]
+    return df_rec, excluded
@@ -0,0 +1,173 @@
+import threading
+import time
+
+from utils.metrics import metrics
+
+
+SCOPE = ["https://spreadsheets.google.com/feeds",
+         "https://www.googleapis.com/auth/drive"]
+
+
+# ============================
+# テスト用のシート（gspread の Worksheet と同じ呼び方）
+# ============================
+class FakeWorksheet:
+    def __init__(self, values=None, latency=0.0):
+        self.values = [list(r) for r in (values or [])]
+        self.latency = latency  # 1 呼び出しあたりの擬似遅延（秒）
+        self.lock = threading.Lock()
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_all_values(self):
+        self._wait()
+        with self.lock:
+            return [list(r) for r in self.values]
+
+    def row_values(self, row):
+        self._wait()
+        with self.lock:
+            return list(self.values[row - 1]) if len(self.values) >= row else []
+
+    def col_values(self, col):
+        self._wait()
+        with self.lock:
+            return [str(r[col - 1]) for r in self.values if len(r) >= col]
+
+    def update(self, range_name, values):
+        # '1:1' のような行指定だけ扱う
+        self._wait()
+        row = int(range_name.split(":")[0]) - 1
+        with self.lock:
+            while len(self.values) <= row:
+                self.values.append([])
+            self.values[row] = list(values[0])
+
+    def append_row(self, row):
+        self.append_rows([row])
+
+    def append_rows(self, rows):
+        self._wait()
+        with self.lock:
+            self.values.extend(list(r) for r in rows)
+
+
+# ============================
+# 認証済みクライアントの共有
+# ============================
+class SheetsClientProvider:
+    # 認証済みの gspread クライアントとワークシートをプロセス内で使い回す
+    # - トークンの期限（token_lifetime）の refresh_margin 秒前に認証し直す
+    # - 401 が返ったら 1 回だけ認証し直して再試行する
+    # - 認証・シート取得（auth）とデータの読み書き（data）の時間を別々に集計する
+    # opener を渡すと認証せずに opener(sheet_id) のワークシートを使う（テスト用）
+
+    def __init__(self, service_account=None, opener=None, token_lifetime=3600.0, refresh_margin=300.0):
+        self.service_account = service_account
+        self.opener = opener
+        self.token_lifetime = token_lifetime
+        self.refresh_margin = refresh_margin
+
+        self._lock = threading.RLock()
+        self._client = None
+        self._authorized_at = None
+        self._worksheets = {}
+        self.timings = {
+            "auth": {"count": 0, "seconds": 0.0},
+            "data": {"count": 0, "seconds": 0.0},
+        }
+
+    def _record(self, kind, seconds):
+        with self._lock:
+            self.timings[kind]["count"] += 1
+            self.timings[kind]["seconds"] += seconds
+        metrics.observe(f"sheets_{kind}", seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                kind: {
+                    "count": t["count"],
+                    "seconds": t["seconds"],
+                    "mean_ms": t["seconds"] * 1000.0 / t["count"] if t["count"] else 0.0,
+                }
+                for kind, t in self.timings.items()
+            }
+
+    # ----------------------------
+    # 認証
+    # ----------------------------
+    def _needs_refresh(self):
+        if self._client is None:
+            return True
+        return time.time() - self._authorized_at > self.token_lifetime - self.refresh_margin
+
+    def _authorize(self):
+        import gspread
+        from oauth2client.service_account import ServiceAccountCredentials
+
+        t0 = time.perf_counter()
+        creds = ServiceAccountCredentials.from_json_keyfile_dict(self.service_account, SCOPE)
+        self._client = gspread.authorize(creds)
+        self._authorized_at = time.time()
+        self._worksheets = {}
+        self._record("auth", time.perf_counter() - t0)
+
+    def invalidate(self):
+        with self._lock:
+            self._client = None
+            self._worksheets = {}
+
+    def worksheet(self, sheet_id=None):
+        if sheet_id is None:
+            sheet_id = self.service_account["sheet_id"] if self.service_account else None
+
+        with self._lock:
+            if self.opener is not None:
+                if sheet_id not in self._worksheets:
+                    self._worksheets[sheet_id] = self.opener(sheet_id)
+                return self._worksheets[sheet_id]
+
+            if self._needs_refresh():
+                self._authorize()
+            if sheet_id not in self._worksheets:
+                t0 = time.perf_counter()
+                self._worksheets[sheet_id] = self._client.open_by_key(sheet_id).sheet1
+                self._record("auth", time.perf_counter() - t0)
+            return self._worksheets[sheet_id]
+
+    # ----------------------------
+    # データの読み書き
+    # ----------------------------
+    def call(self, method, *args, sheet_id=None, **kwargs):
+        # ワークシートのメソッドを呼び、時間を data として記録する
+        for attempt in range(2):
+            ws = self.worksheet(sheet_id)
+            t0 = time.perf_counter()
+            try:
+                return getattr(ws, method)(*args, **kwargs)
+            except Exception as e:
+                status = getattr(getattr(e, "response", None), "status_code", None)
+                if status != 401 or attempt == 1 or self.opener is not None:
+                    raise
+                self.invalidate()  # トークン切れ：認証し直して再試行
+            finally:
+                self._record("data", time.perf_counter() - t0)
+
+
+# ============================
+# プロセス内で共有するプロバイダ
+# ============================
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_sheets_provider(service_account):
+    # サービスアカウント（client_email）ごとに 1 つだけ作る
+    key = service_account.get("client_email", "")
+    with _providers_lock:
+        if key not in _providers:
+            _providers[key] = SheetsClientProvider(dict(service_account))
+        return _providers[key]
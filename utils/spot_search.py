@@ -0,0 +1,88 @@
+import threading
+import unicodedata
+
+import numpy as np
+
+
+# ひらがな → カタカナ（「れごらんど」でも「レゴランド」に当たるように）
+_HIRA_TO_KATA = {c: c + 0x60 for c in range(ord("ぁ"), ord("ゖ") + 1)}
+
+
+def normalize_name(text):
+    # 全角/半角・大文字/小文字・ひらがな/カタカナの違いを吸収し、空白を除く
+    text = unicodedata.normalize("NFKC", text).casefold().translate(_HIRA_TO_KATA)
+    return "".join(text.split())
+
+
+def _ngrams(text, n):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+# ============================
+# 観光地名の文字 n-gram 索引
+# ============================
+class SpotSearchIndex:
+    # 日本語の名前は単語に区切れないので、文字 1-gram / 2-gram の転置リストで候補を絞り、
+    # 最後に部分文字列かどうかを確かめる
+    #   entries:  (地域, スポット) を spot_lists の順に並べたもの
+    #   postings: n-gram → その n-gram を含む entries の番号（昇順）
+
+    def __init__(self, spot_lists, n=2):
+        self.n = n
+        self.entries = [(region, spot) for region, spots in spot_lists.items() for spot in spots]
+        self.names = [normalize_name(spot) for _, spot in self.entries]
+        self.regions = list(spot_lists)
+        self.region_ids = {
+            region: np.array([i for i, (r, _) in enumerate(self.entries) if r == region], dtype=np.int64)
+            for region in self.regions
+        }
+
+        postings = {}
+        for i, name in enumerate(self.names):
+            for size in range(1, n + 1):
+                for gram in _ngrams(name, size):
+                    postings.setdefault(gram, []).append(i)
+        self.postings = {gram: np.array(ids, dtype=np.int64) for gram, ids in postings.items()}
+
+    def search(self, query="", regions=None):
+        # query を含むスポットの entries 番号（spot_lists の順）
+        if regions is None:
+            ids = np.arange(len(self.entries))
+        else:
+            ids = np.concatenate([self.region_ids[r] for r in regions] + [np.empty(0, dtype=np.int64)])
+            ids.sort()
+
+        q = normalize_name(query)
+        if not q:
+            return ids
+
+        grams = _ngrams(q, min(self.n, len(q)))
+        lists = sorted((self.postings.get(g, np.empty(0, dtype=np.int64)) for g in grams), key=len)
+        for posting in lists:
+            ids = np.intersect1d(ids, posting, assume_unique=True)
+            if len(ids) == 0:
+                return ids
+
+        # n-gram がすべて含まれても順番どおりとは限らないので確認する
+        return np.array([i for i in ids if q in self.names[i]], dtype=np.int64)
+
+    def page(self, ids, page, page_size):
+        # ids のうち page 番目（0 始まり）の (地域, スポット) と総ページ数
+        n_pages = max(1, -(-len(ids) // page_size))
+        page = min(max(page, 0), n_pages - 1)
+        start = page * page_size
+        return [self.entries[i] for i in ids[start:start + page_size]], n_pages
+
+
+_search_index = None
+_search_lock = threading.Lock()
+
+
+def get_spot_search_index(spot_lists):
+    # 同じ spot_lists の間は 1 つだけ作って全セッションで共有する
+    global _search_index
+    key = tuple((r, tuple(s)) for r, s in spot_lists.items())
+    with _search_lock:
+        if _search_index is None or _search_index[0] != key:
+            _search_index = (key, SpotSearchIndex(spot_lists))
+        return _search_index[1]